@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nanobananapro.settings")
 
 application = get_asgi_application()
+
+# Serving process: warm heavy imports, templates and the provider client
+from tools import warmup  # noqa: E402
+
+warmup.start()
@@ -12,13 +12,15 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Load environment variables from .env file
-load_dotenv(BASE_DIR / '.env')
+# Load environment variables from .env file (python-dotenv is only imported
+# when there is a file to load)
+if (BASE_DIR / '.env').exists():
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / '.env')
 
 
 # Quick-start development settings - unsuitable for production
@@ -47,6 +49,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # Serves hashed, precompressed static files with far-future cache headers
+    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # Root span per request (see tools/tracing.py)
+    "tools.tracing.TracingMiddleware",
+    # Gzip for pages and JSON only (see tools/middleware.py)
+    "tools.middleware.TextGZipMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -67,6 +75,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "tools.context_processors.tailwind_css",
             ],
         },
     },
@@ -121,6 +130,38 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = "static/"
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# collectstatic writes content-hashed names plus .gz/.br copies
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
+
+# "coordination" holds locks, job and upload state (see COORDINATION). The
+# local-memory default only works for a single process: serve_prefork with
+# several workers, or several app servers, need a shared cache here (e.g.
+# DatabaseCache after `manage.py createcachetable`) or the redis backend.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "coordination": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "coordination",
+        # Well above the default 300 so in-flight uploads and jobs are not
+        # culled. Entries are small: image bytes (drafts, references) live
+        # under MEDIA_ROOT and only pointers to them are kept here
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+}
+
+# Full-page cache lifetime for the static tool pages, in seconds
+PAGE_CACHE_TIMEOUT = 60 * 15
 
 # Media files (User uploaded/generated files)
 MEDIA_URL = "/media/"
@@ -137,3 +178,149 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 # Set the API key in the environment for SimplerLLM to use
 if GEMINI_API_KEY:
     os.environ['GEMINI_API_KEY'] = GEMINI_API_KEY
+
+# Generation pipeline shared by all API endpoints (see tools/pipeline.py)
+GENERATION_PIPELINE = {
+    # Seconds an identical request is served from the previous result (0 disables)
+    'CACHE_TIMEOUT': 60 * 60,
+    # Concurrent provider calls allowed per process
+    'MAX_CONCURRENT_PROVIDER_CALLS': 8,
+    # Seconds a request waits for a provider slot before failing with 503
+    'THROTTLE_TIMEOUT': 30,
+    # For ?response=bytes|stream requests, store the image in the background
+    # (False skips storing it at all)
+    'WRITE_BEHIND': True,
+    # Worker processes for output post-processing (0 runs it in the request thread)
+    'POSTPROCESS_WORKERS': 2,
+    # Image composited when a request sets watermark=1, and the title font
+    # (None uses DejaVu Sans Bold if installed, else Pillow's built-in font)
+    'WATERMARK_PATH': os.getenv('WATERMARK_PATH') or None,
+    'FONT_PATH': os.getenv('TITLE_FONT_PATH') or None,
+}
+
+# Worker warm-up when a serving entry point loads (see tools/warmup.py)
+WARMUP = {
+    'ENABLED': os.getenv('WARMUP_ENABLED', '1') != '0',
+    # Check Gemini answers a cheap metadata request once the worker is warm
+    # (a startup health check; no connection is kept for later requests)
+    'HEALTH_PROBE': os.getenv('WARMUP_HEALTH_PROBE', '') == '1',
+}
+
+# API keys and per-caller quotas (see tools/quotas.py). Keys are issued with
+# `manage.py create_api_key`; requests without a key get the anonymous limits
+# per client IP unless REQUIRE_API_KEY is set.
+QUOTAS = {
+    'REQUIRE_API_KEY': os.getenv('REQUIRE_API_KEY', '') == '1',
+    'ANONYMOUS_REQUESTS_PER_MINUTE': 10,
+    'ANONYMOUS_MAX_CONCURRENT_JOBS': 2,
+    'ANONYMOUS_DAILY_SPEND_UNITS': 100,
+    # Seconds between batched usage writes to the database
+    'FLUSH_INTERVAL': 10,
+}
+
+# Cross-node coordination: locks, shared result index and job state (see
+# tools/coordination.py). With more than one app server, point BACKEND at
+# 'redis' or make the "coordination" cache above a shared one.
+COORDINATION = {
+    'BACKEND': os.getenv('COORDINATION_BACKEND', 'cache'),
+    'CACHE_ALIAS': 'coordination',
+    'REDIS_URL': os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    # Only needed when the nodes do not share MEDIA_ROOT
+    'REPLICATE_RESULTS': os.getenv('COORDINATION_REPLICATE_RESULTS', '') == '1',
+}
+
+# Priority classes for provider slots (see tools/scheduler.py). Calls from
+# the site's own pages (signed page cookie) are interactive, API keys
+# standard, other keyless callers anonymous; clients may send "X-Priority: bulk" to opt down. Queue stats
+# are served at /api/stats/.
+SCHEDULER = {
+    # Relative share of slots when several classes are queued
+    'WEIGHTS': {'interactive': 8, 'standard': 3, 'anonymous': 2, 'bulk': 1},
+    # Slots only the class itself may use
+    'RESERVATIONS': {'interactive': 2, 'standard': 1, 'anonymous': 0, 'bulk': 0},
+    # Seconds after which a queued request is served regardless of class
+    'STARVATION_TIMEOUT': 30,
+    # Lifetime of the signed cookie that marks page visitors' calls interactive
+    'PAGE_TOKEN_AGE': 24 * 60 * 60,
+}
+
+# Registered reference images (see tools/references.py)
+REFERENCES = {
+    # Longest side of the stored, provider-ready copy
+    'MAX_SIDE': 1536,
+    # Per-process in-memory cache of reference bytes
+    'CACHE_BYTES': 256 * 1024 * 1024,
+    # Seconds a reference stays resolvable on every node
+    'TTL': 7 * 24 * 60 * 60,
+    # Multi-reference composition (sketch, thumbnail): images per request and
+    # combined byte budgets for the uploads and for what reaches the provider
+    'MAX_PER_REQUEST': 6,
+    'MAX_UPLOAD_BYTES': 40 * 1024 * 1024,
+    'MAX_PROVIDER_BYTES': 16 * 1024 * 1024,
+    'INGEST_WORKERS': 4,
+}
+
+# Resumable chunked uploads (see tools/uploads.py)
+UPLOADS = {
+    'MAX_LENGTH': 50 * 1024 * 1024,
+    # Largest chunk one PATCH may carry
+    'MAX_CHUNK': 8 * 1024 * 1024,
+    # Seconds an upload (finished or not) is kept
+    'TTL': 24 * 60 * 60,
+    # Uploads over the 10MB provider limit are downscaled to this longest side
+    'MAX_SIDE': 4096,
+}
+
+# Load shedding (see tools/overload.py). Overloaded = queue delay above
+# TARGET_DELAY seconds for a whole INTERVAL; then bulk and standard requests
+# are shed (or served a near-duplicate cached result) and queue waits are
+# capped at DEGRADED_QUEUE_TIMEOUT. Past HARD_IN_FLIGHT generation requests
+# every uncached request is shed.
+OVERLOAD = {
+    'ENABLED': True,
+    'TARGET_DELAY': 2.0,
+    'INTERVAL': 10.0,
+    'SOFT_IN_FLIGHT': 16,
+    'HARD_IN_FLIGHT': 48,
+    'DEGRADED_QUEUE_TIMEOUT': 5,
+}
+
+# Capacity-planning rollups (see tools/analytics.py; report with
+# `manage.py capacity_report` or in the admin under Generation rollups)
+ANALYTICS = {
+    'ENABLED': True,
+    # Seconds between merges of in-memory rollups into the database
+    'FLUSH_INTERVAL': 10,
+    # Estimated provider cost (USD) of one quota cost unit
+    'COST_PER_UNIT': 0.039,
+}
+
+# Request tracing (see tools/tracing.py)
+TRACING = {
+    'ENABLED': True,
+    # 'file' (JSON lines), 'console' (stderr) or 'none'
+    'EXPORTER': os.getenv('TRACING_EXPORTER', 'none'),
+    'FILE': BASE_DIR / 'traces.jsonl',
+    # Rotated to traces.jsonl.1 .. .3 at this size
+    'MAX_FILE_BYTES': 50 * 1024 * 1024,
+    'FILE_BACKUPS': 3,
+    # Slow or failed traces are always kept; this fraction of the rest
+    'SLOW_THRESHOLD': 10.0,
+    'SAMPLE_RATE': 0.01,
+}
+
+# Bulk catalog enhancement (see tools/bulk.py)
+BULK = {
+    # Images processed in parallel per run (provider calls still queue as 'bulk')
+    'WORKERS': 4,
+    # Largest accepted run: entries in the ZIP/CSV and upload size
+    'MAX_ENTRIES': 10_000,
+    'MAX_UPLOAD_BYTES': 1024 * 1024 * 1024,
+    # Directory that CSV imports submitted over HTTP may read images from
+    # (None accepts ZIP uploads only)
+    'IMPORT_ROOT': os.getenv('BULK_IMPORT_ROOT') or None,
+    # Runs left queued/running without a heartbeat this long can be resumed
+    'LEASE_SECONDS': 120,
+    # Images shed under overload are retried for this long before failing
+    'RETRY_TIMEOUT': 600,
+}
@@ -16,13 +16,22 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from tools import views as tools_views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("tools.urls")),
+    # Generated images may live on another app server; this falls back to the
+    # shared result index when the file is not on this node's disk
+    re_path(
+        r"^%sgenerated_images/(?P<filename>[\w.-]+)$" % settings.MEDIA_URL.lstrip("/"),
+        tools_views.generated_image,
+        name="generated_image",
+    ),
 ]
 
 # Serve media files in development
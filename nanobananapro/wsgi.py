@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nanobananapro.settings")
 
 application = get_wsgi_application()
+
+# Serving process: warm heavy imports, templates and the provider client
+from tools import warmup  # noqa: E402
+
+warmup.start()
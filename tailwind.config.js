@@ -0,0 +1,8 @@
+/** Tailwind build for `python manage.py build_css` - purges against the templates. */
+module.exports = {
+  content: ['./tools/templates/**/*.html'],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
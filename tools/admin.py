@@ -1,3 +1,58 @@
 from django.contrib import admin
 
-# Register your models here.
+from . import analytics
+from .models import ApiKey, ApiKeyUsage, GenerationRollup
+
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    list_display = ('name', 'key_prefix', 'is_active', 'requests_per_minute',
+                    'max_concurrent_jobs', 'daily_spend_units', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('name', 'key_prefix')
+    readonly_fields = ('key_prefix', 'created_at')
+
+    def has_add_permission(self, request):
+        # Keys are issued with `manage.py create_api_key` so the raw key can be shown once
+        return False
+
+
+@admin.register(ApiKeyUsage)
+class ApiKeyUsageAdmin(admin.ModelAdmin):
+    list_display = ('api_key', 'day', 'requests', 'spend_units')
+    list_filter = ('day',)
+    date_hierarchy = 'day'
+
+
+@admin.register(GenerationRollup)
+class GenerationRollupAdmin(admin.ModelAdmin):
+    """Hourly rollups, with the capacity report for a chosen window above the list."""
+
+    REPORT_WINDOWS = [1, 7, 30, 90]
+
+    list_display = ('hour', 'tool', 'model', 'requests', 'errors', 'provider_errors',
+                    'cache_hits', 'bytes_stored', 'cost_units')
+    list_filter = ('tool', 'model')
+    date_hierarchy = 'hour'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = int(request.GET.get('report_days', 7))
+        except ValueError:
+            days = 7
+        # report_days is ours, not a list filter
+        request.GET = request.GET.copy()
+        request.GET.pop('report_days', None)
+        extra_context = {
+            **(extra_context or {}),
+            'report': analytics.report(days=days),
+            'report_days': days,
+            'report_windows': self.REPORT_WINDOWS,
+        }
+        return super().changelist_view(request, extra_context)
@@ -0,0 +1,263 @@
+"""
+Generation analytics for capacity planning.
+
+Every generation is folded into an in-memory rollup keyed by (hour, tool,
+model): request, error, provider error and cache hit counts, total latency
+and a latency histogram, bytes stored and cost units. Rollups are merged
+into GenerationRollup rows every FLUSH_INTERVAL seconds by a background
+thread, so the request path never waits on the database (a failed write is
+logged and retried with the next flush) and a month of history is a few
+thousand rows.
+
+``report()`` aggregates those rows into throughput, latency percentiles,
+cache hit rate, error rates, storage and estimated cost per tool and model.
+Percentiles come from the merged histograms, so they are bucket estimates.
+"""
+
+import atexit
+import bisect
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+ANALYTICS_DEFAULTS = {
+    'ENABLED': True,
+    'FLUSH_INTERVAL': 10,
+    # Estimated provider cost (USD) of one quota cost unit
+    'COST_PER_UNIT': 0.039,
+}
+
+# Upper bounds (seconds) of the latency histogram buckets; one more bucket
+# holds everything slower
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120]
+
+COUNTERS = ['requests', 'errors', 'provider_errors', 'cache_hits', 'total_seconds', 'bytes_stored', 'cost_units']
+
+
+logger = logging.getLogger(__name__)
+
+
+def analytics_setting(name):
+    return getattr(settings, 'ANALYTICS', {}).get(name, ANALYTICS_DEFAULTS[name])
+
+
+def empty_histogram():
+    return [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+def merge_histograms(target, source):
+    for i, count in enumerate(source[:len(target)]):
+        target[i] += count
+    return target
+
+
+def percentile(histogram, fraction):
+    """Estimate a latency percentile from bucket counts (linear within a bucket)."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            low = LATENCY_BUCKETS[i - 1] if i else 0.0
+            high = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1] * 2
+            return round(low + (high - low) * (rank - seen) / count, 3)
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+class RollupRecorder:
+    """Accumulates generation rollups in memory and merges them into the DB."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._pending = {}
+            self._last_flush = time.monotonic()
+
+    def record(self, tool, model, duration, success, cache_hit=False, provider_error=False,
+               bytes_stored=0, cost_units=0):
+        if not analytics_setting('ENABLED'):
+            return
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            rollup = self._pending.get((hour, tool, model))
+            if rollup is None:
+                rollup = self._pending[(hour, tool, model)] = dict.fromkeys(COUNTERS, 0)
+                rollup['latency_histogram'] = empty_histogram()
+            rollup['requests'] += 1
+            rollup['errors'] += 0 if success else 1
+            rollup['provider_errors'] += 1 if provider_error else 0
+            rollup['cache_hits'] += 1 if cache_hit else 0
+            rollup['total_seconds'] += duration
+            rollup['bytes_stored'] += bytes_stored
+            rollup['cost_units'] += cost_units
+            rollup['latency_histogram'][bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        """Queue a background flush once FLUSH_INTERVAL has passed."""
+        with self._lock:
+            if time.monotonic() - self._last_flush < analytics_setting('FLUSH_INTERVAL'):
+                return
+            # Claim the interval so a burst of requests queues a single flush
+            self._last_flush = time.monotonic()
+        _get_flusher().submit(self._background_flush)
+
+    def _background_flush(self):
+        close_old_connections()
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        """Merge pending rollups into GenerationRollup rows in one transaction."""
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            if not pending:
+                return
+            try:
+                self._write(pending)
+            except Exception:
+                logger.exception('Analytics rollup flush failed; re-queueing %d rollups', len(pending))
+                self._requeue(pending)
+        finally:
+            self._flush_lock.release()
+
+    def _requeue(self, pending):
+        with self._lock:
+            for key, rollup in pending.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = rollup
+                    continue
+                for name in COUNTERS:
+                    current[name] += rollup[name]
+                merge_histograms(current['latency_histogram'], rollup['latency_histogram'])
+
+    def _write(self, pending):
+        from .models import GenerationRollup
+
+        with transaction.atomic():
+            for (hour, tool, model), rollup in pending.items():
+                counters = {name: rollup[name] for name in COUNTERS}
+                histogram = rollup['latency_histogram']
+                row, created = GenerationRollup.objects.get_or_create(
+                    hour=hour, tool=tool, model=model,
+                    defaults=dict(counters, latency_histogram=list(histogram)),
+                )
+                if created:
+                    continue
+                # Counters are added in SQL; the histogram is merged in Python,
+                # so the update only applies if no other process changed it
+                # since it was read (select_for_update is a no-op on SQLite)
+                rows = GenerationRollup.objects.filter(pk=row.pk)
+                while not rows.filter(latency_histogram=row.latency_histogram).update(
+                    latency_histogram=merge_histograms(list(row.latency_histogram or empty_histogram()), histogram),
+                    **{name: F(name) + value for name, value in counters.items()},
+                ):
+                    row = rows.get()
+
+
+recorder = RollupRecorder()
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _get_flusher():
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analytics-flush')
+        return _flusher
+
+
+def drain_flusher():
+    """Wait for a queued background flush to finish (tests, shutdown)."""
+    global _flusher
+    with _flusher_lock:
+        executor, _flusher = _flusher, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        recorder.flush()
+    except Exception:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Reports
+# ---------------------------------------------------------------------------
+
+def report(days=7, tool=None, now=None):
+    """
+    Capacity report over the last ``days`` days, one entry per tool and model.
+
+    Throughput is given as the average and peak requests per hour over the
+    hours that saw traffic.
+    """
+    from .models import GenerationRollup
+
+    now = now or timezone.now()
+    rows = GenerationRollup.objects.filter(hour__gte=now - timedelta(days=days))
+    if tool:
+        rows = rows.filter(tool=tool)
+
+    groups = {}
+    for row in rows.order_by('tool', 'model', 'hour').iterator():
+        group = groups.get((row.tool, row.model))
+        if group is None:
+            group = groups[(row.tool, row.model)] = dict.fromkeys(COUNTERS, 0)
+            group.update(hours=0, peak_per_hour=0, histogram=empty_histogram())
+        for name in COUNTERS:
+            group[name] += getattr(row, name)
+        group['hours'] += 1
+        group['peak_per_hour'] = max(group['peak_per_hour'], row.requests)
+        merge_histograms(group['histogram'], row.latency_histogram or [])
+
+    cost_per_unit = analytics_setting('COST_PER_UNIT')
+    entries = []
+    for (tool_name, model), group in sorted(groups.items()):
+        requests = group['requests']
+        provider_calls = requests - group['cache_hits']
+        entries.append({
+            'tool': tool_name,
+            'model': model,
+            'requests': requests,
+            'avg_per_hour': round(requests / group['hours'], 2),
+            'peak_per_hour': group['peak_per_hour'],
+            'avg_seconds': round(group['total_seconds'] / requests, 3) if requests else None,
+            'p50_seconds': percentile(group['histogram'], 0.50),
+            'p95_seconds': percentile(group['histogram'], 0.95),
+            'p99_seconds': percentile(group['histogram'], 0.99),
+            'cache_hit_rate': round(group['cache_hits'] / requests, 4) if requests else 0.0,
+            'error_rate': round(group['errors'] / requests, 4) if requests else 0.0,
+            'provider_error_rate': round(group['provider_errors'] / provider_calls, 4) if provider_calls else 0.0,
+            'bytes_stored': group['bytes_stored'],
+            'cost_units': group['cost_units'],
+            'estimated_cost': round(group['cost_units'] * cost_per_unit, 2),
+        })
+    return entries
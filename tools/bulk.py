@@ -0,0 +1,456 @@
+"""
+Bulk catalog enhancement: run the Product Ad Enhancer over a ZIP of images
+or a CSV of image paths.
+
+A run lives in ``MEDIA_ROOT/bulk/<run_id>/``:
+
+    source.zip | source.csv   the uploaded input, kept as-is
+    state.json                status and counters
+    checkpoint.jsonl          one line per finished image, appended as it completes
+    results.zip               <sku>.png per entry plus manifest.csv
+
+Entries are read one at a time straight from the archive, never extracted to
+disk. Identical images (same SHA-256) are generated once and shared by every
+SKU that uses them. Images run through the normal pipeline stages - so they
+share the result cache and queue in the ``bulk`` priority class - with at
+most WORKERS in flight. Each image's cost is reserved from the key's daily
+budget before it is submitted and settled when it finishes, so a run never
+overshoots the budget. Uploads over MAX_UPLOAD_BYTES or MAX_ENTRIES are
+refused before anything is processed. Re-running a run skips every image already in its
+checkpoint, so an interrupted or quota-paused run resumes where it stopped.
+
+A processing run refreshes ``updated_at`` at least every LEASE_SECONDS / 3.
+A run whose status says queued or running but whose lease has lapsed was
+orphaned by a restart or crash, and may be resumed. ``claim()`` checks and
+takes the lease under a coordination lock, so two resume requests cannot
+both start it. Images shed by overload control (503) are retried after the
+Retry-After delay for up to RETRY_TIMEOUT seconds instead of failing.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from . import coordination, imaging, pipeline, quotas, specs, tracing
+from .exceptions import PipelineError
+
+
+BULK_DEFAULTS = {
+    'WORKERS': 4,
+    'MAX_ENTRIES': 10_000,
+    # Largest ZIP or CSV accepted, checked before it is stored
+    'MAX_UPLOAD_BYTES': 1024 * 1024 * 1024,
+    # Directory CSV paths must resolve under when submitted over HTTP
+    'IMPORT_ROOT': None,
+    # A queued or running run not refreshed for this long is considered orphaned
+    'LEASE_SECONDS': 120,
+    # How long an image shed with 503 keeps being retried
+    'RETRY_TIMEOUT': 600,
+}
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+SOURCE_KINDS = {'.zip': 'zip', '.csv': 'csv'}
+
+# Every stage except the per-request quota check; runs are charged per image
+BULK_STAGES = [stage for stage in pipeline.STAGES if stage is not pipeline.quota_stage]
+
+
+def bulk_setting(name):
+    return getattr(settings, 'BULK', {}).get(name, BULK_DEFAULTS[name])
+
+
+Entry = namedtuple('Entry', ['sku', 'source', 'data', 'error'])
+
+
+def run_dir(run_id):
+    return os.path.join(settings.MEDIA_ROOT, 'bulk', os.path.basename(run_id))
+
+
+# ---------------------------------------------------------------------------
+# Reading entries
+# ---------------------------------------------------------------------------
+
+def _check_image(name, size):
+    if os.path.splitext(name)[1].lower() not in pipeline.ALLOWED_EXTENSIONS:
+        return f'Invalid file type. Allowed: {", ".join(pipeline.ALLOWED_EXTENSIONS)}'
+    if size > pipeline.MAX_UPLOAD_SIZE:
+        return 'File size too large. Maximum size is 10MB.'
+    return None
+
+
+def iter_zip_entries(path):
+    """Yield one Entry per image in the archive, reading members one at a time."""
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                continue
+            sku = os.path.splitext(os.path.basename(name))[0]
+            error = _check_image(name, info.file_size)
+            yield Entry(sku, name, None if error else archive.read(info), error)
+
+
+def iter_csv_entries(path, base, root=None):
+    """
+    Yield one Entry per CSV row. Rows need a ``path`` column (relative to
+    ``base``) and may name a ``sku``. With ``root``, paths outside that
+    directory are rejected.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if 'path' not in (reader.fieldnames or []):
+            raise PipelineError('CSV must have a "path" column')
+        for row in reader:
+            source = (row.get('path') or '').strip()
+            if not source:
+                continue
+            sku = (row.get('sku') or '').strip() or os.path.splitext(os.path.basename(source))[0]
+            image_path = os.path.realpath(os.path.join(base, source))
+            if root and os.path.commonpath([image_path, os.path.realpath(root)]) != os.path.realpath(root):
+                yield Entry(sku, source, None, 'Path is outside the import directory')
+                continue
+            if not os.path.isfile(image_path):
+                yield Entry(sku, source, None, 'File not found')
+                continue
+            error = _check_image(source, os.path.getsize(image_path))
+            if error:
+                yield Entry(sku, source, None, error)
+                continue
+            with open(image_path, 'rb') as image:
+                yield Entry(sku, source, image.read(), None)
+
+
+def count_entries(path, kind):
+    """Number of members (ZIP) or rows (CSV) in a source, without reading images."""
+    if kind == 'zip':
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for info in archive.infolist() if not info.is_dir())
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return sum(1 for _ in csv.reader(f)) - 1
+
+
+# ---------------------------------------------------------------------------
+# Runs
+# ---------------------------------------------------------------------------
+
+class BulkRun:
+    """A bulk enhancement run and its on-disk state."""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.path = run_dir(run_id)
+        self._lock = threading.Lock()
+        self.state = self._read_state()
+
+    # Creation / state --------------------------------------------------------
+
+    @classmethod
+    def create(cls, source_name, chunks, principal_id=None, preset=None, csv_base=None, import_root=None):
+        """
+        Store the source (``chunks`` of bytes) and return the new run, ready
+        to be claimed.
+
+        CSV paths are resolved against ``csv_base``; with ``import_root``
+        they must also stay inside it.
+        """
+        kind = SOURCE_KINDS.get(os.path.splitext(source_name)[1].lower())
+        if kind is None:
+            raise PipelineError('Upload a .zip of images or a .csv of image paths')
+        if preset and preset not in imaging.PRESETS:
+            raise PipelineError(f'Invalid preset. Allowed: {", ".join(imaging.PRESETS)}')
+
+        run_id = uuid.uuid4().hex
+        path = run_dir(run_id)
+        source = os.path.join(path, f"source.{kind}")
+        limit = bulk_setting('MAX_UPLOAD_BYTES')
+        os.makedirs(path)
+        try:
+            size = 0
+            with open(source, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > limit:
+                        raise PipelineError(f"Uploads are limited to {limit // (1024 * 1024)}MB", status=413)
+                    f.write(chunk)
+            if kind == 'zip' and not zipfile.is_zipfile(source):
+                raise PipelineError('Uploaded file is not a valid ZIP archive')
+            if count_entries(source, kind) > bulk_setting('MAX_ENTRIES'):
+                raise PipelineError(f"Runs are limited to {bulk_setting('MAX_ENTRIES')} entries", status=413)
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+        run = cls(run_id)
+        run.state = {
+            'run_id': run_id,
+            'kind': kind,
+            'source_name': os.path.basename(source_name),
+            'principal': principal_id,
+            'preset': preset,
+            'csv_base': csv_base or import_root,
+            'import_root': import_root,
+            'status': 'created',
+            'created_at': time.time(),
+        }
+        run.save_state()
+        return run
+
+    def _read_state(self):
+        try:
+            with open(os.path.join(self.path, 'state.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, **changes):
+        with self._lock:
+            self.state.update(changes, updated_at=time.time())
+            path = os.path.join(self.path, 'state.json')
+            with open(f"{path}.part", 'w') as f:
+                json.dump(self.state, f)
+            os.replace(f"{path}.part", path)
+
+    def is_active(self, now=None):
+        """True while the run is queued or running and its lease is fresh."""
+        if self.state['status'] not in ACTIVE_STATUSES:
+            return False
+        now = time.time() if now is None else now
+        return now - self.state.get('updated_at', 0) < bulk_setting('LEASE_SECONDS')
+
+    def claim(self):
+        """
+        Mark the run queued for (re)processing, or raise PipelineError (409)
+        if it is already being processed.
+        """
+        try:
+            with coordination.get_backend().lock(f"bulk:{self.run_id}", ttl=30, timeout=5):
+                self.state = self._read_state()
+                if self.is_active():
+                    raise PipelineError('Run is already in progress', status=409)
+                self.save_state(status='queued')
+        except coordination.LockTimeout:
+            raise PipelineError('Run is already in progress', status=409)
+
+    @property
+    def results_path(self):
+        return os.path.join(self.path, 'results.zip')
+
+    def entries(self):
+        source = os.path.join(self.path, f"source.{self.state['kind']}")
+        if self.state['kind'] == 'zip':
+            return iter_zip_entries(source)
+        return iter_csv_entries(source, self.state['csv_base'], root=self.state.get('import_root'))
+
+    # Checkpoint ------------------------------------------------------------
+
+    def load_checkpoint(self):
+        """Return ``{digest: record}`` for images finished in earlier attempts."""
+        records = {}
+        try:
+            with open(os.path.join(self.path, 'checkpoint.jsonl')) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        records[record['digest']] = record
+        except FileNotFoundError:
+            pass
+        return records
+
+    def checkpoint(self, record):
+        with self._lock:
+            with open(os.path.join(self.path, 'checkpoint.jsonl'), 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+
+    # Processing ------------------------------------------------------------
+
+    def enhance(self, digest, entry, principal, reserved=0):
+        """
+        Run one unique image through the pipeline; return its checkpoint
+        record. ``reserved`` units taken from the principal's budget are
+        settled against what the image actually cost.
+        """
+        deadline = time.monotonic() + bulk_setting('RETRY_TIMEOUT')
+        while True:
+            try:
+                return self._enhance_once(digest, entry, principal, reserved)
+            except PipelineError as e:
+                remaining = deadline - time.monotonic()
+                if e.status != 503 or remaining <= 0:
+                    error = e.message
+                    break
+                # Shed or queue timeout under load: wait as told, then retry
+                time.sleep(min(float(e.headers.get('Retry-After', 1)), remaining))
+            except Exception as e:
+                error = str(e)
+                break
+        if principal is not None and reserved:
+            quotas.accountant.charge(principal, -reserved)
+        return {'digest': digest, 'status': 'failed', 'error': error}
+
+    def _enhance_once(self, digest, entry, principal, reserved=0):
+        spec = pipeline.get_tool('product_ad_enhancer')
+        job = pipeline.GenerationJob(spec, None)
+        job.priority = 'bulk'
+        job.principal = principal
+        try:
+            with tracing.span('bulk.image', **{'bulk.run_id': self.run_id, 'bulk.digest': digest}):
+                job.save_bytes(entry.data, 'bulk', os.path.splitext(entry.source)[1].lower(), digest=digest)
+                specs.parse_output_options(job, {'preset': self.state.get('preset') or ''})
+                job.prompt = spec.build_prompt(job)
+                payload = pipeline.run_pipeline(job, BULK_STAGES)
+            if principal is not None:
+                spent = 0 if job.cache_hit else job.cost_units
+                quotas.accountant.charge(principal, spent - reserved)
+            return {'digest': digest, 'status': 'ok', 'filename': payload['filename'],
+                    'cache_hit': job.cache_hit}
+        finally:
+            job.cleanup()
+
+    def process(self, principal=None, workers=None, progress=None):
+        """
+        Process (or resume) the run. ``progress`` is called with the state
+        after each finished image.
+        """
+        workers = workers or bulk_setting('WORKERS')
+        cost = pipeline.get_tool('product_ad_enhancer').cost_units
+        finished = self.load_checkpoint()
+        rows = []            # one per entry, in archive order
+        seen = set()
+        counts = {'total_entries': 0, 'unique_images': 0, 'duplicates': 0, 'invalid': 0}
+        paused = False
+        in_flight = set()
+
+        self.save_state(status='running', error=None,
+                        done=sum(1 for r in finished.values() if r['status'] == 'ok'), failed=0)
+
+        def collect(futures):
+            for future in futures:
+                record = future.result()
+                finished[record['digest']] = record
+                self.checkpoint(record)
+                key = 'done' if record['status'] == 'ok' else 'failed'
+                self.save_state(**{key: self.state.get(key, 0) + 1})
+                if progress:
+                    progress(self.state)
+
+        def drain():
+            # Wake up regularly to keep the lease fresh while images are slow
+            completed, pending = wait(in_flight, timeout=bulk_setting('LEASE_SECONDS') / 3,
+                                      return_when=FIRST_COMPLETED)
+            if completed:
+                collect(completed)
+            else:
+                self.save_state()
+            return pending
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk') as pool:
+                for entry in self.entries():
+                    counts['total_entries'] += 1
+                    if counts['total_entries'] > bulk_setting('MAX_ENTRIES'):
+                        raise PipelineError(f"Runs are limited to {bulk_setting('MAX_ENTRIES')} entries")
+                    if entry.error:
+                        counts['invalid'] += 1
+                        rows.append({'sku': entry.sku, 'source': entry.source, 'digest': '',
+                                     'status': 'invalid', 'error': entry.error})
+                        continue
+
+                    digest = hashlib.sha256(entry.data).hexdigest()
+                    rows.append({'sku': entry.sku, 'source': entry.source, 'digest': digest})
+                    if digest in seen:
+                        counts['duplicates'] += 1
+                        continue
+                    seen.add(digest)
+                    counts['unique_images'] += 1
+                    if paused or finished.get(digest, {}).get('status') == 'ok':
+                        continue
+
+                    # Bounded read-ahead: only a few decoded entries in memory
+                    while len(in_flight) >= workers * 2:
+                        in_flight = drain()
+
+                    if principal is not None and not quotas.accountant.reserve(principal, cost):
+                        # Keep reading to build the manifest; resume tomorrow
+                        paused = True
+                        continue
+                    reserved = cost if principal is not None else 0
+                    in_flight.add(pool.submit(tracing.wrap(self.enhance), digest, entry, principal, reserved))
+
+                while in_flight:
+                    in_flight = drain()
+        except Exception as e:
+            self.save_state(status='failed', error=str(e), **counts)
+            raise
+
+        self.write_results(rows, finished)
+        self.save_state(status='paused' if paused else 'completed',
+                        error='Daily quota exhausted' if paused else None, **counts)
+        return self.state
+
+    def write_results(self, rows, finished):
+        """Write results.zip: one PNG per SKU plus manifest.csv."""
+        partial = f"{self.results_path}.part"
+        names = set()
+        manifest = io.StringIO()
+        writer = csv.DictWriter(manifest, ['sku', 'source', 'digest', 'status', 'image', 'error'])
+        writer.writeheader()
+
+        with zipfile.ZipFile(partial, 'w') as archive:
+            for row in rows:
+                record = finished.get(row['digest'], {})
+                status = row.get('status') or record.get('status', 'pending')
+                image = ''
+                if status == 'ok':
+                    path = pipeline.ensure_local_result(record['filename'])
+                    if path is None:
+                        status, record = 'failed', {'error': 'Result expired'}
+                    else:
+                        image = f"{row['sku']}.png"
+                        suffix = 1
+                        while image in names:
+                            suffix += 1
+                            image = f"{row['sku']}_{suffix}.png"
+                        names.add(image)
+                        # PNGs are already compressed
+                        archive.write(path, f"images/{image}", compress_type=zipfile.ZIP_STORED)
+                writer.writerow({'sku': row['sku'], 'source': row['source'], 'digest': row['digest'],
+                                 'status': status, 'image': image,
+                                 'error': row.get('error') or record.get('error', '')})
+            archive.writestr('manifest.csv', manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+        os.replace(partial, self.results_path)
+
+
+def get_run(run_id):
+    run = BulkRun(run_id)
+    return run if run.state is not None else None
+
+
+def start(run, principal=None):
+    """Claim a run and process it in a background thread; raises PipelineError (409) if it is running."""
+    run.claim()
+
+    def target():
+        from django.db import connection
+        try:
+            run.process(principal)
+        except Exception:
+            pass  # recorded in the run state
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target, name=f"bulk-{run.run_id[:8]}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+
+
+TAILWIND_CSS = 'tools/css/app.css'
+# How long a missing stylesheet is remembered before looking again
+MISSING_RECHECK_SECONDS = 60
+
+_tailwind = {'url': None, 'checked_at': None}
+
+
+def _find_tailwind_css():
+    # Under DEBUG the file is served from the app's static dir, otherwise
+    # from STATIC_ROOT after collectstatic. Until `manage.py build_css` has
+    # produced it, pages fall back to the Tailwind CDN.
+    if settings.DEBUG:
+        found = finders.find(TAILWIND_CSS)
+    else:
+        found = staticfiles_storage.exists(TAILWIND_CSS)
+    if not found:
+        return None
+    try:
+        return static(TAILWIND_CSS)
+    except ValueError:
+        return None
+
+
+def _tailwind_css_url():
+    """The stylesheet URL, cached once found; a miss is rechecked periodically."""
+    checked_at = _tailwind['checked_at']
+    if _tailwind['url'] is None and (checked_at is None
+                                     or time.monotonic() - checked_at >= MISSING_RECHECK_SECONDS):
+        _tailwind['url'] = _find_tailwind_css()
+        _tailwind['checked_at'] = time.monotonic()
+    return _tailwind['url']
+
+
+def tailwind_css(request):
+    """Expose the URL of the locally built Tailwind stylesheet, if any."""
+    return {'tailwind_css_url': _tailwind_css_url()}
@@ -0,0 +1,282 @@
+"""
+Cross-node coordination for running several app servers behind a plain
+round-robin balancer.
+
+The backend provides three things on top of a shared key/value store:
+
+- distributed locks (used to single-flight identical generations),
+- a shared result index recording each generated image (node, size and
+  checksum); with REPLICATE_RESULTS on a shared store it also holds the
+  bytes, so any node can serve or edit a result another node produced
+  without a shared MEDIA_ROOT,
+- job state records that any node can report on.
+
+Two implementations exist: CacheBackend on the Django cache framework (use a
+shared cache such as DatabaseCache, Memcached or Redis for multiple nodes)
+and RedisBackend speaking the Redis protocol through a redis-py compatible
+client. LocalRedis is an in-process stand-in for that client.
+"""
+
+import hashlib
+import pickle
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+COORDINATION_DEFAULTS = {
+    'BACKEND': 'cache',
+    'CACHE_ALIAS': 'default',
+    'REDIS_URL': 'redis://localhost:6379/0',
+    'KEY_PREFIX': 'nbp',
+    'RESULT_TTL': 24 * 60 * 60,
+    'JOB_TTL': 24 * 60 * 60,
+    'NODE_NAME': socket.gethostname(),
+    # Copy result bytes into the index (multi-node without shared media)
+    'REPLICATE_RESULTS': False,
+}
+
+
+def coordination_setting(name):
+    return getattr(settings, 'COORDINATION', {}).get(name, COORDINATION_DEFAULTS[name])
+
+
+class LockTimeout(Exception):
+    """Raised when a distributed lock could not be acquired in time."""
+
+
+class CoordinationBackend:
+    """Locks, result index and job state built on five storage primitives."""
+
+    # Whether other processes can see what this backend stores
+    process_local = False
+
+    def __init__(self, prefix=None):
+        self.prefix = prefix or coordination_setting('KEY_PREFIX')
+
+    def key(self, *parts):
+        return ':'.join([self.prefix, *parts])
+
+    # Storage primitives implemented by subclasses
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl):
+        """Set ``key`` only if it does not exist; return True if it was set."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_if_equals(self, key, value):
+        raise NotImplementedError
+
+    # Locks
+    @contextmanager
+    def lock(self, name, ttl=60, timeout=30, poll=0.05):
+        """Hold the named lock; the TTL frees it if this node dies."""
+        key = self.key('lock', name)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self.add(key, token, ttl):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(name)
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            self.delete_if_equals(key, token)
+
+    # Shared result index
+    def publish_result(self, filename, data):
+        entry = {
+            'node': coordination_setting('NODE_NAME'),
+            'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'created_at': time.time(),
+        }
+        # A process-local store has no other node to serve, so it only ever
+        # gets the index entry, never the bytes
+        if coordination_setting('REPLICATE_RESULTS') and not self.process_local:
+            entry['data'] = data
+        self.set(self.key('result', filename), entry, coordination_setting('RESULT_TTL'))
+
+    def fetch_result(self, filename):
+        """Return replicated result bytes, or None if the index has none (or they are corrupt)."""
+        entry = self.get(self.key('result', filename))
+        if not entry or entry.get('data') is None:
+            return None
+        if hashlib.sha256(entry['data']).hexdigest() != entry['sha256']:
+            return None
+        return entry['data']
+
+    def has_result(self, filename):
+        """True if the result's bytes can be fetched from the index."""
+        entry = self.get(self.key('result', filename))
+        return entry is not None and entry.get('data') is not None
+
+    # Job state
+    def set_job_state(self, job_id, **state):
+        key = self.key('job', job_id)
+        record = self.get(key) or {'job_id': job_id}
+        record.update(state, node=coordination_setting('NODE_NAME'), updated_at=time.time())
+        self.set(key, record, coordination_setting('JOB_TTL'))
+        return record
+
+    def get_job_state(self, job_id):
+        return self.get(self.key('job', job_id))
+
+
+class CacheBackend(CoordinationBackend):
+    """
+    Backend on a Django cache alias.
+
+    ``add`` is atomic on the shared cache backends Django ships; the
+    compare-and-delete used to release a lock is not, which the lock TTL
+    bounds.
+    """
+
+    def __init__(self, alias=None, prefix=None):
+        super().__init__(prefix)
+        self.cache = caches[alias or coordination_setting('CACHE_ALIAS')]
+
+    @property
+    def process_local(self):
+        """True when the cache is private to this process (locmem, dummy)."""
+        from django.core.cache.backends.dummy import DummyCache
+        from django.core.cache.backends.locmem import LocMemCache
+
+        return isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        return self.cache.add(key, value, ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def delete_if_equals(self, key, value):
+        if self.cache.get(key) == value:
+            self.cache.delete(key)
+
+
+# Atomic compare-and-delete for lock release
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBackend(CoordinationBackend):
+    """Backend over any redis-py compatible client (the ``redis`` package is optional)."""
+
+    def __init__(self, client=None, url=None, prefix=None):
+        super().__init__(prefix)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or coordination_setting('REDIS_URL'))
+        self.client = client
+
+    @property
+    def process_local(self):
+        return isinstance(self.client, LocalRedis)
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(key, pickle.dumps(value), ex=int(ttl))
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, pickle.dumps(value), nx=True, ex=int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def delete_if_equals(self, key, value):
+        self.client.eval(RELEASE_SCRIPT, 1, key, pickle.dumps(value))
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the subset of the redis-py client RedisBackend
+    uses, for tests and single-node development.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def _live(self, key):
+        value, expires = self._data.get(key, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def eval(self, script, numkeys, *args):
+        if script != RELEASE_SCRIPT:
+            raise NotImplementedError('LocalRedis only runs the lock release script')
+        key, token = args[0], args[numkeys]
+        with self._lock:
+            if self._live(key) == token:
+                del self._data[key]
+                return 1
+            return 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured coordination backend (created on first use)."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            kind = coordination_setting('BACKEND')
+            if kind == 'redis':
+                _backend = RedisBackend()
+            elif kind == 'cache':
+                _backend = CacheBackend()
+            else:
+                raise ValueError(f"Unknown COORDINATION backend: {kind}")
+        return _backend
+
+
+def set_backend(backend):
+    """Replace the process-wide backend (None re-reads the settings)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,8 @@
+class PipelineError(Exception):
+    """Raised by a stage to abort the job with a JSON error response."""
+
+    def __init__(self, message, status=400, headers=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers or {}
@@ -0,0 +1,184 @@
+"""
+Pillow helpers for preparing provider inputs and post-processing outputs.
+
+Pillow is imported inside each function so it stays off the startup path.
+"""
+
+import io
+import os
+from functools import lru_cache
+
+
+def downsample(data, max_side):
+    """
+    Shrink image bytes so the longest side is at most ``max_side``.
+
+    Returns ``(bytes, extension)``. Images with transparency stay PNG; the
+    rest become JPEG, which is several times smaller for photos. Images that
+    are already small enough are returned unchanged.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if max(image.size) <= max_side:
+            return data, '.' + (image.format or 'png').lower().replace('jpeg', 'jpg')
+
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(buffer, format='PNG', optimize=True)
+            return buffer.getvalue(), '.png'
+        image.convert('RGB').save(buffer, format='JPEG', quality=85, optimize=True)
+        return buffer.getvalue(), '.jpg'
+
+
+# Pillow format name -> (file extension, MIME type) for provider inputs
+FORMATS = {
+    'PNG': ('.png', 'image/png'),
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+
+
+def sniff(data):
+    """Return ``(extension, mime_type)`` of image bytes; OSError if unsupported."""
+    with _open(data) as image:
+        if image.format not in FORMATS:
+            raise OSError(f"Unsupported image format: {image.format}")
+        return FORMATS[image.format]
+
+
+def provider_input(data):
+    """Image bytes labelled with their real MIME type for the provider."""
+    return {'data': data, 'mime_type': sniff(data)[1]}
+
+
+def _open(source):
+    from PIL import Image
+
+    return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def verify(source):
+    """Raise OSError unless ``source`` (bytes or a file path) is a readable image."""
+    with _open(source) as image:
+        image.verify()
+
+
+def normalize(source, max_side):
+    """
+    Provider-ready copy of an uploaded image (bytes or a file path): EXIF
+    rotation applied, metadata dropped, longest side at most ``max_side``.
+    Returns ``(bytes, extension, (width, height))``; PNG if it has
+    transparency, else JPEG.
+    """
+    from PIL import Image, ImageOps
+
+    with _open(source) as source:
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(buffer, format='PNG', optimize=True)
+            return buffer.getvalue(), '.png', image.size
+        image.convert('RGB').save(buffer, format='JPEG', quality=90, optimize=True)
+        return buffer.getvalue(), '.jpg', image.size
+
+
+# ---------------------------------------------------------------------------
+# Output post-processing
+# ---------------------------------------------------------------------------
+
+# Exact output sizes for common destinations
+PRESETS = {
+    'youtube': (1280, 720),
+    'ecommerce_square': (2000, 2000),
+    'instagram_square': (1080, 1080),
+}
+
+WATERMARK_WIDTH = 0.18     # fraction of the image width
+WATERMARK_OPACITY = 0.6
+TITLE_HEIGHT = 0.1         # font size as a fraction of the image height
+
+
+@lru_cache(maxsize=32)
+def _font(path, size):
+    from PIL import ImageFont
+
+    for candidate in filter(None, [path, 'DejaVuSans-Bold.ttf']):
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=16)
+def _watermark_mask(path, mtime, width, opacity):
+    """Scaled, pre-faded watermark; ``mtime`` invalidates the cache on change."""
+    from PIL import Image
+
+    with Image.open(path) as source:
+        mark = source.convert('RGBA')
+    height = max(1, round(mark.height * width / mark.width))
+    mark = mark.resize((width, height), Image.Resampling.LANCZOS)
+    alpha = mark.getchannel('A').point(lambda a: round(a * opacity))
+    mark.putalpha(alpha)
+    return mark
+
+
+def _wrap(draw, text, font, max_width):
+    lines, line = [], ''
+    for word in text.split():
+        candidate = f"{line} {word}".strip()
+        if line and draw.textlength(candidate, font=font) > max_width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+def postprocess(data, preset=None, watermark_path=None, title=None, font_path=None):
+    """
+    Crop/resize to a preset, composite a watermark and draw a title.
+
+    A plain function of bytes in, bytes out so it can run in a worker
+    process. Fonts and watermark masks are cached per process.
+    """
+    from PIL import Image, ImageDraw, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = source.convert('RGBA')
+
+    if preset:
+        image = ImageOps.fit(image, PRESETS[preset], Image.Resampling.LANCZOS)
+
+    if title:
+        draw = ImageDraw.Draw(image)
+        size = max(12, round(image.height * TITLE_HEIGHT))
+        font = _font(font_path, size)
+        margin = round(image.height * 0.05)
+        lines = _wrap(draw, title, font, image.width - 2 * margin)
+        y = image.height - margin - len(lines) * round(size * 1.15)
+        for line in lines:
+            draw.text((margin, y), line, font=font, fill='white',
+                      stroke_width=max(1, size // 12), stroke_fill='black')
+            y += round(size * 1.15)
+
+    if watermark_path:
+        width = max(1, round(image.width * WATERMARK_WIDTH))
+        mark = _watermark_mask(watermark_path, os.path.getmtime(watermark_path), width, WATERMARK_OPACITY)
+        margin = round(image.width * 0.02)
+        image.alpha_composite(mark, (image.width - mark.width - margin, image.height - mark.height - margin))
+
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
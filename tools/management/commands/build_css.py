@@ -0,0 +1,41 @@
+import os
+import shlex
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the purged, minified Tailwind stylesheet from the templates. "
+        "Run collectstatic afterwards to publish it under a hashed, "
+        "precompressed filename."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cli', default=os.getenv('TAILWIND_CLI', 'tailwindcss'),
+                            help='Tailwind CLI to run (standalone binary or "npx tailwindcss")')
+
+    def handle(self, *args, **options):
+        base_dir = settings.BASE_DIR
+        output = base_dir / 'tools' / 'static' / 'tools' / 'css' / 'app.css'
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+        command = shlex.split(options['cli']) + [
+            '--config', str(base_dir / 'tailwind.config.js'),
+            '--input', str(base_dir / 'tools' / 'static_src' / 'tailwind.css'),
+            '--output', str(output),
+            '--minify',
+        ]
+        try:
+            subprocess.run(command, cwd=base_dir, check=True)
+        except FileNotFoundError:
+            raise CommandError(
+                f"Tailwind CLI not found ({options['cli']}). Install the standalone "
+                "binary or pass --cli 'npx tailwindcss'."
+            )
+        except subprocess.CalledProcessError as e:
+            raise CommandError(f"Tailwind build failed with exit code {e.returncode}")
+
+        self.stdout.write(self.style.SUCCESS(f"Built {output.relative_to(base_dir)} ({output.stat().st_size} bytes)"))
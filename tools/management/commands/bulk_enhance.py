@@ -0,0 +1,59 @@
+import os
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tools import bulk
+from tools import specs  # noqa: F401 - registers the tool specs
+from tools.exceptions import PipelineError
+
+
+class Command(BaseCommand):
+    help = "Run the Product Ad Enhancer over a ZIP of images or a CSV of image paths (path[,sku] columns)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='.zip or .csv file')
+        parser.add_argument('--resume', metavar='RUN_ID', help='continue an earlier run from its checkpoint')
+        parser.add_argument('--workers', type=int, help='images processed in parallel')
+        parser.add_argument('--preset', help='output preset, e.g. ecommerce_square')
+        parser.add_argument('--output', help='copy the results ZIP here')
+
+    def handle(self, *args, **options):
+        try:
+            if options['resume']:
+                run = bulk.get_run(options['resume'])
+                if run is None:
+                    raise CommandError(f"Run {options['resume']} not found")
+            elif options['source']:
+                with open(options['source'], 'rb') as f:
+                    # Paths in a local CSV are relative to the CSV itself
+                    run = bulk.BulkRun.create(options['source'], iter(lambda: f.read(1 << 20), b''),
+                                              preset=options['preset'],
+                                              csv_base=os.path.dirname(os.path.abspath(options['source'])))
+            else:
+                raise CommandError('Give a source file or --resume RUN_ID')
+            run.claim()
+        except (OSError, PipelineError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Run {run.run_id}")
+
+        def progress(state):
+            self.stdout.write(f"  {state.get('done', 0)} done, {state.get('failed', 0)} failed", ending='\r')
+
+        try:
+            state = run.process(workers=options['workers'], progress=progress)
+        except PipelineError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('')
+        self.stdout.write(
+            f"{state['status']}: {state['total_entries']} entries, {state['unique_images']} unique, "
+            f"{state['duplicates']} duplicates, {state['invalid']} invalid, "
+            f"{state['done']} enhanced, {state['failed']} failed"
+        )
+        if options['output']:
+            shutil.copyfile(run.results_path, options['output'])
+            self.stdout.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(f"Results: {run.results_path}")
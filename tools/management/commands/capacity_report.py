@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tools import analytics
+
+
+COLUMNS = [
+    ('tool', 'Tool', '{}'),
+    ('model', 'Model', '{}'),
+    ('requests', 'Requests', '{:,}'),
+    ('avg_per_hour', 'Avg/h', '{:.1f}'),
+    ('peak_per_hour', 'Peak/h', '{:,}'),
+    ('p50_seconds', 'p50 s', '{:.2f}'),
+    ('p95_seconds', 'p95 s', '{:.2f}'),
+    ('p99_seconds', 'p99 s', '{:.2f}'),
+    ('cache_hit_rate', 'Cache hits', '{:.1%}'),
+    ('error_rate', 'Errors', '{:.1%}'),
+    ('provider_error_rate', 'Provider err', '{:.1%}'),
+    ('bytes_stored', 'Stored MB', None),
+    ('estimated_cost', 'Est. cost $', '{:,.2f}'),
+]
+
+
+def format_cell(entry, key, fmt):
+    value = entry[key]
+    if value is None:
+        return '-'
+    if key == 'bytes_stored':
+        return f"{value / (1024 * 1024):,.1f}"
+    return fmt.format(value)
+
+
+class Command(BaseCommand):
+    help = "Capacity-planning report from the hourly generation rollups: throughput, latency, cache hits, errors, storage and cost."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='report window (default 7)')
+        parser.add_argument('--tool', help='only this tool')
+        parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+
+    def handle(self, *args, **options):
+        # Include this process's not yet flushed rollups (none for a fresh command)
+        analytics.recorder.flush()
+        entries = analytics.report(days=options['days'], tool=options['tool'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(entries, indent=2))
+            return
+        if not entries:
+            self.stdout.write(f"No generations recorded in the last {options['days']} days.")
+            return
+
+        rows = [[title for _, title, _ in COLUMNS]]
+        rows += [[format_cell(entry, key, fmt) for key, _, fmt in COLUMNS] for entry in entries]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+        self.stdout.write(f"Last {options['days']} days")
+        for row in rows:
+            self.stdout.write('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+        total = sum(entry['estimated_cost'] for entry in entries)
+        self.stdout.write(f"Total estimated cost: ${total:,.2f}")
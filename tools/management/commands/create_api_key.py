@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from tools.models import ApiKey
+
+
+class Command(BaseCommand):
+    help = "Issue an API key for the generation API. The key is printed once and only its hash is stored."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='who or what the key is for')
+        parser.add_argument('--rpm', type=int, default=30, help='requests per minute')
+        parser.add_argument('--concurrent', type=int, default=2, help='concurrent jobs')
+        parser.add_argument('--daily-units', type=int, default=200, help='daily spend units')
+
+    def handle(self, *args, **options):
+        api_key, raw_key = ApiKey.generate(
+            options['name'],
+            requests_per_minute=options['rpm'],
+            max_concurrent_jobs=options['concurrent'],
+            daily_spend_units=options['daily_units'],
+        )
+        self.stdout.write(f"Created API key for {api_key.name}:")
+        self.stdout.write(raw_key)
@@ -0,0 +1,109 @@
+import gc
+import os
+import signal
+import socketserver
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the site from preforked worker processes. The parent imports "
+        "and warms the application once, then forks copy-on-write children "
+        "that share the listening socket."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='127.0.0.1:8000', help='host:port to listen on')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='number of worker processes')
+        parser.add_argument('--access-log', action='store_true', help='log every request')
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError('serve_prefork needs a platform with os.fork()')
+
+        host, _, port = options['bind'].rpartition(':')
+        if not host or not port.isdigit():
+            raise CommandError('--bind must look like host:port')
+
+        from django.core.wsgi import get_wsgi_application
+        from tools import coordination, warmup
+
+        # Uploads, locks and job state must be visible to every worker
+        workers = max(1, options['workers'])
+        if workers > 1 and coordination.get_backend().process_local:
+            raise CommandError(
+                'The coordination backend is local to one process, so workers would not see '
+                "each other's uploads, locks or jobs. Point the \"coordination\" cache at a "
+                'shared backend (e.g. DatabaseCache), set COORDINATION_BACKEND=redis, '
+                'or run with --workers 1.'
+            )
+
+        # Import and compile once in the parent; children inherit it. This runs
+        # synchronously since threads do not survive fork. The provider client
+        # holds sockets and TLS state, so each child builds its own.
+        application = get_wsgi_application()
+        warmup.warm_up(provider=False)
+
+        handler = WSGIRequestHandler if options['access_log'] else QuietRequestHandler
+        server = ThreadingWSGIServer((host, int(port)), handler)
+        server.set_app(application)
+
+        # Move everything imported so far out of the collector's reach so the
+        # children do not dirty the shared pages on their first collection
+        gc.freeze()
+
+        self.stopping = False
+        self.children = set()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for _ in range(workers):
+            self.spawn(server)
+        self.stdout.write(f"Serving on http://{host}:{port}/ with {len(self.children)} workers")
+
+        # Supervise: replace workers that exit until we are asked to stop
+        while self.children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            self.children.discard(pid)
+            if not self.stopping:
+                self.spawn(server)
+
+        server.server_close()
+
+    def spawn(self, server):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                from tools import warmup
+                warmup.start()
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        self.children.add(pid)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.discard(pid)
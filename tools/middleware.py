@@ -0,0 +1,14 @@
+from django.middleware.gzip import GZipMiddleware
+
+
+# Content types worth compressing; images and archives already are
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+
+class TextGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware limited to text and JSON responses."""
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('key_prefix', models.CharField(help_text='First characters of the key, for identification', max_length=12)),
+                ('key_hash', models.CharField(editable=False, max_length=64, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('requests_per_minute', models.PositiveIntegerField(default=30)),
+                ('max_concurrent_jobs', models.PositiveIntegerField(default=2)),
+                ('daily_spend_units', models.PositiveIntegerField(default=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'API key',
+            },
+        ),
+        migrations.CreateModel(
+            name='ApiKeyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('spend_units', models.PositiveIntegerField(default=0)),
+                ('api_key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='tools.apikey')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('api_key', 'day'), name='unique_api_key_usage_day')],
+            },
+        ),
+    ]
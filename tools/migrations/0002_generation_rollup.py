@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tools', '0001_api_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('tool', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=100)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('provider_errors', models.PositiveIntegerField(default=0)),
+                ('cache_hits', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('latency_histogram', models.JSONField(default=list)),
+                ('bytes_stored', models.PositiveBigIntegerField(default=0)),
+                ('cost_units', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tool', 'hour'], name='tools_gener_tool_529171_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'tool', 'model'), name='unique_generation_rollup_hour')],
+            },
+        ),
+    ]
@@ -1,3 +1,87 @@
+import hashlib
+import secrets
+
 from django.db import models
 
-# Create your models here.
+
+class ApiKey(models.Model):
+    """API credential with its quota limits. Only a hash of the key is stored."""
+
+    KEY_PREFIX = 'nbp_'
+
+    name = models.CharField(max_length=100)
+    key_prefix = models.CharField(max_length=12, help_text='First characters of the key, for identification')
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    is_active = models.BooleanField(default=True)
+    requests_per_minute = models.PositiveIntegerField(default=30)
+    max_concurrent_jobs = models.PositiveIntegerField(default=2)
+    daily_spend_units = models.PositiveIntegerField(default=200)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'API key'
+
+    def __str__(self):
+        return f"{self.name} ({self.key_prefix}...)"
+
+    @staticmethod
+    def hash_key(raw_key):
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def generate(cls, name, **limits):
+        """Create a key and return ``(api_key, raw_key)``; the raw key is not stored."""
+        raw_key = cls.KEY_PREFIX + secrets.token_urlsafe(32)
+        api_key = cls.objects.create(
+            name=name,
+            key_prefix=raw_key[:12],
+            key_hash=cls.hash_key(raw_key),
+            **limits,
+        )
+        return api_key, raw_key
+
+
+class ApiKeyUsage(models.Model):
+    """Daily usage per API key, written in batches by tools.quotas."""
+
+    api_key = models.ForeignKey(ApiKey, on_delete=models.CASCADE, related_name='usage')
+    day = models.DateField()
+    requests = models.PositiveIntegerField(default=0)
+    spend_units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['api_key', 'day'], name='unique_api_key_usage_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.api_key.name} {self.day}"
+
+
+class GenerationRollup(models.Model):
+    """
+    Generations aggregated per hour, tool and model, written incrementally
+    by tools.analytics. Reports read these rows, never raw requests.
+    """
+
+    hour = models.DateTimeField()
+    tool = models.CharField(max_length=50)
+    model = models.CharField(max_length=100)
+    requests = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    provider_errors = models.PositiveIntegerField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    # Request counts per tools.analytics.LATENCY_BUCKETS bucket
+    latency_histogram = models.JSONField(default=list)
+    bytes_stored = models.PositiveBigIntegerField(default=0)
+    cost_units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'tool', 'model'], name='unique_generation_rollup_hour'),
+        ]
+        indexes = [models.Index(fields=['tool', 'hour'])]
+
+    def __str__(self):
+        return f"{self.tool} / {self.model} {self.hour:%Y-%m-%d %H:00}"
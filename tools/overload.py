@@ -0,0 +1,157 @@
+"""
+Overload control for the generation API.
+
+When the provider slows down, requests queue for provider slots until every
+server thread is stuck waiting and even static pages stop responding. The
+controller keeps that from happening by failing API requests fast:
+
+- Queueing delay is tracked CoDel-style: the process counts as overloaded
+  once the queue delay has stayed above TARGET_DELAY for a full INTERVAL,
+  and recovers only once it has stayed below target for a full INTERVAL.
+  Slots granted without queueing say nothing about the queue and are not
+  fed in; the standing queue is sampled on every request instead.
+- Generation requests in flight are counted; above SOFT_IN_FLIGHT the queue
+  is shed early, above HARD_IN_FLIGHT everything but cached results is.
+
+Shedding goes by priority class: bulk first, then anonymous, then standard,
+and interactive only at the hard limit. A shed request is answered from a cached or
+near-duplicate result when one exists ("degraded"), otherwise with 503 and
+Retry-After. Page views never pass through the controller.
+"""
+
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .exceptions import PipelineError
+
+
+OVERLOAD_DEFAULTS = {
+    'ENABLED': True,
+    'TARGET_DELAY': 2.0,
+    'INTERVAL': 10.0,
+    'SOFT_IN_FLIGHT': 16,
+    'HARD_IN_FLIGHT': 48,
+    'DEGRADED_QUEUE_TIMEOUT': 5,
+}
+
+
+def overload_setting(name):
+    return getattr(settings, 'OVERLOAD', {}).get(name, OVERLOAD_DEFAULTS[name])
+
+
+class Overloaded(PipelineError):
+    """Raised when a request is shed to protect the server."""
+
+
+class OverloadController:
+    """CoDel-style queue delay tracking plus in-flight counting."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.in_flight = 0
+            self.overloaded = False
+            self._first_above = None
+            self._first_below = None
+            self._last_delay = 0.0
+            self._overloaded_since = None
+            self.stats = {'shed': {}, 'degraded': 0, 'overload_episodes': 0}
+
+    # Signals -----------------------------------------------------------------
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe(self, delay, now=None):
+        """Feed one queueing delay sample (seconds)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._last_delay = delay
+            if delay < overload_setting('TARGET_DELAY'):
+                self._first_above = None
+                if not self.overloaded:
+                    return
+                if self._first_below is None:
+                    self._first_below = now + overload_setting('INTERVAL')
+                elif now >= self._first_below:
+                    self.overloaded = False
+                    self._overloaded_since = None
+                    self._first_below = None
+                return
+
+            self._first_below = None
+            if self._first_above is None:
+                self._first_above = now + overload_setting('INTERVAL')
+            elif now >= self._first_above and not self.overloaded:
+                self.overloaded = True
+                self._overloaded_since = now
+                self.stats['overload_episodes'] += 1
+
+    # Decisions -------------------------------------------------------------
+
+    def should_shed(self, priority):
+        if not overload_setting('ENABLED'):
+            return False
+        with self._lock:
+            in_flight, overloaded = self.in_flight, self.overloaded
+        if in_flight > overload_setting('HARD_IN_FLIGHT'):
+            return True
+        soft = in_flight > overload_setting('SOFT_IN_FLIGHT')
+        if priority == 'bulk':
+            return overloaded or soft
+        if priority == 'anonymous':
+            return overloaded
+        if priority == 'standard':
+            return overloaded and soft
+        return False
+
+    def check_early(self, priority):
+        """Before reading the body: reject when past the hard limit."""
+        if overload_setting('ENABLED') and self.in_flight > overload_setting('HARD_IN_FLIGHT'):
+            self.shed(priority)
+
+    def retry_after(self):
+        # Roughly how long the current queue takes to drain
+        delay = max(self._last_delay, overload_setting('TARGET_DELAY'))
+        return max(1, min(60, math.ceil(delay)))
+
+    def shed(self, priority):
+        with self._lock:
+            self.stats['shed'][priority] = self.stats['shed'].get(priority, 0) + 1
+        raise Overloaded('Server is overloaded. Please try again shortly.', status=503,
+                         headers={'Retry-After': self.retry_after()})
+
+    def record_degraded(self):
+        with self._lock:
+            self.stats['degraded'] += 1
+
+    def queue_timeout(self, default):
+        """Wait less for a provider slot while overloaded."""
+        if self.overloaded:
+            return min(default, overload_setting('DEGRADED_QUEUE_TIMEOUT'))
+        return default
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'overloaded': self.overloaded,
+                'in_flight': self.in_flight,
+                'queue_delay': round(self._last_delay, 3),
+                'shed': dict(self.stats['shed']),
+                'degraded': self.stats['degraded'],
+                'overload_episodes': self.stats['overload_episodes'],
+            }
+
+
+controller = OverloadController()
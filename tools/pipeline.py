@@ -0,0 +1,811 @@
+"""
+Declarative generation pipeline shared by every image API endpoint.
+
+Each tool is described by a ToolSpec (input parsing, prompt builder, provider
+call, post-processing) and registered by name. Requests then flow through a
+fixed chain of shared stages - metrics, caching, throttling and storage -
+before reaching the provider, so a feature added to a stage applies to every
+tool at once.
+
+SimplerLLM is imported only when a provider call is made, so management
+commands and freshly forked workers do not pay for the SDK import.
+
+The provider always returns the image in memory. By default it is written to
+``generated_images/`` and its URL returned as JSON; API clients that only want
+the bytes can ask for ``?response=bytes`` (or ``stream``, or send
+``Accept: image/png``) and get the image in the response body, with the disk
+write moved off the request path (see ``WRITE_BEHIND``).
+
+Every stored result is also published to the coordination backend, so with
+several app servers any node can serve, edit or cache-hit a result another
+node produced (from a shared MEDIA_ROOT, or from the index itself when
+COORDINATION['REPLICATE_RESULTS'] is on).
+"""
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from . import analytics, coordination, imaging, overload, quotas, references, scheduler, tracing
+from .exceptions import PipelineError
+
+
+ALLOWED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp']
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB in bytes
+
+PIPELINE_DEFAULTS = {
+    'CACHE_TIMEOUT': 60 * 60,
+    'MAX_CONCURRENT_PROVIDER_CALLS': 8,
+    'THROTTLE_TIMEOUT': 30,
+    'WRITE_BEHIND': True,
+    'SINGLE_FLIGHT_TIMEOUT': 120,
+    'POSTPROCESS_WORKERS': 2,
+    'POSTPROCESS_TIMEOUT': 30,
+    'WATERMARK_PATH': None,
+    'FONT_PATH': None,
+}
+
+RESPONSE_MODES = ('json', 'bytes', 'stream')
+# Seconds a single-flight waiter gives a write-behind store to land
+WRITE_BEHIND_WAIT = 5
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def pipeline_setting(name):
+    """Return a GENERATION_PIPELINE setting, falling back to the defaults."""
+    return getattr(settings, 'GENERATION_PIPELINE', {}).get(name, PIPELINE_DEFAULTS[name])
+
+
+@dataclass
+class ToolSpec:
+    """Declarative description of one image tool."""
+
+    name: str
+    parse: Callable
+    build_prompt: Callable
+    invoke: Callable
+    output_prefix: Optional[str] = None
+    # SimplerLLM ImageSize value, resolved to the enum at call time
+    size: str = 'horizontal'
+    model: Optional[str] = None
+    postprocess: list = field(default_factory=list)
+    cacheable: bool = True
+    # Daily quota units charged per provider call (cache hits are free)
+    cost_units: int = 1
+
+    def __post_init__(self):
+        if self.output_prefix is None:
+            self.output_prefix = self.name
+
+
+def validate_upload(uploaded_file):
+    """Check an uploaded image's type and size; return its extension."""
+    # Validate file type
+    file_ext = os.path.splitext(uploaded_file.name)[1].lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise PipelineError(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}')
+
+    # Validate file size (max 10MB)
+    if uploaded_file.size > MAX_UPLOAD_SIZE:
+        raise PipelineError('File size too large. Maximum size is 10MB.')
+    return file_ext
+
+
+class GenerationJob:
+    """Mutable state threaded through the pipeline for a single request."""
+
+    def __init__(self, spec, request):
+        self.spec = spec
+        self.request = request
+        self.params = {}
+        self.sources = []
+        self.digests = []
+        self.temp_paths = []
+        self.prompt = None
+        self.size = spec.size
+        self.model = spec.model
+        self.output_filename = None
+        self.output_path = None
+        self.cache_hit = False
+        self.extra = {}
+        self.response_mode = 'json'
+        self.image_bytes = None
+        self.principal = None
+        self.response_headers = {}
+        self.job_id = uuid.uuid4().hex
+        self.priority = 'standard'
+        self.cost_units = spec.cost_units
+        self.provider_error = False
+        self.bytes_stored = 0
+        # Callables run with (job, payload) once the job has succeeded
+        self.on_success = []
+
+    @property
+    def inline(self):
+        return self.response_mode != 'json'
+
+    def validate_upload(self, uploaded_file):
+        """Check an uploaded image's type and size; return its extension."""
+        return validate_upload(uploaded_file)
+
+    def save_upload(self, uploaded_file, prefix):
+        """Validate an uploaded image and save it as a provider source."""
+        file_ext = self.validate_upload(uploaded_file)
+
+        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+
+        # Save the upload, hashing it on the way through for the cache key
+        temp_path = os.path.join(upload_dir, f"{prefix}_{uuid.uuid4().hex}{file_ext}")
+        self.temp_paths.append(temp_path)
+        digest = hashlib.sha256()
+        with tracing.span('upload.save', **{'upload.bytes': uploaded_file.size}):
+            with open(temp_path, 'wb+') as destination:
+                for chunk in uploaded_file.chunks():
+                    digest.update(chunk)
+                    destination.write(chunk)
+
+        self.sources.append(temp_path)
+        self.digests.append(digest.hexdigest())
+        return temp_path
+
+    def read_upload(self, uploaded_file):
+        """Validate an uploaded image and return its bytes without saving it."""
+        self.validate_upload(uploaded_file)
+        return b''.join(uploaded_file.chunks())
+
+    def save_bytes(self, data, prefix, file_ext='.png', digest=None):
+        """Save server-side produced image bytes as a provider source."""
+        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+
+        temp_path = os.path.join(upload_dir, f"{prefix}_{uuid.uuid4().hex}{file_ext}")
+        self.temp_paths.append(temp_path)
+        with open(temp_path, 'wb') as destination:
+            destination.write(data)
+
+        self.sources.append(temp_path)
+        self.digests.append(digest or hashlib.sha256(data).hexdigest())
+        return temp_path
+
+    def use_upload(self, upload_id):
+        """Use a finalized resumable upload as a provider source, in place."""
+        from . import uploads
+
+        state = uploads.resolve(upload_id, self.principal.id if self.principal else None)
+        self.sources.append(state['path'])
+        self.digests.append(state['sha256'])
+        return state['path']
+
+    def take_image(self, prefix):
+        """
+        Add the request's image - an ``image`` file or the ``upload_id`` of a
+        resumable upload - as a source; return False if it sent neither.
+        """
+        if 'image' in self.request.FILES:
+            self.save_upload(self.request.FILES['image'], prefix)
+        elif self.request.POST.get('upload_id', '').strip():
+            self.use_upload(self.request.POST['upload_id'].strip())
+        else:
+            return False
+        return True
+
+    def use_reference(self, ref_id):
+        """Use a registered reference image, straight from memory, as a provider source."""
+        entry = references.lookup(ref_id, self.principal.id if self.principal else None)
+        if entry is None:
+            raise PipelineError('Reference image not found or expired. Please register it again.', status=404)
+        self.sources.append(entry['data'])
+        self.digests.append(f"reference:{entry['id']}")
+        return entry
+
+    def add_references(self, uploaded_files=(), ref_ids=()):
+        """
+        Compose extra reference images (uploaded files, then registered ids)
+        after the sources already added. Files are ingested in parallel
+        through the reference cache; the count and combined sizes are capped.
+        """
+        uploaded_files, ref_ids = list(uploaded_files), list(ref_ids)
+        limit = references.reference_setting('MAX_PER_REQUEST')
+        if len(self.sources) + len(uploaded_files) + len(ref_ids) > limit:
+            raise PipelineError(f'Too many reference images. Maximum is {limit} per request.')
+        for uploaded_file in uploaded_files:
+            self.validate_upload(uploaded_file)
+        if sum(f.size for f in uploaded_files) > references.reference_setting('MAX_UPLOAD_BYTES'):
+            raise PipelineError('Reference images are too large in total.', status=413)
+
+        try:
+            entries = references.register_many(uploaded_files, self.principal.id if self.principal else None)
+        except OSError:
+            raise PipelineError('Could not read a reference image. Please upload valid JPG, PNG or WEBP files.')
+        for entry in entries:
+            self.sources.append(entry['data'])
+            self.digests.append(f"reference:{entry['id']}")
+        for ref_id in ref_ids:
+            self.use_reference(ref_id)
+
+        total = sum(len(s) if isinstance(s, bytes) else os.path.getsize(s) for s in self.sources)
+        if total > references.reference_setting('MAX_PROVIDER_BYTES'):
+            raise PipelineError('Reference images are too large in total. Please send fewer or smaller images.',
+                                status=413)
+        return len(entries) + len(ref_ids)
+
+    def use_generated_image(self, filename):
+        """Use a previously generated image (from any node) as a provider source."""
+        filename = os.path.basename(filename)
+        path = ensure_local_result(filename)
+        if path is None:
+            raise PipelineError('Referenced image not found. Please upload a new image.')
+        # Generated images are immutable, so the name identifies the content
+        self.sources.append(path)
+        self.digests.append(f"generated:{filename}")
+        return path
+
+    def cache_key(self):
+        parts = [self.spec.name, self.prompt or '', self.size, self.model or '', *self.digests]
+        return 'generation:' + hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def similar_key(self):
+        """Looser key ignoring size, model and prompt case/punctuation - what
+        degraded mode accepts as a near-duplicate result."""
+        prompt = ' '.join(''.join(c if c.isalnum() else ' ' for c in (self.prompt or '').lower()).split())
+        parts = [self.spec.name, prompt, *self.digests]
+        return 'similar:' + hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def cleanup(self):
+        for path in self.temp_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.temp_paths = []
+
+
+def generated_image_path(filename):
+    return os.path.join(settings.MEDIA_ROOT, 'generated_images', filename)
+
+
+def generated_image_url(filename):
+    return f"{settings.MEDIA_URL}generated_images/{filename}"
+
+
+def result_available(filename):
+    """True if the result is on this node or in the shared result index."""
+    return (os.path.exists(generated_image_path(filename))
+            or coordination.get_backend().has_result(filename))
+
+
+def wait_for_result(filename, timeout):
+    """Wait for a result that may still be written behind; False if it never shows up."""
+    deadline = time.monotonic() + timeout
+    while not result_available(filename):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def ensure_local_result(filename):
+    """Return a local path for a result, copying it from the index if needed."""
+    path = generated_image_path(filename)
+    if os.path.exists(path):
+        return path
+    data = coordination.get_backend().fetch_result(filename)
+    if data is None:
+        return None
+    write_image(path, data)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# Tool registry
+# ---------------------------------------------------------------------------
+
+TOOLS = {}
+
+
+def register_tool(spec):
+    """Register a ToolSpec so it is served by the pipeline."""
+    TOOLS[spec.name] = spec
+    return spec
+
+
+def get_tool(name):
+    return TOOLS.get(name)
+
+
+# ---------------------------------------------------------------------------
+# Provider calls
+# ---------------------------------------------------------------------------
+
+_image_generator = None
+_image_generator_lock = threading.Lock()
+
+
+def get_image_generator():
+    """Return the shared image generator used for provider calls."""
+    global _image_generator
+    with _image_generator_lock:
+        if _image_generator is None:
+            from SimplerLLM import ImageGenerator, ImageProvider
+            _image_generator = ImageGenerator.create(provider=ImageProvider.GOOGLE_GEMINI)
+        return _image_generator
+
+
+def provider_size(size):
+    """Map a size name such as 'horizontal' onto SimplerLLM's ImageSize."""
+    from SimplerLLM import ImageSize
+    return ImageSize(size)
+
+
+def generate_image(img_gen, job):
+    """Provider call for text prompts, optionally with reference images."""
+    kwargs = {
+        'prompt': job.prompt,
+        'size': provider_size(job.size),
+        'output_format': 'bytes',
+    }
+    if job.sources:
+        kwargs['reference_images'] = list(job.sources)
+    if job.model:
+        kwargs['model'] = job.model
+    job.image_bytes = img_gen.generate_image(**kwargs)
+
+
+def edit_image(img_gen, job):
+    """Provider call that edits the first source image."""
+    kwargs = {
+        'image_source': job.sources[0],
+        'edit_prompt': job.prompt,
+        'size': provider_size(job.size),
+        'output_format': 'bytes',
+    }
+    if job.model:
+        kwargs['model'] = job.model
+    job.image_bytes = img_gen.edit_image(**kwargs)
+
+
+def call_provider(job):
+    with tracing.span('provider.call', **{'provider.model': job.model or 'default', 'provider.size': job.size}):
+        try:
+            job.spec.invoke(get_image_generator(), job)
+        except Exception:
+            job.provider_error = True
+            raise
+
+
+# ---------------------------------------------------------------------------
+# Shared stages
+# ---------------------------------------------------------------------------
+
+class PipelineMetrics:
+    """Thread-safe in-process counters per tool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools = {}
+
+    def record(self, tool, duration, success, cache_hit=False):
+        with self._lock:
+            stats = self._stats(tool)
+            stats['requests'] += 1
+            stats['total_seconds'] += duration
+            if not success:
+                stats['errors'] += 1
+            if cache_hit:
+                stats['cache_hits'] += 1
+
+    def record_rejection(self, tool):
+        with self._lock:
+            self._stats(tool)['rejected'] += 1
+
+    def _stats(self, tool):
+        return self._tools.setdefault(tool, {
+            'requests': 0, 'errors': 0, 'rejected': 0, 'cache_hits': 0, 'total_seconds': 0.0,
+        })
+
+    def snapshot(self):
+        with self._lock:
+            return {tool: dict(stats) for tool, stats in self._tools.items()}
+
+    def reset(self):
+        with self._lock:
+            self._tools.clear()
+
+
+metrics = PipelineMetrics()
+
+
+def quota_stage(job, call_next):
+    """Enforce the caller's rate, concurrency and daily spend quotas."""
+    job.response_headers.update(quotas.accountant.admit(job.principal, job.cost_units))
+    spent = 0
+    try:
+        payload = call_next()
+        if not job.cache_hit:
+            spent = job.cost_units
+        return payload
+    finally:
+        job.response_headers.update(quotas.accountant.release(job.principal, spent))
+
+
+def metrics_stage(job, call_next):
+    """
+    Record latency, errors and cache hits per tool, live and in the hourly
+    rollups. Deliberate rejections (validation, quota 429, overload 503) are
+    only counted live as ``rejected``: they are neither errors nor latency
+    samples.
+    """
+    started = time.monotonic()
+    success = False
+    try:
+        payload = call_next()
+        success = True
+        return payload
+    except PipelineError:
+        if not job.provider_error:
+            metrics.record_rejection(job.spec.name)
+            success = None
+        raise
+    finally:
+        if success is not None:
+            record_generation(job, time.monotonic() - started, success)
+
+
+def record_generation(job, duration, success):
+    """Count a finished generation in the live metrics and the analytics rollups."""
+    metrics.record(job.spec.name, duration, success, job.cache_hit)
+    analytics.recorder.record(
+        job.spec.name, job.model or 'default', duration, success,
+        cache_hit=job.cache_hit,
+        provider_error=job.provider_error,
+        bytes_stored=job.bytes_stored,
+        cost_units=job.cost_units if success and not job.cache_hit else 0,
+    )
+
+
+def serve_stored_result(job, filename):
+    """Answer the job with an existing result; None if it is not available."""
+    if not filename or not result_available(filename):
+        return None
+    job.cache_hit = True
+    job.output_filename = filename
+    job.output_path = ensure_local_result(filename) if job.inline else generated_image_path(filename)
+    return {
+        'success': True,
+        'image_url': generated_image_url(filename),
+        'filename': filename,
+    }
+
+
+def cache_stage(job, call_next):
+    """Serve identical requests from a previously generated image."""
+    timeout = pipeline_setting('CACHE_TIMEOUT')
+    if not job.spec.cacheable or not timeout:
+        return call_next()
+
+    key = job.cache_key()
+    backend = coordination.get_backend()
+
+    payload = serve_stored_result(job, backend.get(backend.key('cache', key)))
+    if payload:
+        return payload
+
+    def single_flight():
+        # A result the previous holder is still writing behind is worth a
+        # short wait; anything else means generating it again
+        filename = backend.get(backend.key('cache', key))
+        if filename and wait_for_result(filename, WRITE_BEHIND_WAIT):
+            payload = serve_stored_result(job, filename)
+            if payload:
+                return payload
+        payload = call_next()
+        if payload.get('filename') and not job.cache_hit:
+            # Recorded before the lock is released, so waiters find it
+            backend.set(backend.key('cache', key), payload['filename'], timeout)
+            backend.set(backend.key('similar', job.similar_key()), payload['filename'], timeout)
+        return payload
+
+    # Single-flight: identical requests on any node wait for the first one
+    # instead of each calling the provider
+    try:
+        with backend.lock(key, ttl=pipeline_setting('SINGLE_FLIGHT_TIMEOUT'),
+                          timeout=pipeline_setting('SINGLE_FLIGHT_TIMEOUT')):
+            return single_flight()
+    except coordination.LockTimeout:
+        return single_flight()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide provider slot scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = scheduler.PriorityScheduler(pipeline_setting('MAX_CONCURRENT_PROVIDER_CALLS'))
+        return _scheduler
+
+
+def overload_stage(job, call_next):
+    """Shed cache misses early while overloaded, serving a near-duplicate if one exists."""
+    controls = overload.controller
+    controls.observe(get_scheduler().oldest_wait())
+    if not controls.should_shed(job.priority):
+        return call_next()
+
+    backend = coordination.get_backend()
+    payload = serve_stored_result(job, backend.get(backend.key('similar', job.similar_key())))
+    if payload is None:
+        controls.shed(job.priority)
+    controls.record_degraded()
+    job.extra['degraded'] = True
+    return payload
+
+
+def throttle_stage(job, call_next):
+    """Queue for one of this process's provider slots by priority class."""
+    slots = get_scheduler()
+    controls = overload.controller
+    timeout = controls.queue_timeout(pipeline_setting('THROTTLE_TIMEOUT'))
+    try:
+        waited = slots.acquire(job.priority, timeout)
+    except scheduler.SchedulerTimeout:
+        controls.observe(timeout)
+        raise PipelineError('Server is busy. Please try again shortly.', status=503,
+                            headers={'Retry-After': controls.retry_after()})
+    if waited:
+        # An immediate grant (free or reserved slot) is no queue delay sample
+        controls.observe(waited)
+    job.response_headers['X-Queue-Class'] = job.priority
+    job.response_headers['X-Queue-Wait-Ms'] = int(waited * 1000)
+    try:
+        return call_next()
+    finally:
+        slots.release(job.priority)
+
+
+def write_image(path, data):
+    """Write image bytes atomically so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{uuid.uuid4().hex}.part"
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+def store_result(filename, data):
+    """Write a result locally and publish it to the shared result index."""
+    with tracing.span('storage.write', **{'storage.bytes': len(data)}):
+        write_image(generated_image_path(filename), data)
+    with tracing.span('storage.publish'):
+        coordination.get_backend().publish_result(filename, data)
+
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+
+def _get_write_behind():
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = ThreadPoolExecutor(max_workers=2, thread_name_prefix='write-behind')
+        return _write_behind
+
+
+def drain_write_behind():
+    """Wait for queued write-behind stores to finish (tests, shutdown)."""
+    global _write_behind
+    with _write_behind_lock:
+        executor, _write_behind = _write_behind, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+_postprocess_pool = None
+_postprocess_pool_lock = threading.Lock()
+
+
+def _get_postprocess_pool():
+    global _postprocess_pool
+    with _postprocess_pool_lock:
+        if _postprocess_pool is None:
+            # Spawned workers import only tools.imaging - no Django, no fork of
+            # a threaded server
+            _postprocess_pool = ProcessPoolExecutor(
+                max_workers=pipeline_setting('POSTPROCESS_WORKERS'),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _postprocess_pool
+
+
+def postprocess_output(job):
+    """
+    Apply the requested output options (preset, watermark, title).
+
+    Pillow work is CPU-bound and holds the GIL, so it runs in a process pool;
+    POSTPROCESS_WORKERS = 0 runs it in the request thread instead.
+    """
+    options = job.params.get('output')
+    if not options:
+        return
+
+    kwargs = dict(options, font_path=pipeline_setting('FONT_PATH'))
+    with tracing.span('postprocess', **{'postprocess.preset': options['preset'] or ''}):
+        if not pipeline_setting('POSTPROCESS_WORKERS'):
+            job.image_bytes = imaging.postprocess(job.image_bytes, **kwargs)
+            return
+
+        global _postprocess_pool
+        try:
+            future = _get_postprocess_pool().submit(imaging.postprocess, job.image_bytes, **kwargs)
+            job.image_bytes = future.result(timeout=pipeline_setting('POSTPROCESS_TIMEOUT'))
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next request
+            with _postprocess_pool_lock:
+                _postprocess_pool = None
+            raise
+
+
+def storage_stage(job, call_next):
+    """Run post-processing on the provider output and store it."""
+    call_next()
+
+    for step in job.spec.postprocess:
+        step(job)
+
+    job.output_filename = f"{job.spec.output_prefix}_{uuid.uuid4().hex}.png"
+    job.output_path = generated_image_path(job.output_filename)
+
+    if job.inline:
+        # The bytes go back in this response; storing them is optional and
+        # happens off the request path
+        if not pipeline_setting('WRITE_BEHIND'):
+            job.output_filename = job.output_path = None
+            return {'success': True}
+        _get_write_behind().submit(tracing.wrap(store_result), job.output_filename, job.image_bytes)
+    else:
+        store_result(job.output_filename, job.image_bytes)
+    job.bytes_stored = len(job.image_bytes)
+
+    return {
+        'success': True,
+        'image_url': generated_image_url(job.output_filename),
+        'filename': job.output_filename,
+    }
+
+
+# Outermost first; the provider call sits at the end of the chain.
+STAGES = [metrics_stage, quota_stage, cache_stage, overload_stage, throttle_stage, storage_stage]
+
+
+def run_pipeline(job, stages=None):
+    """Run the job through the stage chain and return the response payload."""
+    stages = STAGES if stages is None else stages
+
+    def dispatch(index):
+        if index == len(stages):
+            return call_provider(job)
+        stage = stages[index]
+        with tracing.span(f"stage.{stage.__name__.removesuffix('_stage')}"):
+            return stage(job, lambda: dispatch(index + 1))
+
+    return dispatch(0)
+
+
+def response_mode(request):
+    """Pick JSON (URL only), raw bytes or a chunked stream for the image."""
+    mode = request.GET.get('response', '').lower()
+    if mode in RESPONSE_MODES:
+        return mode
+    if request.headers.get('Accept', '').split(',')[0].strip() == 'image/png':
+        return 'bytes'
+    return 'json'
+
+
+def image_response(job, payload):
+    """Return the generated image itself, with the JSON fields as headers."""
+    if job.image_bytes is None:
+        # Cache hit - stream the stored file straight from disk
+        response = FileResponse(open(job.output_path, 'rb'), content_type='image/png')
+    elif job.response_mode == 'stream':
+        data = job.image_bytes
+        chunks = (data[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(data), STREAM_CHUNK_SIZE))
+        response = StreamingHttpResponse(chunks, content_type='image/png')
+    else:
+        response = HttpResponse(job.image_bytes, content_type='image/png')
+
+    if payload.get('filename'):
+        response['X-Image-Filename'] = payload['filename']
+        response['X-Image-Url'] = payload['image_url']
+    for key, value in job.extra.items():
+        response['X-' + key.replace('_', '-').title()] = str(value)
+    return response
+
+
+def handle(request, spec):
+    """Execute a tool spec for a request and return the response."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    job = GenerationJob(spec, request)
+    job.response_mode = response_mode(request)
+    job.extra['job_id'] = job.job_id
+    jobs = coordination.get_backend()
+    started = False
+    overload.controller.enter()
+    root = tracing.current_span()
+    if root is not None:
+        root.set_attribute('tool.name', spec.name)
+        root.set_attribute('job.id', job.job_id)
+    try:
+        job.principal = quotas.authenticate(request)
+        job.priority = scheduler.classify(request, job.principal)
+        overload.controller.check_early(job.priority)
+        if request.content_type.startswith('multipart/'):
+            # Parse the multipart body up front so its cost gets its own span
+            with tracing.span('upload.parse_body', **{'http.request_content_length':
+                                                      request.META.get('CONTENT_LENGTH', '')}):
+                request.POST, request.FILES
+        with tracing.span('parse'):
+            spec.parse(job)
+        job.prompt = spec.build_prompt(job)
+        jobs.set_job_state(job.job_id, tool=spec.name, status='running',
+                           trace_id=root.trace_id if root is not None else None)
+        started = True
+        payload = run_pipeline(job)
+        for callback in job.on_success:
+            callback(job, payload)
+        jobs.set_job_state(job.job_id, status='succeeded', filename=payload.get('filename'))
+        if job.inline:
+            response = image_response(job, payload)
+        else:
+            payload.update(job.extra)
+            response = JsonResponse(payload)
+    except PipelineError as e:
+        if started:
+            jobs.set_job_state(job.job_id, status='failed', error=e.message, http_status=e.status)
+        response = JsonResponse({'error': e.message}, status=e.status)
+        job.response_headers.update(e.headers)
+    except Exception as e:
+        jobs.set_job_state(job.job_id, tool=spec.name, status='failed', error=str(e))
+        error = {
+            'error': str(e),
+            'success': False
+        }
+        if root is not None:
+            root.record_exception(e)
+            error['trace_id'] = root.trace_id
+        response = JsonResponse(error, status=500)
+    finally:
+        job.cleanup()
+        overload.controller.leave()
+
+    for header, value in job.response_headers.items():
+        response[header] = str(value)
+    return response
+
+
+def api_view(name):
+    """Build a CSRF-exempt API view for the registered tool ``name``."""
+    @csrf_exempt
+    def view(request):
+        return handle(request, get_tool(name))
+
+    view.__name__ = f"api_{name}"
+    view.__doc__ = f"API endpoint for the {name} tool."
+    return view
@@ -0,0 +1,394 @@
+"""
+API-key authentication and per-caller quotas for the generation API.
+
+Every request is attributed to a principal: an ApiKey (``X-API-Key`` or
+``Authorization: Bearer``) or, unless QUOTAS['REQUIRE_API_KEY'] is set, the
+client IP with the anonymous limits. Each principal has a requests-per-minute
+limit, a concurrent job limit and a daily spend budget.
+
+Enforcement never touches the database on the request path: usage is counted
+in sharded in-memory counters and flushed to ApiKeyUsage in one batch every
+FLUSH_INTERVAL seconds by a background thread. After a flush each process
+re-reads the daily totals, which is how usage from other processes becomes
+visible. A failed flush is logged and its usage re-queued for the next one;
+requests never wait on it. Each flush also drops counters for past days and
+principals with nothing in flight.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .exceptions import PipelineError
+
+
+logger = logging.getLogger(__name__)
+
+QUOTA_DEFAULTS = {
+    'REQUIRE_API_KEY': False,
+    'ANONYMOUS_REQUESTS_PER_MINUTE': 10,
+    'ANONYMOUS_MAX_CONCURRENT_JOBS': 2,
+    'ANONYMOUS_DAILY_SPEND_UNITS': 100,
+    'FLUSH_INTERVAL': 10,
+    'KEY_CACHE_TIMEOUT': 60,
+    'SHARDS': 16,
+}
+
+
+def quota_setting(name):
+    return getattr(settings, 'QUOTAS', {}).get(name, QUOTA_DEFAULTS[name])
+
+
+class QuotaExceeded(PipelineError):
+    """Raised when a request is unauthenticated or over one of its quotas."""
+
+
+Principal = namedtuple('Principal', [
+    'id', 'api_key_id', 'requests_per_minute', 'max_concurrent_jobs', 'daily_spend_units',
+])
+
+
+class ShardedCounter:
+    """Integer counters spread over several locks to keep contention low."""
+
+    def __init__(self, shards=16):
+        self._shards = [(threading.Lock(), {}) for _ in range(max(1, shards))]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def add(self, key, amount=1):
+        lock, values = self._shard(key)
+        with lock:
+            values[key] = values.get(key, 0) + amount
+            return values[key]
+
+    def get(self, key):
+        lock, values = self._shard(key)
+        with lock:
+            return values.get(key, 0)
+
+    def set(self, key, value):
+        lock, values = self._shard(key)
+        with lock:
+            values[key] = value
+
+    def drain(self):
+        """Return and clear every counter."""
+        drained = {}
+        for lock, values in self._shards:
+            with lock:
+                drained.update(values)
+                values.clear()
+        return drained
+
+    def prune(self, keep):
+        """Drop counters whose key does not satisfy ``keep``."""
+        for lock, values in self._shards:
+            with lock:
+                for key in [k for k in values if not keep(k)]:
+                    del values[key]
+
+    def prune_zero(self):
+        """Drop counters that are back at zero."""
+        for lock, values in self._shards:
+            with lock:
+                for key in [k for k, v in values.items() if not v]:
+                    del values[key]
+
+
+# ---------------------------------------------------------------------------
+# Authentication
+# ---------------------------------------------------------------------------
+
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
+
+def _lookup_key(raw_key):
+    """Resolve a raw key to a Principal, caching the DB lookup briefly."""
+    from .models import ApiKey
+
+    key_hash = ApiKey.hash_key(raw_key)
+    now = time.monotonic()
+    with _key_cache_lock:
+        cached = _key_cache.get(key_hash)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    api_key = ApiKey.objects.filter(key_hash=key_hash, is_active=True).first()
+    principal = None
+    if api_key is not None:
+        principal = Principal(
+            id=f"key:{api_key.pk}",
+            api_key_id=api_key.pk,
+            requests_per_minute=api_key.requests_per_minute,
+            max_concurrent_jobs=api_key.max_concurrent_jobs,
+            daily_spend_units=api_key.daily_spend_units,
+        )
+    with _key_cache_lock:
+        _key_cache[key_hash] = (principal, now + quota_setting('KEY_CACHE_TIMEOUT'))
+    return principal
+
+
+def authenticate(request):
+    """Return the Principal for a request or raise QuotaExceeded (401)."""
+    raw_key = request.headers.get('X-API-Key', '').strip()
+    if not raw_key:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            raw_key = credentials.strip()
+
+    if raw_key:
+        principal = _lookup_key(raw_key)
+        if principal is None:
+            raise QuotaExceeded('Invalid API key', status=401)
+        return principal
+
+    if quota_setting('REQUIRE_API_KEY'):
+        raise QuotaExceeded('API key required', status=401, headers={'WWW-Authenticate': 'Bearer'})
+
+    return Principal(
+        id=f"ip:{request.META.get('REMOTE_ADDR', '')}",
+        api_key_id=None,
+        requests_per_minute=quota_setting('ANONYMOUS_REQUESTS_PER_MINUTE'),
+        max_concurrent_jobs=quota_setting('ANONYMOUS_MAX_CONCURRENT_JOBS'),
+        daily_spend_units=quota_setting('ANONYMOUS_DAILY_SPEND_UNITS'),
+    )
+
+
+# ---------------------------------------------------------------------------
+# Accounting
+# ---------------------------------------------------------------------------
+
+class QuotaAccountant:
+    """In-memory quota enforcement with periodic batched persistence."""
+
+    def __init__(self, shards=16):
+        self._shards = shards
+        self._flush_lock = threading.Lock()
+        self._interval_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.minute_requests = ShardedCounter(self._shards)   # (principal, minute)
+        self.in_flight = ShardedCounter(self._shards)          # principal
+        self.daily_spend = ShardedCounter(self._shards)        # (principal, day)
+        self.pending_requests = ShardedCounter(self._shards)   # (api_key_id, day)
+        self.pending_spend = ShardedCounter(self._shards)      # (api_key_id, day)
+        self._loaded_days = set()
+        self._last_flush = time.monotonic()
+
+    def _load_daily_spend(self, principal, day):
+        """Seed the daily counter from the DB once per key, day and process."""
+        if principal.api_key_id is None or (principal.id, day) in self._loaded_days:
+            return
+        from .models import ApiKeyUsage
+
+        self._loaded_days.add((principal.id, day))
+        stored = (ApiKeyUsage.objects.filter(api_key_id=principal.api_key_id, day=day)
+                  .values_list('spend_units', flat=True).first())
+        if stored:
+            self.daily_spend.add((principal.id, day), stored)
+
+    def _headers(self, principal, minute_count, day):
+        spent = self.daily_spend.get((principal.id, day))
+        return {
+            'X-RateLimit-Limit': principal.requests_per_minute,
+            'X-RateLimit-Remaining': max(0, principal.requests_per_minute - minute_count),
+            'X-RateLimit-Reset': 60 - int(time.time()) % 60,
+            'X-Quota-Concurrent-Limit': principal.max_concurrent_jobs,
+            'X-Quota-Daily-Limit': principal.daily_spend_units,
+            'X-Quota-Daily-Remaining': max(0, principal.daily_spend_units - spent),
+        }
+
+    def admit(self, principal, cost_units):
+        """Reserve a slot for one request; return the quota headers."""
+        minute = int(time.time()) // 60
+        day = timezone.now().date()
+        self._load_daily_spend(principal, day)
+
+        minute_count = self.minute_requests.add((principal.id, minute))
+        headers = self._headers(principal, minute_count, day)
+        if minute_count > principal.requests_per_minute:
+            self.minute_requests.add((principal.id, minute), -1)
+            headers['Retry-After'] = headers['X-RateLimit-Reset']
+            raise QuotaExceeded('Rate limit exceeded. Please slow down.', status=429, headers=headers)
+
+        if self.daily_spend.get((principal.id, day)) + cost_units > principal.daily_spend_units:
+            headers['Retry-After'] = 24 * 60 * 60 - int(time.time()) % (24 * 60 * 60)
+            raise QuotaExceeded('Daily quota exhausted.', status=429, headers=headers)
+
+        if self.in_flight.add(principal.id) > principal.max_concurrent_jobs:
+            self.in_flight.add(principal.id, -1)
+            headers['Retry-After'] = 1
+            raise QuotaExceeded('Too many concurrent requests.', status=429, headers=headers)
+
+        if principal.api_key_id is not None:
+            self.pending_requests.add((principal.api_key_id, day))
+        return headers
+
+    def release(self, principal, spent_units):
+        """Finish a request admitted by ``admit``; return updated headers."""
+        self.in_flight.add(principal.id, -1)
+        return {'X-Quota-Daily-Remaining': self.charge(principal, spent_units)}
+
+    def charge(self, principal, spent_units):
+        """Add spend for a principal; return the units left today."""
+        day = timezone.now().date()
+        if spent_units:
+            self.daily_spend.add((principal.id, day), spent_units)
+            if principal.api_key_id is not None:
+                self.pending_spend.add((principal.api_key_id, day), spent_units)
+        self.maybe_flush()
+        return self.remaining_spend(principal)
+
+    def reserve(self, principal, cost_units):
+        """
+        Take ``cost_units`` of today's budget before starting work that is
+        not admitted per request (bulk runs); False if it does not fit.
+        Settle afterwards with ``charge`` (negative units give some back).
+        """
+        day = timezone.now().date()
+        self._load_daily_spend(principal, day)
+        if self.daily_spend.add((principal.id, day), cost_units) > principal.daily_spend_units:
+            self.daily_spend.add((principal.id, day), -cost_units)
+            return False
+        if principal.api_key_id is not None:
+            self.pending_spend.add((principal.api_key_id, day), cost_units)
+        self.maybe_flush()
+        return True
+
+    def remaining_spend(self, principal):
+        day = timezone.now().date()
+        self._load_daily_spend(principal, day)
+        return max(0, principal.daily_spend_units - self.daily_spend.get((principal.id, day)))
+
+    def maybe_flush(self):
+        """Queue a background flush once FLUSH_INTERVAL has passed."""
+        with self._interval_lock:
+            if time.monotonic() - self._last_flush < quota_setting('FLUSH_INTERVAL'):
+                return
+            # Claim the interval so a burst of requests queues a single flush
+            self._last_flush = time.monotonic()
+        _get_flusher().submit(self._background_flush)
+
+    def _background_flush(self):
+        close_old_connections()
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        """Write pending usage to the DB in one transaction and resync totals."""
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = time.monotonic()
+            requests = self.pending_requests.drain()
+            spend = self.pending_spend.drain()
+
+            self._prune()
+
+            if not requests and not spend:
+                return
+            try:
+                self._write(requests, spend)
+            except Exception:
+                logger.exception('Quota usage flush failed; re-queueing %d entries',
+                                 len(set(requests) | set(spend)))
+                for key, value in requests.items():
+                    self.pending_requests.add(key, value)
+                for key, value in spend.items():
+                    self.pending_spend.add(key, value)
+                return
+            try:
+                self._resync(set(requests) | set(spend))
+            except Exception:
+                logger.exception('Quota usage resync failed')
+        finally:
+            self._flush_lock.release()
+
+    def _prune(self):
+        """Forget rate-limit windows, days and idle principals no longer needed."""
+        current_minute = int(time.time()) // 60
+        today = timezone.now().date()
+        self.minute_requests.prune(lambda key: key[1] >= current_minute - 1)
+        self.daily_spend.prune(lambda key: key[1] >= today)
+        self.in_flight.prune_zero()
+        self._loaded_days = {key for key in list(self._loaded_days) if key[1] >= today}
+
+    def _write(self, requests, spend):
+        from .models import ApiKeyUsage
+
+        with transaction.atomic():
+            for key_id, day in set(requests) | set(spend):
+                added_requests = requests.get((key_id, day), 0)
+                added_spend = spend.get((key_id, day), 0)
+                usage, created = ApiKeyUsage.objects.get_or_create(
+                    api_key_id=key_id, day=day,
+                    defaults={'requests': added_requests, 'spend_units': added_spend},
+                )
+                if not created:
+                    ApiKeyUsage.objects.filter(pk=usage.pk).update(
+                        requests=F('requests') + added_requests,
+                        spend_units=F('spend_units') + added_spend,
+                    )
+
+    def _resync(self, flushed):
+        """Pick up usage flushed by other processes."""
+        from .models import ApiKeyUsage
+
+        today = timezone.now().date()
+        key_ids = {key_id for key_id, day in flushed if day == today}
+        for key_id, stored in (ApiKeyUsage.objects.filter(api_key_id__in=key_ids, day=today)
+                               .values_list('api_key_id', 'spend_units')):
+            unflushed = self.pending_spend.get((key_id, today))
+            self.daily_spend.set((f"key:{key_id}", today), stored + unflushed)
+
+
+accountant = QuotaAccountant(shards=quota_setting('SHARDS'))
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _get_flusher():
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='quota-flush')
+        return _flusher
+
+
+def drain_flusher():
+    """Wait for a queued background flush to finish (tests, shutdown)."""
+    global _flusher
+    with _flusher_lock:
+        executor, _flusher = _flusher, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def reset():
+    """Clear all in-memory quota state (used by tests)."""
+    accountant.reset()
+    with _key_cache_lock:
+        _key_cache.clear()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        accountant.flush()
+    except Exception:
+        pass
@@ -0,0 +1,158 @@
+"""
+Registered reference images.
+
+Creators reuse the same face photo across many thumbnail generations. A
+client registers the photo once (``POST /api/references/``) and gets back a
+``reference_id``; later requests send that id instead of the file.
+
+Registration normalizes the image once - EXIF rotation, metadata stripped,
+downscaled to MAX_SIDE, re-encoded - and keeps the provider-ready bytes:
+
+- in a per-process LRU bounded by CACHE_BYTES, so hot references are
+  handed to the provider straight from memory with no temp file;
+- under ``MEDIA_ROOT/references/``, with only the id's metadata in the
+  coordination backend for TTL seconds, so every node sharing MEDIA_ROOT can
+  resolve the id without the backend holding image bytes.
+
+Ids hash the content together with the registering principal (API key or
+client address), so registering the same photo twice returns the same id,
+and a reference only resolves for the principal that registered it - an id
+learned or guessed by someone else is simply unknown to them. SimplerLLM
+takes reference images as bytes, so no provider-side file handle is needed.
+
+Tools that compose several references (a face, a logo, a style) ingest the
+extra uploads with ``register_many``: each file is read, normalized and
+registered on its own thread, so a request with four references costs about
+as much latency as one, and a repeated logo is a cache hit.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import coordination, imaging, tracing
+
+
+REFERENCE_DEFAULTS = {
+    'MAX_SIDE': 1536,
+    'CACHE_BYTES': 256 * 1024 * 1024,
+    'TTL': 7 * 24 * 60 * 60,
+    # Reference images one request may compose, including the primary one
+    'MAX_PER_REQUEST': 6,
+    # Combined size of the reference files uploaded with one request
+    'MAX_UPLOAD_BYTES': 40 * 1024 * 1024,
+    # Combined size of the images handed to the provider for one request
+    'MAX_PROVIDER_BYTES': 16 * 1024 * 1024,
+    'INGEST_WORKERS': 4,
+}
+
+
+def reference_setting(name):
+    return getattr(settings, 'REFERENCES', {}).get(name, REFERENCE_DEFAULTS[name])
+
+
+class ReferenceCache:
+    """Least-recently-used mapping of reference id to entry, bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+
+    def get(self, ref_id):
+        with self._lock:
+            entry = self._entries.get(ref_id)
+            if entry is not None:
+                self._entries.move_to_end(ref_id)
+            return entry
+
+    def put(self, ref_id, entry):
+        with self._lock:
+            old = self._entries.pop(ref_id, None)
+            if old is not None:
+                self.size -= len(old['data'])
+            self._entries[ref_id] = entry
+            self.size += len(entry['data'])
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted['data'])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+local_cache = ReferenceCache(reference_setting('CACHE_BYTES'))
+
+
+def _key(ref_id):
+    backend = coordination.get_backend()
+    return backend, backend.key('reference', ref_id)
+
+
+def reference_path(ref_id, ext):
+    return os.path.join(settings.MEDIA_ROOT, 'references', f"{os.path.basename(ref_id)}{ext}")
+
+
+def reference_id(data, owner):
+    digest = hashlib.sha256(data).hexdigest()
+    return 'ref_' + hashlib.sha256(f"{owner}\x1f{digest}".encode()).hexdigest()[:40]
+
+
+def register(data, owner):
+    """Normalize image bytes and store them for ``owner``; return the reference entry."""
+    from .pipeline import write_image
+
+    ref_id = reference_id(data, owner)
+    entry = lookup(ref_id, owner)
+    if entry is None:
+        normalized, ext, (width, height) = imaging.normalize(data, reference_setting('MAX_SIDE'))
+        write_image(reference_path(ref_id, ext), normalized)
+        meta = {'id': ref_id, 'owner': owner, 'ext': ext, 'width': width, 'height': height}
+        backend, key = _key(ref_id)
+        backend.set(key, meta, reference_setting('TTL'))
+        entry = dict(meta, data=normalized)
+        local_cache.put(ref_id, entry)
+    return entry
+
+
+def lookup(ref_id, owner):
+    """Return the entry for a reference id, or None if unknown, expired or registered by someone else."""
+    if not ref_id.startswith('ref_'):
+        return None
+    entry = local_cache.get(ref_id)
+    if entry is None:
+        backend, key = _key(ref_id)
+        meta = backend.get(key)
+        if meta is None:
+            return None
+        try:
+            with open(reference_path(ref_id, meta['ext']), 'rb') as f:
+                entry = dict(meta, data=f.read())
+        except FileNotFoundError:
+            return None
+        local_cache.put(ref_id, entry)
+    if entry.get('owner') != owner:
+        return None
+    return entry
+
+
+def _ingest(uploaded_file, owner):
+    with tracing.span('reference.ingest', **{'upload.bytes': uploaded_file.size}):
+        return register(b''.join(uploaded_file.chunks()), owner)
+
+
+def register_many(uploaded_files, owner):
+    """Read, normalize and register uploaded files in parallel; return their entries in order."""
+    if len(uploaded_files) <= 1:
+        return [_ingest(f, owner) for f in uploaded_files]
+    workers = min(len(uploaded_files), reference_setting('INGEST_WORKERS'))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reference') as pool:
+        futures = [pool.submit(tracing.wrap(_ingest), f, owner) for f in uploaded_files]
+        return [future.result() for future in futures]
@@ -0,0 +1,209 @@
+"""
+Priority scheduling of provider calls.
+
+Every generation is assigned a priority class - ``interactive`` (calls from
+the site's own pages, recognised by a signed cookie the pages hand out),
+``standard`` (API keys), ``anonymous`` (other callers without a
+key) or ``bulk`` (clients that opt down, batch runs). Provider slots are
+shared between the classes by weighted fair queuing, with:
+
+- reservations: slots that only the owning class may take, so interactive
+  requests always find room even when bulk traffic fills the queue;
+- starvation prevention: a request waiting longer than STARVATION_TIMEOUT
+  is served next regardless of its class weight.
+
+Per-class queue depth, in-flight count and wait times are kept for tuning
+and exposed through ``snapshot()``.
+"""
+
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+
+
+PRIORITY_CLASSES = ['interactive', 'standard', 'anonymous', 'bulk']
+
+SCHEDULER_DEFAULTS = {
+    'WEIGHTS': {'interactive': 8, 'standard': 3, 'anonymous': 2, 'bulk': 1},
+    'RESERVATIONS': {'interactive': 2, 'standard': 1, 'anonymous': 0, 'bulk': 0},
+    'STARVATION_TIMEOUT': 30,
+    'PAGE_TOKEN_AGE': 24 * 60 * 60,
+}
+
+# Signed cookie, bound to the client address, that the tool pages hand out
+PAGE_COOKIE = 'nbp_page'
+PAGE_COOKIE_SALT = 'tools.scheduler.page'
+
+
+def scheduler_setting(name):
+    return getattr(settings, 'SCHEDULER', {}).get(name, SCHEDULER_DEFAULTS[name])
+
+
+def issue_page_token(request, response):
+    """Mark the visitor's later API calls from this page as interactive."""
+    response.set_signed_cookie(PAGE_COOKIE, request.META.get('REMOTE_ADDR', ''), salt=PAGE_COOKIE_SALT,
+                               max_age=scheduler_setting('PAGE_TOKEN_AGE'), httponly=True, samesite='Strict')
+    # The cookie is per visitor, so shared caches must not keep the page
+    patch_cache_control(response, private=True)
+
+
+def has_page_token(request):
+    address = request.get_signed_cookie(PAGE_COOKIE, default=None, salt=PAGE_COOKIE_SALT,
+                                        max_age=scheduler_setting('PAGE_TOKEN_AGE'))
+    return address is not None and address == request.META.get('REMOTE_ADDR', '')
+
+
+def classify(request, principal):
+    """
+    Pick the priority class for a request.
+
+    API keys are standard. Keyless requests carrying the page cookie issued
+    to this client address (see ``issue_page_token``) are interactive; any
+    other keyless caller is anonymous, below authenticated traffic. Request
+    headers alone never raise the class. Anyone may ask for a lower class
+    with the ``X-Priority`` header.
+    """
+    if principal is not None and principal.api_key_id is not None:
+        default = 'standard'
+    elif has_page_token(request):
+        default = 'interactive'
+    else:
+        default = 'anonymous'
+    requested = request.headers.get('X-Priority', '').strip().lower()
+    if requested in PRIORITY_CLASSES and PRIORITY_CLASSES.index(requested) > PRIORITY_CLASSES.index(default):
+        return requested
+    return default
+
+
+class SchedulerTimeout(Exception):
+    """Raised when no provider slot became available in time."""
+
+
+class _Waiter:
+    __slots__ = ('priority', 'enqueued_at', 'granted')
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = threading.Event()
+
+
+class PriorityScheduler:
+    """Weighted fair queuing of a fixed number of slots between classes."""
+
+    def __init__(self, slots, weights=None, reservations=None, starvation_timeout=None):
+        self.slots = slots
+        self.weights = weights or scheduler_setting('WEIGHTS')
+        self.reservations = reservations or scheduler_setting('RESERVATIONS')
+        self.starvation_timeout = (scheduler_setting('STARVATION_TIMEOUT')
+                                   if starvation_timeout is None else starvation_timeout)
+        self._lock = threading.Lock()
+        self._queues = {c: deque() for c in PRIORITY_CLASSES}
+        self._in_flight = {c: 0 for c in PRIORITY_CLASSES}
+        self._virtual_time = {c: 0.0 for c in PRIORITY_CLASSES}
+        self._stats = {c: {'dispatched': 0, 'timeouts': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+                       for c in PRIORITY_CLASSES}
+
+    # Slot accounting -------------------------------------------------------
+
+    def _free_slots(self):
+        return self.slots - sum(self._in_flight.values())
+
+    def _can_take(self, priority):
+        """A class may take a slot if it leaves enough for others' reservations."""
+        held_back = sum(max(0, self.reservations.get(c, 0) - self._in_flight[c])
+                        for c in PRIORITY_CLASSES if c != priority)
+        # Never reserve every slot away from a class
+        return self._free_slots() > min(held_back, self.slots - 1)
+
+    def _pick_class(self):
+        candidates = [c for c in PRIORITY_CLASSES if self._queues[c] and self._can_take(c)]
+        if not candidates:
+            return None
+
+        # Starvation prevention: the longest-waiting overdue request goes first
+        now = time.monotonic()
+        overdue = [c for c in candidates if now - self._queues[c][0].enqueued_at >= self.starvation_timeout]
+        if overdue:
+            return min(overdue, key=lambda c: self._queues[c][0].enqueued_at)
+
+        # Weighted fair queuing: lowest virtual finish time wins
+        return min(candidates, key=lambda c: (self._virtual_time[c], PRIORITY_CLASSES.index(c)))
+
+    def _dispatch(self):
+        while self._free_slots() > 0:
+            priority = self._pick_class()
+            if priority is None:
+                return
+            waiter = self._queues[priority].popleft()
+            self._grant(waiter)
+
+    def _grant(self, waiter):
+        priority = waiter.priority
+        self._in_flight[priority] += 1
+        self._virtual_time[priority] += 1.0 / self.weights.get(priority, 1)
+
+        waited = time.monotonic() - waiter.enqueued_at
+        stats = self._stats[priority]
+        stats['dispatched'] += 1
+        stats['total_wait'] += waited
+        stats['max_wait'] = max(stats['max_wait'], waited)
+        waiter.granted.set()
+
+    # Public API ------------------------------------------------------------
+
+    def acquire(self, priority, timeout):
+        """Wait for a slot; return the seconds spent queueing (exactly 0.0 if one was free at once)."""
+        waiter = _Waiter(priority)
+        with self._lock:
+            if not self._queues[priority]:
+                # A class returning from idle does not keep credit from the past
+                active = [self._virtual_time[c] for c in PRIORITY_CLASSES if self._queues[c] or self._in_flight[c]]
+                if active:
+                    self._virtual_time[priority] = max(self._virtual_time[priority], min(active))
+            self._queues[priority].append(waiter)
+            self._dispatch()
+            if waiter.granted.is_set():
+                return 0.0
+
+        if not waiter.granted.wait(timeout):
+            with self._lock:
+                if not waiter.granted.is_set():
+                    self._queues[priority].remove(waiter)
+                    self._stats[priority]['timeouts'] += 1
+                    raise SchedulerTimeout(priority)
+        return time.monotonic() - waiter.enqueued_at
+
+    def release(self, priority):
+        with self._lock:
+            self._in_flight[priority] -= 1
+            self._dispatch()
+
+    def oldest_wait(self):
+        """Seconds the longest-queued request has been waiting (0 if none)."""
+        with self._lock:
+            now = time.monotonic()
+            return max((now - q[0].enqueued_at for q in self._queues.values() if q), default=0.0)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for c in PRIORITY_CLASSES:
+                stats = self._stats[c]
+                queue = self._queues[c]
+                result[c] = {
+                    'queue_depth': len(queue),
+                    'in_flight': self._in_flight[c],
+                    'oldest_wait': round(now - queue[0].enqueued_at, 3) if queue else 0.0,
+                    'dispatched': stats['dispatched'],
+                    'timeouts': stats['timeouts'],
+                    'avg_wait': round(stats['total_wait'] / stats['dispatched'], 3) if stats['dispatched'] else 0.0,
+                    'max_wait': round(stats['max_wait'], 3),
+                    'weight': self.weights.get(c, 1),
+                    'reserved': self.reservations.get(c, 0),
+                }
+            return {'slots': self.slots, 'classes': result}
@@ -0,0 +1,132 @@
+"""
+Compact sketch transport for the Sketch to Image tool.
+
+The browser sends the sketch as stroke vectors instead of a full-canvas PNG:
+
+    {"width": 800, "height": 600,
+     "strokes": [{"w": 5, "p": [x0, y0, x1, y1, ...]}, ...]}
+
+Each accepted sketch is remembered under its content hash (``sketch_id``) so
+a resubmission after small changes can send only the new strokes:
+
+    {"base": "<sketch_id>", "strokes": [...new strokes only...]}
+
+The server rasterizes the strokes with Pillow into the PNG the provider sees.
+Pillow is imported on first use to keep it off the startup path.
+"""
+
+import hashlib
+import io
+import json
+
+from django.core.cache import cache
+
+
+MAX_CANVAS_SIDE = 2048
+MAX_POINTS = 100_000
+MAX_BRUSH_SIZE = 64
+SKETCH_CACHE_TIMEOUT = 60 * 60
+
+
+class SketchError(ValueError):
+    """Raised when a stroke payload is malformed."""
+
+
+class UnknownBaseSketch(SketchError):
+    """Raised when a delta refers to a sketch the server no longer has."""
+
+
+def _clean_strokes(strokes):
+    if not isinstance(strokes, list):
+        raise SketchError('Strokes must be a list')
+
+    cleaned = []
+    total_points = 0
+    for stroke in strokes:
+        if not isinstance(stroke, dict):
+            raise SketchError('Each stroke must be an object')
+        points = stroke.get('p')
+        if not isinstance(points, list) or not points or len(points) % 2:
+            raise SketchError('Stroke points must be a flat list of x, y pairs')
+        try:
+            width = int(stroke.get('w', 5))
+            points = [int(round(float(v))) for v in points]
+        except (TypeError, ValueError):
+            raise SketchError('Stroke values must be numbers')
+        total_points += len(points) // 2
+        if total_points > MAX_POINTS:
+            raise SketchError('Sketch has too many points')
+        cleaned.append({'w': max(1, min(width, MAX_BRUSH_SIZE)), 'p': points})
+    return cleaned
+
+
+def _sketch_id(sketch):
+    canonical = json.dumps(sketch, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def resolve(payload):
+    """
+    Turn a full or delta stroke payload into a complete sketch.
+
+    Returns ``(sketch_id, sketch)`` and remembers the sketch so it can serve
+    as the base of a later delta.
+    """
+    if isinstance(payload, (str, bytes)):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            raise SketchError('Sketch data is not valid JSON')
+    if not isinstance(payload, dict):
+        raise SketchError('Sketch data must be an object')
+
+    strokes = _clean_strokes(payload.get('strokes', []))
+
+    if payload.get('base'):
+        base = cache.get(f"sketch:{payload['base']}")
+        if base is None:
+            raise UnknownBaseSketch('Base sketch expired. Please resend the full sketch.')
+        sketch = {'width': base['width'], 'height': base['height'], 'strokes': base['strokes'] + strokes}
+    else:
+        try:
+            width = int(payload.get('width', 800))
+            height = int(payload.get('height', 600))
+        except (TypeError, ValueError):
+            raise SketchError('Canvas size must be numbers')
+        if not (0 < width <= MAX_CANVAS_SIDE and 0 < height <= MAX_CANVAS_SIDE):
+            raise SketchError(f'Canvas size must be between 1 and {MAX_CANVAS_SIDE} pixels')
+        sketch = {'width': width, 'height': height, 'strokes': strokes}
+
+    if sum(len(s['p']) for s in sketch['strokes']) // 2 > MAX_POINTS:
+        raise SketchError('Sketch has too many points')
+
+    sketch_id = _sketch_id(sketch)
+    cache.set(f"sketch:{sketch_id}", sketch, SKETCH_CACHE_TIMEOUT)
+    return sketch_id, sketch
+
+
+def is_blank(sketch):
+    """O(strokes) blank check - no pixel scan needed."""
+    return not sketch['strokes']
+
+
+def rasterize(sketch):
+    """Render a sketch as black round-capped strokes on white, as PNG bytes."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('L', (sketch['width'], sketch['height']), 255)
+    draw = ImageDraw.Draw(image)
+
+    for stroke in sketch['strokes']:
+        width = stroke['w']
+        radius = width / 2
+        points = list(zip(stroke['p'][0::2], stroke['p'][1::2]))
+        if len(points) > 1:
+            draw.line(points, fill=0, width=width, joint='curve')
+        # Round caps (and single-point dots)
+        for x, y in (points[0], points[-1]):
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=0)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,423 @@
+"""
+Tool specs served by the generation pipeline.
+
+Adding a tool means writing its parse / prompt functions here and registering
+a ToolSpec; the shared pipeline stages apply to it automatically.
+"""
+
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from . import coordination, imaging, sketches, uploads
+from .pipeline import (
+    PipelineError, ToolSpec, edit_image, ensure_local_result, generate_image, pipeline_setting,
+    postprocess_output, register_tool, write_image,
+)
+
+
+PRO_IMAGE_MODEL = 'gemini-3-pro-image-preview'
+# Quota units per call on the pro model, relative to 1 for the default model
+PRO_IMAGE_COST_UNITS = 4
+# Faster, cheaper model used for low-resolution draft previews
+DRAFT_IMAGE_MODEL = 'gemini-2.5-flash-image'
+
+SIZES = ['square', 'horizontal', 'vertical']
+
+MAX_TITLE_LENGTH = 100
+
+
+# ---------------------------------------------------------------------------
+# Extra references (shared)
+# ---------------------------------------------------------------------------
+
+def parse_extra_references(job):
+    """
+    Add the optional extra reference images - ``references`` files and
+    comma-separated ``reference_ids`` - after the tool's primary image.
+    """
+    request = job.request
+    ref_ids = [ref_id.strip() for value in request.POST.getlist('reference_ids')
+               for ref_id in value.split(',') if ref_id.strip()]
+    job.params['extra_references'] = job.add_references(request.FILES.getlist('references'), ref_ids)
+
+
+def extra_references_note(job, primary):
+    count = job.params.get('extra_references', 0)
+    if not count:
+        return ''
+    if count == 1:
+        images, them = 'image follows', 'it'
+    else:
+        images, them = 'images follow', 'them'
+    return (f"\n\n{count} additional reference {images} the {primary}. Use {them} for the logos, "
+            f"products or visual style the request calls for, keeping the {primary} as the main reference.")
+
+
+# ---------------------------------------------------------------------------
+# Output options (shared)
+# ---------------------------------------------------------------------------
+
+def parse_output_options(job, data, default_preset=None):
+    """
+    Read the optional ``preset``, ``watermark`` and ``title`` fields that
+    postprocess_output applies to the generated image.
+    """
+    preset = str(data.get('preset', default_preset or '')).strip().lower()
+    if preset in ('', 'none', 'original'):
+        preset = None
+    elif preset not in imaging.PRESETS:
+        raise PipelineError(f'Invalid preset. Allowed: {", ".join(imaging.PRESETS)}')
+
+    watermark_path = None
+    if str(data.get('watermark', '')).strip().lower() in ('1', 'true', 'on', 'yes'):
+        watermark_path = pipeline_setting('WATERMARK_PATH')
+        if not watermark_path:
+            raise PipelineError('Watermarking is not configured on this server')
+
+    title = str(data.get('title', '')).strip()
+    if len(title) > MAX_TITLE_LENGTH:
+        raise PipelineError(f'Title must be at most {MAX_TITLE_LENGTH} characters')
+
+    options = {'preset': preset, 'watermark_path': watermark_path, 'title': title or None}
+    if any(options.values()):
+        job.params['output'] = options
+        job.digests.append('output:' + json.dumps(options, sort_keys=True))
+
+
+# ---------------------------------------------------------------------------
+# Text to Image
+# ---------------------------------------------------------------------------
+
+def parse_text_to_image(job):
+    data = json.loads(job.request.body)
+    prompt = data.get('prompt', '').strip()
+    size = data.get('size', 'square').lower()
+
+    if not prompt:
+        raise PipelineError('Prompt is required')
+
+    job.params['prompt'] = prompt
+    job.size = size if size in SIZES else 'square'
+    parse_output_options(job, data)
+
+
+def build_text_to_image_prompt(job):
+    return job.params['prompt']
+
+
+# ---------------------------------------------------------------------------
+# Product Ad Enhancer
+# ---------------------------------------------------------------------------
+
+ENHANCEMENT_PROMPT = """Transform this product photo into a professional studio shot with high-end commercial photography quality.
+
+Apply these enhancements:
+- Professional three-point studio lighting (key light, fill light, rim light)
+- Clean, minimalist background (pure white or subtle gradient)
+- Sharp focus on the product with perfect clarity
+- Remove any distractions, clutter, or background objects
+- Enhance product details, colors, and textures
+- Add natural shadows and reflections for depth
+- Create a high-end, luxury feel
+- Make it look like a professional advertisement or e-commerce product photo
+
+Maintain the product's exact appearance while elevating the overall presentation to studio quality."""
+
+
+def parse_product_ad_enhancer(job):
+    if not job.take_image('upload'):
+        raise PipelineError('No image file uploaded')
+    parse_output_options(job, job.request.POST)
+
+
+def build_product_ad_enhancer_prompt(job):
+    return ENHANCEMENT_PROMPT
+
+
+# ---------------------------------------------------------------------------
+# Sketch to Image
+# ---------------------------------------------------------------------------
+
+TRANSFORMATION_PROMPT = """Transform this hand-drawn sketch into a photorealistic, high-quality photograph.
+Maintain the exact composition, subject matter, and layout from the sketch, but enhance it with:
+- Realistic details and textures
+- Professional lighting and shadows
+- Natural, vibrant colors
+- High-definition quality
+- Photographic depth and clarity
+Make it look like a professional photograph while staying true to the original sketch's intent."""
+
+
+def parse_sketch_to_image(job):
+    parse_output_options(job, job.request.POST)
+
+    # Stroke vectors (full or delta) from the canvas, rasterized server-side
+    if 'sketch' in job.request.POST:
+        try:
+            sketch_id, sketch = sketches.resolve(job.request.POST['sketch'])
+        except sketches.UnknownBaseSketch as e:
+            raise PipelineError(str(e), status=409)
+        except sketches.SketchError as e:
+            raise PipelineError(str(e))
+        if sketches.is_blank(sketch):
+            raise PipelineError('Sketch is empty')
+        job.save_bytes(sketches.rasterize(sketch), 'sketch', digest=f"sketch:{sketch_id}")
+        job.extra['sketch_id'] = sketch_id
+    elif not job.take_image('sketch'):
+        raise PipelineError('No sketch image uploaded')
+    parse_extra_references(job)
+
+
+def build_sketch_to_image_prompt(job):
+    return TRANSFORMATION_PROMPT + extra_references_note(job, 'sketch')
+
+
+# ---------------------------------------------------------------------------
+# Image Editor
+# ---------------------------------------------------------------------------
+
+# Draft mode sends a downsampled source to the draft model. Each draft
+# remembers its edit chain (full-resolution source + prompts) so "finalize"
+# can re-run just the accepted chain on the pro model. Sources are kept under
+# MEDIA_ROOT/drafts/; the coordination backend only records their format.
+EDIT_MODES = ['full', 'draft', 'finalize']
+DRAFT_MAX_SIDE = 768
+
+
+def parse_edit_image(job):
+    request = job.request
+    mode = request.POST.get('mode', 'full').strip().lower() or 'full'
+    if mode not in EDIT_MODES:
+        raise PipelineError(f'Invalid mode. Allowed: {", ".join(EDIT_MODES)}')
+    if mode == 'finalize':
+        return parse_edit_finalize(job)
+
+    edit_prompt = request.POST.get('prompt', '').strip()
+    if not edit_prompt:
+        raise PipelineError('Edit prompt is required')
+    job.params['prompt'] = edit_prompt
+
+    if mode == 'draft':
+        return parse_edit_draft(job)
+
+    # Either a new upload or a previously edited image
+    if not job.take_image('edit_upload') and request.POST.get('current_image', '').strip():
+        job.use_generated_image(request.POST['current_image'].strip())
+
+    if not job.sources:
+        raise PipelineError('No image provided. Please upload an image or reference an existing one.')
+
+
+def _draft_key(*parts):
+    backend = coordination.get_backend()
+    return backend, backend.key('draft', *parts)
+
+
+def draft_source_path(digest, file_ext):
+    return os.path.join(settings.MEDIA_ROOT, 'drafts', f"{digest}{file_ext}")
+
+
+def store_draft_source(data):
+    """Keep the full-resolution source of an edit chain; return its digest."""
+    try:
+        file_ext, _ = imaging.sniff(data)
+    except OSError:
+        raise PipelineError('Could not read the image. Please upload a valid JPG, PNG or WEBP file.')
+    digest = hashlib.sha256(data).hexdigest()
+    path = draft_source_path(digest, file_ext)
+    if not os.path.exists(path):
+        write_image(path, data)
+    backend, key = _draft_key('source', digest)
+    backend.set(key, {'ext': file_ext}, coordination.coordination_setting('RESULT_TTL'))
+    return digest
+
+
+def record_draft_chain(job, payload):
+    if payload.get('filename'):
+        backend, key = _draft_key('chain', payload['filename'])
+        backend.set(key, job.params['chain'], coordination.coordination_setting('RESULT_TTL'))
+
+
+def parse_edit_draft(job):
+    request = job.request
+    current_image = os.path.basename(request.POST.get('current_image', '').strip())
+
+    if 'image' in request.FILES:
+        data = job.read_upload(request.FILES['image'])
+        chain = {'source': store_draft_source(data), 'prompts': []}
+    elif request.POST.get('upload_id', '').strip():
+        with open(uploads.resolve(request.POST['upload_id'].strip(), job.principal.id)['path'], 'rb') as f:
+            data = f.read()
+        chain = {'source': store_draft_source(data), 'prompts': []}
+    elif current_image:
+        path = ensure_local_result(current_image)
+        if path is None:
+            raise PipelineError('Referenced image not found. Please upload a new image.')
+        with open(path, 'rb') as f:
+            data = f.read()
+        backend, key = _draft_key('chain', current_image)
+        chain = backend.get(key)
+        if chain is None:
+            # Drafting on top of a full-quality result: it becomes the source
+            chain = {'source': store_draft_source(data), 'prompts': []}
+    else:
+        raise PipelineError('No image provided. Please upload an image or reference an existing one.')
+
+    preview, file_ext = imaging.downsample(data, DRAFT_MAX_SIDE)
+    job.save_bytes(preview, 'edit_draft', file_ext)
+    job.model = DRAFT_IMAGE_MODEL
+    job.cost_units = 1
+    job.params['chain'] = {'source': chain['source'], 'prompts': chain['prompts'] + [job.params['prompt']]}
+    job.extra['draft'] = True
+    job.on_success.append(record_draft_chain)
+
+
+def parse_edit_finalize(job):
+    current_image = os.path.basename(job.request.POST.get('current_image', '').strip())
+    if not current_image:
+        raise PipelineError('Finalize needs the draft to finalize (current_image)')
+
+    backend, key = _draft_key('chain', current_image)
+    chain = backend.get(key)
+    source = backend.get(backend.key('draft', 'source', chain['source'])) if chain else None
+    path = draft_source_path(chain['source'], source['ext']) if source else None
+    if path is None or not os.path.exists(path):
+        raise PipelineError('Draft not found or expired. Please redo the edit.')
+
+    # Sent from its file, whose extension gives the provider the right MIME type
+    job.sources.append(path)
+    job.digests.append(chain['source'])
+    job.params['chain_prompts'] = chain['prompts']
+    job.cost_units = PRO_IMAGE_COST_UNITS * len(chain['prompts'])
+
+
+def build_edit_image_prompt(job):
+    if 'chain_prompts' in job.params:
+        return '\n'.join(job.params['chain_prompts'])
+    return job.params['prompt']
+
+
+def edit_chain(img_gen, job):
+    """Apply each prompt of a finalized chain in turn, feeding the output forward."""
+    prompts = job.params.get('chain_prompts')
+    if not prompts:
+        return edit_image(img_gen, job)
+
+    combined_prompt = job.prompt
+    try:
+        for prompt in prompts:
+            job.prompt = prompt
+            edit_image(img_gen, job)
+            # Raw bytes would be sent as JPEG whatever they are
+            job.sources[0] = imaging.provider_input(job.image_bytes)
+    finally:
+        job.prompt = combined_prompt
+
+
+# ---------------------------------------------------------------------------
+# YouTube Thumbnail
+# ---------------------------------------------------------------------------
+
+THUMBNAIL_PROMPT = """Create a professional, high-CTR YouTube thumbnail featuring the person from the reference image.
+
+User's Vision: {user_prompt}
+
+Technical Requirements:
+- Subject: The person from the reference image with an engaging, expressive face
+- Composition: Strategic positioning with space for potential text overlay
+- Lighting: Dramatic professional lighting with high contrast and rim lights
+- Colors: Vibrant, bold colors that pop on screen using complementary color schemes
+- Background: Dynamic and visually interesting, not cluttered, with depth
+- Quality: High-definition, sharp focus, professional photography quality
+- Style: Eye-catching, attention-grabbing, optimized for mobile viewing
+- Expression: Genuine emotion that matches the video concept
+
+YouTube Optimization:
+- Must grab attention instantly in a crowded feed
+- Clear and readable even at small thumbnail sizes (mobile optimization)
+- Single strong focal point (the person's face and expression)
+- High contrast for maximum visibility
+- Professional and trustworthy appearance
+- Designed to maximize click-through rate
+
+Create a thumbnail that combines the user's vision with professional YouTube thumbnail best practices."""
+
+
+def parse_youtube_thumbnail(job):
+    request = job.request
+    reference_id = request.POST.get('reference_id', '').strip()
+    if 'image' not in request.FILES and not reference_id and not request.POST.get('upload_id', '').strip():
+        raise PipelineError('No reference image uploaded')
+
+    user_prompt = request.POST.get('prompt', '').strip()
+    if not user_prompt:
+        raise PipelineError('Thumbnail description is required')
+    job.params['user_prompt'] = user_prompt
+
+    # A registered reference skips the upload and temp file entirely
+    if reference_id:
+        job.use_reference(reference_id)
+    else:
+        job.take_image('thumbnail_ref')
+    parse_extra_references(job)
+    # Exact 1280x720 unless the client asks otherwise
+    parse_output_options(job, request.POST, default_preset='youtube')
+
+
+def build_youtube_thumbnail_prompt(job):
+    return (THUMBNAIL_PROMPT.format(user_prompt=job.params['user_prompt'])
+            + extra_references_note(job, "person's photo"))
+
+
+register_tool(ToolSpec(
+    name='text_to_image',
+    parse=parse_text_to_image,
+    build_prompt=build_text_to_image_prompt,
+    invoke=generate_image,
+    size='square',
+    postprocess=[postprocess_output],
+))
+
+register_tool(ToolSpec(
+    name='product_ad_enhancer',
+    output_prefix='product_enhancer',
+    parse=parse_product_ad_enhancer,
+    build_prompt=build_product_ad_enhancer_prompt,
+    invoke=edit_image,
+    model=PRO_IMAGE_MODEL,
+    cost_units=PRO_IMAGE_COST_UNITS,
+    postprocess=[postprocess_output],
+))
+
+register_tool(ToolSpec(
+    name='sketch_to_image',
+    parse=parse_sketch_to_image,
+    build_prompt=build_sketch_to_image_prompt,
+    invoke=generate_image,
+    model=PRO_IMAGE_MODEL,
+    cost_units=PRO_IMAGE_COST_UNITS,
+    postprocess=[postprocess_output],
+))
+
+register_tool(ToolSpec(
+    name='edit_image',
+    output_prefix='edited_image',
+    parse=parse_edit_image,
+    build_prompt=build_edit_image_prompt,
+    invoke=edit_chain,
+    model=PRO_IMAGE_MODEL,
+    cost_units=PRO_IMAGE_COST_UNITS,
+))
+
+register_tool(ToolSpec(
+    name='youtube_thumbnail',
+    parse=parse_youtube_thumbnail,
+    build_prompt=build_youtube_thumbnail_prompt,
+    invoke=generate_image,
+    model=PRO_IMAGE_MODEL,
+    cost_units=PRO_IMAGE_COST_UNITS,
+    postprocess=[postprocess_output],
+))
@@ -1,3 +1,1113 @@
-from django.test import TestCase
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    analytics, bulk, coordination, imaging, overload, pipeline, quotas, references, scheduler, specs, tracing, uploads,
+    warmup,
+)
+from .exceptions import PipelineError
+from .models import ApiKey, ApiKeyUsage, GenerationRollup
+
+
+def make_png(size=(8, 8)):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+PNG_BYTES = make_png()
+
+# Nothing in the suite may export traces into the repo, whatever the environment says
+_tracing_override = override_settings(TRACING={'EXPORTER': 'none'})
+
+
+def setUpModule():
+    _tracing_override.enable()
+    tracing.set_exporter(None)
+
+
+def tearDownModule():
+    _tracing_override.disable()
+    tracing.set_exporter(None)
+
+
+class FakeImageGenerator:
+    """Stands in for the SimplerLLM generator and returns a tiny PNG."""
+
+    def __init__(self):
+        self.calls = []
+
+    def _write(self, kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get('output_format') == 'file':
+            with open(kwargs['output_path'], 'wb') as f:
+                f.write(PNG_BYTES)
+            return kwargs['output_path']
+        return PNG_BYTES
+
+    def generate_image(self, **kwargs):
+        return self._write(kwargs)
+
+    def edit_image(self, **kwargs):
+        return self._write(kwargs)
+
+
+class PipelineTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.generator = FakeImageGenerator()
+        patcher = mock.patch.object(pipeline, 'get_image_generator', return_value=self.generator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        caches['coordination'].clear()
+        pipeline.metrics.reset()
+        quotas.reset()
+        overload.controller.reset()
+        references.local_cache.clear()
+        analytics.recorder.reset()
+        # Nothing pending may be flushed at exit, after the test DB is gone
+        self.addCleanup(quotas.reset)
+        self.addCleanup(analytics.recorder.reset)
+        self.addCleanup(analytics.drain_flusher)
+        self.addCleanup(quotas.drain_flusher)
+        self.traces = tracing.MemoryExporter()
+        tracing.set_exporter(self.traces)
+        self.addCleanup(tracing.set_exporter, None)
+
+    def tearDown(self):
+        # Write-behind stores resolve MEDIA_ROOT when they run, so finish them
+        # before the temporary media root is swapped back out
+        pipeline.drain_write_behind()
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, name='photo.png'):
+        return SimpleUploadedFile(name, PNG_BYTES, content_type='image/png')
+
+
+class GenerationPipelineTests(PipelineTestCase):
+    def test_text_to_image_generates_file(self):
+        response = self.client.post('/api/generate-text-to-image/',
+                                    json.dumps({'prompt': 'a banana'}),
+                                    content_type='application/json')
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['filename'].startswith('text_to_image_'))
+        self.assertTrue(os.path.exists(pipeline.generated_image_path(data['filename'])))
+
+    def test_method_not_allowed(self):
+        response = self.client.get('/api/edit-image/')
+        self.assertEqual(response.status_code, 405)
+
+    def test_validation_errors_keep_tool_messages(self):
+        response = self.client.post('/api/generate-sketch-to-image/')
+        self.assertEqual(response.json()['error'], 'No sketch image uploaded')
+        response = self.client.post('/api/enhance-product-ad/', {'image': self.upload('photo.gif')})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid file type', response.json()['error'])
+
+    def test_uploads_are_cleaned_up(self):
+        response = self.client.post('/api/generate-youtube-thumbnail/',
+                                    {'image': self.upload(), 'prompt': 'shocked face'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+        self.assertEqual(len(self.generator.calls[0]['reference_images']), 1)
+
+    def test_identical_requests_hit_cache(self):
+        first = self.client.post('/api/enhance-product-ad/', {'image': self.upload()}).json()
+        second = self.client.post('/api/enhance-product-ad/', {'image': self.upload()}).json()
+        self.assertEqual(first['filename'], second['filename'])
+        self.assertEqual(len(self.generator.calls), 1)
+        stats = pipeline.metrics.snapshot()['product_ad_enhancer']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['cache_hits'], 1)
+
+    def test_concurrent_identical_requests_call_provider_once(self):
+        from django.test import Client
+
+        started, release = threading.Event(), threading.Event()
+        generate = self.generator.generate_image
+
+        def slow_generate(**kwargs):
+            started.set()
+            release.wait(5)
+            return generate(**kwargs)
+
+        results = []
+
+        def post():
+            response = Client().post('/api/generate-text-to-image/', json.dumps({'prompt': 'a banana'}),
+                                     content_type='application/json')
+            results.append(response.json())
+
+        with mock.patch.object(self.generator, 'generate_image', side_effect=slow_generate):
+            threads = [threading.Thread(target=post) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            self.assertTrue(started.wait(5))
+            time.sleep(0.2)  # the second request is now waiting on the single-flight lock
+            release.set()
+            for thread in threads:
+                thread.join(10)
+
+        self.assertEqual(len(self.generator.calls), 1)
+        self.assertEqual(len({result['filename'] for result in results}), 1)
+
+    def test_edit_previous_result(self):
+        first = self.client.post('/api/edit-image/', {'image': self.upload(), 'prompt': 'add a hat'}).json()
+        second = self.client.post('/api/edit-image/',
+                                  {'current_image': first['filename'], 'prompt': 'make it red'})
+        self.assertEqual(second.status_code, 200)
+        missing = self.client.post('/api/edit-image/',
+                                   {'current_image': '../missing.png', 'prompt': 'make it red'})
+        self.assertEqual(missing.status_code, 400)
+
+    def test_registered_spec_served_by_generic_endpoint(self):
+        response = self.client.post('/api/tools/text_to_image/',
+                                    json.dumps({'prompt': 'a banana'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post('/api/tools/nope/').status_code, 404)
+
+
+class SketchTransportTests(PipelineTestCase):
+    def post_sketch(self, payload):
+        return self.client.post('/api/generate-sketch-to-image/', {'sketch': json.dumps(payload)})
+
+    def test_strokes_are_rasterized(self):
+        response = self.post_sketch({'width': 100, 'height': 80, 'strokes': [{'w': 4, 'p': [10, 10, 50, 40]}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('sketch_id', response.json())
+        self.assertEqual(len(self.generator.calls[0]['reference_images']), 1)
+
+    def test_blank_sketch_rejected(self):
+        response = self.post_sketch({'width': 100, 'height': 80, 'strokes': []})
+        self.assertEqual(response.status_code, 400)
+
+    def test_delta_extends_base_sketch(self):
+        first = self.post_sketch({'width': 100, 'height': 80, 'strokes': [{'w': 4, 'p': [10, 10, 50, 40]}]}).json()
+        delta = self.post_sketch({'base': first['sketch_id'], 'strokes': [{'w': 2, 'p': [70, 70]}]}).json()
+        full = self.post_sketch({'width': 100, 'height': 80, 'strokes': [
+            {'w': 4, 'p': [10, 10, 50, 40]}, {'w': 2, 'p': [70, 70]},
+        ]}).json()
+        self.assertEqual(delta['sketch_id'], full['sketch_id'])
+        self.assertNotEqual(delta['sketch_id'], first['sketch_id'])
+
+    def test_unknown_base_asks_for_full_resend(self):
+        response = self.post_sketch({'base': 'missing', 'strokes': [{'w': 2, 'p': [1, 1]}]})
+        self.assertEqual(response.status_code, 409)
+
+
+class WarmupTests(TestCase):
+    def test_disabled_warm_up_is_ready_at_once(self):
+        warmup.state.start()
+        with self.settings(WARMUP={'ENABLED': False}):
+            self.assertIsNone(warmup.start())
+        self.assertTrue(warmup.state.ready)
+
+    def test_readiness_reports_warm_state(self):
+        with mock.patch.object(warmup, 'prepare_provider'):
+            warmup.warm_up()
+        response = self.client.get('/health/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('templates', response.json()['steps'])
+
+        warmup.state.start()
+        self.assertEqual(self.client.get('/health/ready/').status_code, 503)
+        warmup.state.finish()
+
+    @override_settings(WARMUP={'HEALTH_PROBE': True})
+    def test_pre_fork_warm_up_leaves_provider_to_children(self):
+        with mock.patch.object(warmup, 'prepare_provider') as prepare, \
+                mock.patch.object(warmup, 'probe_provider') as probe:
+            warmup.warm_up(provider=False)
+        prepare.assert_not_called()
+        probe.assert_not_called()
+        self.assertEqual(set(warmup.state.snapshot()['steps']), {'modules', 'templates'})
+
+
+class StartupImportTests(TestCase):
+    HEAVY_MODULES = ['SimplerLLM', 'google.genai', 'PIL', 'dotenv']
+
+    def test_startup_does_not_import_heavy_dependencies(self):
+        # Set up Django and import the whole URLconf the way a management
+        # command or script would, then list what ended up in sys.modules.
+        # Warm-up is off, so nothing can load in the background meanwhile.
+        code = (
+            "import json, sys, threading, django; django.setup(); "
+            "import nanobananapro.urls; "
+            "print(json.dumps({'modules': sorted(sys.modules), "
+            "'threads': [t.name for t in threading.enumerate()]}))"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='nanobananapro.settings', WARMUP_ENABLED='0')
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertNotIn('tools-warmup', loaded['threads'])
+        for module in self.HEAVY_MODULES:
+            self.assertEqual([m for m in loaded['modules'] if m == module or m.startswith(module + '.')], [])
+
+
+class PageTests(TestCase):
+    def test_pages_are_cached_and_compressible(self):
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_only_text_responses_are_gzipped(self):
+        from django.http import HttpResponse
+
+        from .middleware import TextGZipMiddleware
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        middleware = TextGZipMiddleware(lambda request: None)
+        image = middleware.process_response(request, HttpResponse(PNG_BYTES * 20, content_type='image/png'))
+        self.assertFalse(image.has_header('Content-Encoding'))
+        data = middleware.process_response(request, HttpResponse('{"a": 1}' * 50, content_type='application/json'))
+        self.assertEqual(data['Content-Encoding'], 'gzip')
+
+    def test_tailwind_cdn_until_stylesheet_is_built(self):
+        from . import context_processors
+
+        self.addCleanup(context_processors._tailwind.update, url=None, checked_at=None)
+        context_processors._tailwind.update(url=None, checked_at=None)
+        with override_settings(DEBUG=True), mock.patch.object(context_processors.finders, 'find', return_value=None):
+            self.assertIsNone(context_processors._tailwind_css_url())
+        self.assertIn('cdn.tailwindcss.com', self.client.get('/').content.decode())
+
+        context_processors._tailwind['checked_at'] -= context_processors.MISSING_RECHECK_SECONDS
+        with override_settings(DEBUG=True), mock.patch.object(context_processors.finders, 'find',
+                                                              return_value='/built/app.css'):
+            self.assertEqual(context_processors._tailwind_css_url(), '/static/tools/css/app.css')
+
+
+class InlineResponseTests(PipelineTestCase):
+    def generate(self, mode):
+        return self.client.post(f'/api/generate-text-to-image/?response={mode}',
+                                json.dumps({'prompt': 'a banana'}),
+                                content_type='application/json')
+
+    def test_bytes_response_returns_image_body(self):
+        response = self.generate('bytes')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, PNG_BYTES)
+        pipeline.drain_write_behind()
+        self.assertTrue(os.path.exists(pipeline.generated_image_path(response['X-Image-Filename'])))
+
+    def test_stream_response_is_chunked(self):
+        response = self.generate('stream')
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), PNG_BYTES)
+        pipeline.drain_write_behind()
+        self.assertTrue(os.path.exists(pipeline.generated_image_path(response['X-Image-Filename'])))
+
+    @override_settings(GENERATION_PIPELINE={'WRITE_BEHIND': False})
+    def test_without_write_behind_nothing_is_stored(self):
+        response = self.generate('bytes')
+        self.assertEqual(response.content, PNG_BYTES)
+        self.assertNotIn('X-Image-Filename', response)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'generated_images')))
+
+
+class QuotaTests(PipelineTestCase):
+    def generate(self, prompt='a banana', **headers):
+        return self.client.post('/api/generate-text-to-image/', json.dumps({'prompt': prompt}),
+                                content_type='application/json', headers=headers)
+
+    def test_rate_limit_per_key(self):
+        _, raw_key = ApiKey.generate('client', requests_per_minute=2)
+        self.assertEqual(self.generate(**{'X-API-Key': raw_key})['X-RateLimit-Remaining'], '1')
+        self.assertEqual(self.generate('other', Authorization=f'Bearer {raw_key}').status_code, 200)
+        limited = self.generate('third', **{'X-API-Key': raw_key})
+        self.assertEqual(limited.status_code, 429)
+        self.assertIn('Retry-After', limited)
+
+    def test_invalid_or_missing_key(self):
+        self.assertEqual(self.generate(**{'X-API-Key': 'nbp_wrong'}).status_code, 401)
+        with override_settings(QUOTAS={'REQUIRE_API_KEY': True}):
+            self.assertEqual(self.generate().status_code, 401)
+
+    def test_daily_spend_is_flushed_in_batches(self):
+        api_key, raw_key = ApiKey.generate('client', daily_spend_units=2)
+        self.generate('one', **{'X-API-Key': raw_key})
+        self.generate('one', **{'X-API-Key': raw_key})  # cache hit, free
+        self.assertFalse(ApiKeyUsage.objects.exists())
+
+        quotas.accountant.flush()
+        usage = ApiKeyUsage.objects.get(api_key=api_key)
+        self.assertEqual((usage.requests, usage.spend_units), (2, 1))
+
+        self.assertEqual(self.generate('two', **{'X-API-Key': raw_key}).status_code, 200)
+        response = self.generate('three', **{'X-API-Key': raw_key})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['X-Quota-Daily-Remaining'], '0')
+
+    @override_settings(QUOTAS={'FLUSH_INTERVAL': 0})
+    def test_failed_usage_flush_keeps_request_and_usage(self):
+        from django.db import OperationalError
+
+        api_key, raw_key = ApiKey.generate('client')
+        with mock.patch.object(quotas.accountant, '_write', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('tools.quotas', 'ERROR'):
+                response = self.generate(**{'X-API-Key': raw_key})
+                quotas.drain_flusher()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ApiKeyUsage.objects.exists())
+
+        quotas.accountant.flush()
+        usage = ApiKeyUsage.objects.get(api_key=api_key)
+        self.assertEqual((usage.requests, usage.spend_units), (1, 1))
+
+    def test_flush_forgets_past_days_and_idle_principals(self):
+        accountant = quotas.accountant
+        today = timezone.now().date()
+        yesterday = today - timedelta(days=1)
+        accountant.daily_spend.add(('ip:1', yesterday), 5)
+        accountant.daily_spend.add(('ip:1', today), 3)
+        accountant._loaded_days.update({('key:1', yesterday), ('key:1', today)})
+        accountant.in_flight.add('ip:1')
+        accountant.in_flight.add('ip:2')
+        accountant.in_flight.add('ip:2', -1)
+
+        accountant.flush()
+        self.assertEqual(accountant.daily_spend.drain(), {('ip:1', today): 3})
+        self.assertEqual(accountant._loaded_days, {('key:1', today)})
+        self.assertEqual(accountant.in_flight.drain(), {'ip:1': 1})
+
+
+class CoordinationTests(PipelineTestCase):
+    def backends(self):
+        return [coordination.CacheBackend(), coordination.RedisBackend(client=coordination.LocalRedis())]
+
+    def test_locks_are_exclusive(self):
+        for backend in self.backends():
+            with backend.lock('job', ttl=5):
+                with self.assertRaises(coordination.LockTimeout):
+                    with backend.lock('job', timeout=0.1):
+                        pass
+            with backend.lock('job', timeout=0.1):
+                pass
+
+    def test_result_index_and_job_state(self):
+        for backend in self.backends():
+            # Single node by default: the index records the result, not its bytes
+            backend.publish_result('a.png', PNG_BYTES)
+            self.assertFalse(backend.has_result('a.png'))
+            self.assertIsNone(backend.fetch_result('a.png'))
+            with override_settings(COORDINATION={'REPLICATE_RESULTS': True}):
+                # ... nor on a store private to this process
+                backend.publish_result('a.png', PNG_BYTES)
+                self.assertFalse(backend.has_result('a.png'))
+                with mock.patch.object(type(backend), 'process_local', new_callable=mock.PropertyMock,
+                                       return_value=False):
+                    backend.publish_result('a.png', PNG_BYTES)
+            self.assertEqual(backend.fetch_result('a.png'), PNG_BYTES)
+            backend.set_job_state('j1', status='running')
+            backend.set_job_state('j1', status='succeeded')
+            self.assertEqual(backend.get_job_state('j1')['status'], 'succeeded')
+
+    def test_rejected_job_is_reported_failed(self):
+        _, raw_key = ApiKey.generate('client', daily_spend_units=0)
+        with mock.patch.object(coordination.CoordinationBackend, 'set_job_state', autospec=True,
+                               side_effect=coordination.CoordinationBackend.set_job_state) as spy:
+            response = self.client.post('/api/generate-text-to-image/', json.dumps({'prompt': 'a banana'}),
+                                        content_type='application/json', headers={'X-API-Key': raw_key})
+        self.assertEqual(response.status_code, 429)
+        state = self.client.get(f"/api/jobs/{spy.call_args.args[1]}/").json()
+        self.assertEqual((state['status'], state['http_status']), ('failed', 429))
+
+    @override_settings(COORDINATION={'REPLICATE_RESULTS': True})
+    @mock.patch.object(coordination.CacheBackend, 'process_local', new_callable=mock.PropertyMock,
+                       return_value=False)
+    def test_result_from_another_node_can_be_edited_and_served(self, _process_local):
+        first = self.client.post('/api/edit-image/', {'image': self.upload(), 'prompt': 'add a hat'}).json()
+        # Simulate the next request landing on a node without the file
+        os.remove(pipeline.generated_image_path(first['filename']))
+        second = self.client.post('/api/edit-image/',
+                                  {'current_image': first['filename'], 'prompt': 'make it red'})
+        self.assertEqual(second.status_code, 200)
+
+        os.remove(pipeline.generated_image_path(first['filename']))
+        response = self.client.get(first['image_url'])
+        self.assertEqual(b''.join(response.streaming_content), PNG_BYTES)
+
+        state = self.client.get(f"/api/jobs/{second.json()['job_id']}/").json()
+        self.assertEqual(state['status'], 'succeeded')
+
+
+class DraftEditTests(PipelineTestCase):
+    def large_upload(self):
+        return SimpleUploadedFile('photo.png', make_png((2000, 1000)), content_type='image/png')
+
+    def test_draft_then_finalize_reruns_chain_at_full_quality(self):
+        first = self.client.post('/api/edit-image/', {
+            'image': self.large_upload(), 'prompt': 'add a hat', 'mode': 'draft'}).json()
+        self.assertTrue(first['draft'])
+        draft_call = self.generator.calls[0]
+        self.assertEqual(draft_call['model'], 'gemini-2.5-flash-image')
+        # The downsampled preview is sent as JPEG instead of the PNG upload
+        self.assertTrue(draft_call['image_source'].endswith('.jpg'))
+
+        second = self.client.post('/api/edit-image/', {
+            'current_image': first['filename'], 'prompt': 'make it red', 'mode': 'draft'}).json()
+        final = self.client.post('/api/edit-image/', {
+            'current_image': second['filename'], 'mode': 'finalize'})
+        self.assertEqual(final.status_code, 200)
+        self.assertNotIn('draft', final.json())
+
+        final_calls = self.generator.calls[2:]
+        self.assertEqual([c['edit_prompt'] for c in final_calls], ['add a hat', 'make it red'])
+        self.assertTrue(all(c['model'] == 'gemini-3-pro-image-preview' for c in final_calls))
+        # Each step goes to the provider labelled with its real format
+        self.assertTrue(final_calls[0]['image_source'].endswith('.png'))
+        self.assertEqual(final_calls[1]['image_source'], {'data': PNG_BYTES, 'mime_type': 'image/png'})
+
+    def test_finalize_keeps_source_format(self):
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'white').save(buffer, format='JPEG')
+        upload = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+        draft = self.client.post('/api/edit-image/', {'image': upload, 'prompt': 'add a hat', 'mode': 'draft'})
+        self.client.post('/api/edit-image/', {'current_image': draft.json()['filename'], 'mode': 'finalize'})
+        self.assertTrue(self.generator.calls[-1]['image_source'].endswith('.jpg'))
+
+    def test_finalize_unknown_draft(self):
+        response = self.client.post('/api/edit-image/', {'current_image': 'nope.png', 'mode': 'finalize'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PrioritySchedulerTests(TestCase):
+    def make(self, slots=1, **kwargs):
+        kwargs.setdefault('reservations', {'interactive': 0, 'standard': 0, 'bulk': 0})
+        return scheduler.PriorityScheduler(slots, weights={'interactive': 8, 'standard': 3, 'bulk': 1}, **kwargs)
+
+    def queue(self, sched, priority, order):
+        def run():
+            sched.acquire(priority, timeout=5)
+            order.append(priority)
+            sched.release(priority)
+        thread = threading.Thread(target=run)
+        thread.start()
+        # Wait until the request is queued before starting the next
+        while sum(c['queue_depth'] for c in sched.snapshot()['classes'].values()) < len(self.threads) + 1:
+            time.sleep(0.001)
+        self.threads.append(thread)
+
+    def setUp(self):
+        self.threads = []
+
+    def test_interactive_overtakes_queued_bulk(self):
+        sched = self.make()
+        sched.acquire('bulk', timeout=1)
+        order = []
+        self.queue(sched, 'bulk', order)
+        self.queue(sched, 'interactive', order)
+        sched.release('bulk')
+        for thread in self.threads:
+            thread.join()
+        self.assertEqual(order, ['interactive', 'bulk'])
+        self.assertEqual(sched.snapshot()['classes']['bulk']['dispatched'], 2)
+
+    def test_starved_request_is_served_first(self):
+        sched = self.make(starvation_timeout=0)
+        sched.acquire('interactive', timeout=1)
+        order = []
+        self.queue(sched, 'bulk', order)
+        self.queue(sched, 'interactive', order)
+        sched.release('interactive')
+        for thread in self.threads:
+            thread.join()
+        self.assertEqual(order, ['bulk', 'interactive'])
+
+    def test_reserved_slots_are_kept_for_their_class(self):
+        sched = self.make(slots=2, reservations={'interactive': 1, 'standard': 0, 'bulk': 0})
+        sched.acquire('bulk', timeout=1)
+        with self.assertRaises(scheduler.SchedulerTimeout):
+            sched.acquire('bulk', timeout=0.05)
+        sched.acquire('interactive', timeout=0.05)
+
+    def test_api_keys_can_opt_down_but_not_up(self):
+        request = RequestFactory().post('/', HTTP_X_PRIORITY='bulk')
+        self.assertEqual(scheduler.classify(request, None), 'bulk')
+        # Keyless callers rank below API keys unless they are the site's own pages
+        self.assertEqual(scheduler.classify(RequestFactory().post('/'), None), 'anonymous')
+        request = RequestFactory().post('/', HTTP_SEC_FETCH_SITE='same-origin')
+        self.assertEqual(scheduler.classify(request, None), 'anonymous')
+
+        page = self.client.get('/')
+        self.assertIn('private', page['Cache-Control'])
+        request = RequestFactory().post('/')
+        request.COOKIES[scheduler.PAGE_COOKIE] = page.cookies[scheduler.PAGE_COOKIE].value
+        self.assertEqual(scheduler.classify(request, None), 'interactive')
+        # The cookie only counts from the address it was issued to
+        request.META['REMOTE_ADDR'] = '10.0.0.9'
+        self.assertEqual(scheduler.classify(request, None), 'anonymous')
+        key = quotas.Principal('key:1', 1, 1, 1, 1)
+        request = RequestFactory().post('/', HTTP_X_PRIORITY='interactive')
+        self.assertEqual(scheduler.classify(request, key), 'standard')
+
+
+class PostprocessTests(PipelineTestCase):
+    def open_result(self, filename):
+        from PIL import Image
+        return Image.open(os.path.join(self.media_root, 'generated_images', filename))
+
+    def test_preset_title_and_watermark(self):
+        watermark = os.path.join(self.media_root, 'logo.png')
+        with open(watermark, 'wb') as f:
+            f.write(make_png((40, 20)))
+        data = imaging.postprocess(make_png((300, 300)), preset='youtube',
+                                   watermark_path=watermark, title='Big news today')
+
+        from PIL import Image
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.size, (1280, 720))
+        self.assertGreater(len(image.getcolors(1 << 16) or []), 1)
+
+    def test_thumbnail_defaults_to_youtube_size_in_worker_process(self):
+        response = self.client.post('/api/generate-youtube-thumbnail/',
+                                    {'image': self.upload(), 'prompt': 'shocked face'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.open_result(response.json()['filename']).size, (1280, 720))
+
+    @override_settings(GENERATION_PIPELINE={'POSTPROCESS_WORKERS': 0})
+    def test_options_are_validated_and_part_of_cache_key(self):
+        response = self.client.post('/api/enhance-product-ad/', {'image': self.upload(), 'preset': 'poster'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/enhance-product-ad/', {'image': self.upload(), 'watermark': '1'})
+        self.assertEqual(response.json()['error'], 'Watermarking is not configured on this server')
+
+        plain = self.client.post('/api/enhance-product-ad/', {'image': self.upload()}).json()
+        square = self.client.post('/api/enhance-product-ad/',
+                                  {'image': self.upload(), 'preset': 'ecommerce_square'}).json()
+        self.assertNotEqual(plain['filename'], square['filename'])
+        self.assertEqual(self.open_result(square['filename']).size, (2000, 2000))
+
+
+class TracingTests(PipelineTestCase):
+    def generate(self, mode='json', **headers):
+        return self.client.post(f'/api/generate-text-to-image/?response={mode}',
+                                json.dumps({'prompt': 'a banana'}),
+                                content_type='application/json', headers=headers)
+
+    def span_names(self, trace_id):
+        return [span.name for span in self.traces.spans if span.trace_id == trace_id]
+
+    @override_settings(TRACING={'SAMPLE_RATE': 0})
+    def test_failed_trace_is_kept_with_stage_spans(self):
+        with mock.patch.object(self.generator, 'generate_image', side_effect=RuntimeError('provider down')):
+            response = self.generate()
+        self.assertEqual(response.status_code, 500)
+        trace_id = response['X-Trace-Id']
+        self.assertEqual(response.json()['trace_id'], trace_id)
+
+        names = self.span_names(trace_id)
+        for name in ['parse', 'stage.metrics', 'stage.cache', 'stage.throttle', 'stage.storage', 'provider.call']:
+            self.assertIn(name, names)
+        provider = next(s for s in self.traces.spans if s.name == 'provider.call')
+        self.assertEqual(provider.status, 'ERROR')
+        self.assertEqual(provider.events[0]['attributes']['exception.message'], 'provider down')
+
+    @override_settings(TRACING={'SAMPLE_RATE': 0})
+    def test_fast_successful_trace_is_dropped(self):
+        response = self.generate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.traces.spans, [])
+
+    @override_settings(TRACING={'SAMPLE_RATE': 0})
+    def test_rejected_request_is_not_an_error(self):
+        _, raw_key = ApiKey.generate('client', daily_spend_units=0)
+        response = self.generate(**{'X-API-Key': raw_key})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.traces.spans, [])
+
+        # Kept for another reason, the rejection shows up as attributes only
+        with override_settings(TRACING={'SAMPLE_RATE': 1}):
+            response = self.generate(**{'X-API-Key': raw_key})
+        spans = [s for s in self.traces.spans if s.trace_id == response['X-Trace-Id']]
+        self.assertTrue(spans)
+        self.assertTrue(all(s.status != 'ERROR' for s in spans))
+        quota = next(s for s in spans if s.name == 'stage.quota')
+        self.assertEqual(quota.attributes['rejection.status'], 429)
+
+    def test_file_export_is_queued_and_rotated(self):
+        path = os.path.join(self.media_root, 'traces.jsonl')
+        file_exporter = tracing.FileExporter(path, max_bytes=600, backups=1)
+        gate = threading.Event()
+        held = mock.Mock(export=lambda spans: gate.wait(5) and file_exporter.export(spans))
+        exporter = tracing.BackgroundExporter(held, max_spans=3)
+        for i in range(4):
+            exporter.export([tracing.Span(f'span-{i}', 'ab' * 16)])
+        gate.set()
+        exporter.flush()
+        self.assertEqual(exporter.dropped, 1)
+        self.assertTrue(os.path.exists(path + '.1'))
+        self.assertFalse(os.path.exists(path + '.2'))
+        with open(path) as f:
+            self.assertEqual(json.loads(f.readlines()[-1])['name'], 'span-2')
+
+    @override_settings(TRACING={'SAMPLE_RATE': 0, 'SLOW_THRESHOLD': 0})
+    def test_remote_parent_and_write_behind_thread_join_the_trace(self):
+        trace_id = 'ab' * 16
+        response = self.generate('bytes', traceparent=f'00-{trace_id}-{"cd" * 8}-01')
+        self.assertEqual(response['X-Trace-Id'], trace_id)
+        for _ in range(100):
+            if 'storage.write' in self.span_names(trace_id):
+                break
+            time.sleep(0.01)
+        self.assertIn('storage.write', self.span_names(trace_id))
+        root = next(s for s in self.traces.spans if s.is_local_root)
+        self.assertEqual(root.parent_id, 'cd' * 8)
+
+
+class BulkEnhanceTests(PipelineTestCase):
+    def make_zip(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('shoes/sku-1.png', PNG_BYTES)
+            archive.writestr('shoes/sku-2.png', PNG_BYTES)
+            archive.writestr('sku-3.png', make_png((9, 9)))
+            archive.writestr('notes.txt', b'not an image')
+        return buffer.getvalue()
+
+    def read_manifest(self, path):
+        with zipfile.ZipFile(path) as archive:
+            rows = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode())))
+            return rows, sorted(archive.namelist())
+
+    def test_dedupes_and_resumes_from_checkpoint(self):
+        run = bulk.BulkRun.create('catalog.zip', [self.make_zip()])
+        state = run.process(workers=2)
+        self.assertEqual(state['status'], 'completed')
+        self.assertEqual((state['total_entries'], state['unique_images'], state['duplicates'], state['invalid']),
+                         (4, 2, 1, 1))
+        self.assertEqual(len(self.generator.calls), 2)
+        self.assertTrue(all(call['model'] == specs.PRO_IMAGE_MODEL for call in self.generator.calls))
+
+        rows, names = self.read_manifest(run.results_path)
+        self.assertEqual(names, ['images/sku-1.png', 'images/sku-2.png', 'images/sku-3.png', 'manifest.csv'])
+        self.assertEqual([row['status'] for row in rows], ['ok', 'ok', 'ok', 'invalid'])
+
+        # Resuming skips everything in the checkpoint, even without the result cache
+        caches['coordination'].clear()
+        bulk.get_run(run.run_id).process()
+        self.assertEqual(len(self.generator.calls), 2)
+
+    def start_capturing(self):
+        """Patch bulk.start so the test can join the run threads it spawns."""
+        threads = []
+
+        def start(run, principal=None):
+            threads.append(real_start(run, principal))
+            return threads[-1]
+
+        real_start = bulk.start
+        patcher = mock.patch.object(bulk, 'start', side_effect=start)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return threads
+
+    def test_api_requires_key_and_serves_results(self):
+        threads = self.start_capturing()
+        upload = SimpleUploadedFile('catalog.zip', self.make_zip(), content_type='application/zip')
+        response = self.client.post('/api/bulk/product-ad-enhancer/', {'file': upload})
+        self.assertEqual(response.status_code, 401)
+
+        _, raw_key = ApiKey.generate('shop')
+        headers = {'X-API-Key': raw_key}
+        upload.seek(0)
+        response = self.client.post('/api/bulk/product-ad-enhancer/', {'file': upload}, headers=headers)
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        threads[0].join(timeout=30)
+        state = self.client.get(status_url, headers=headers).json()
+        self.assertEqual(state['status'], 'completed')
+
+        response = self.client.get(state['results_url'], headers=headers)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(self.client.get(status_url).status_code, 401)
+
+    def test_orphaned_run_can_resume_but_live_one_cannot(self):
+        threads = self.start_capturing()
+        _, raw_key = ApiKey.generate('shop')
+        headers = {'X-API-Key': raw_key}
+        run = bulk.BulkRun.create('catalog.zip', [self.make_zip()], principal_id=f"key:{ApiKey.objects.get().pk}")
+        run.save_state(status='running')
+        url = f'/api/bulk/{run.run_id}/'
+        self.assertEqual(self.client.post(url, headers=headers).status_code, 409)
+
+        # A restart left it 'running' with a lapsed lease
+        run.save_state()
+        run.state['updated_at'] -= bulk.bulk_setting('LEASE_SECONDS')
+        with open(os.path.join(run.path, 'state.json'), 'w') as f:
+            json.dump(run.state, f)
+        self.assertEqual(self.client.post(url, headers=headers).status_code, 202)
+        threads[0].join(timeout=30)
+        self.assertEqual(bulk.get_run(run.run_id).state['status'], 'completed')
+
+    def test_shed_images_are_retried(self):
+        controller = overload.controller
+        with mock.patch.object(controller, 'should_shed', side_effect=[True, False, False]), \
+                mock.patch.object(controller, 'retry_after', return_value=0):
+            state = bulk.BulkRun.create('catalog.zip', [self.make_zip()]).process(workers=1)
+        self.assertEqual((state['status'], state['done'], state['failed']), ('completed', 2, 0))
+        self.assertEqual(controller.snapshot()['shed'], {'bulk': 1})
+
+
+    def test_run_stops_at_the_daily_budget(self):
+        cost = pipeline.get_tool('product_ad_enhancer').cost_units
+        api_key, _ = ApiKey.generate('shop', daily_spend_units=cost)
+        principal = quotas.Principal(f"key:{api_key.pk}", api_key.pk, 100, 10, cost)
+        state = bulk.BulkRun.create('catalog.zip', [self.make_zip()]).process(principal, workers=2)
+        self.assertEqual((state['status'], state['done']), ('paused', 1))
+        self.assertEqual(len(self.generator.calls), 1)
+        self.assertEqual(quotas.accountant.remaining_spend(principal), 0)
+
+    @override_settings(BULK={'MAX_ENTRIES': 3, 'MAX_UPLOAD_BYTES': 1024})
+    def test_oversized_uploads_are_refused(self):
+        with self.assertRaises(PipelineError) as raised:
+            bulk.BulkRun.create('catalog.zip', [self.make_zip()])
+        self.assertEqual(raised.exception.status, 413)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'bulk')), [])
+
+        _, raw_key = ApiKey.generate('shop')
+        upload = SimpleUploadedFile('catalog.zip', b'x' * 2048, content_type='application/zip')
+        response = self.client.post('/api/bulk/product-ad-enhancer/', {'file': upload},
+                                    headers={'X-API-Key': raw_key})
+        self.assertEqual(response.status_code, 413)
+
+
+class OverloadTests(PipelineTestCase):
+    def generate(self, prompt, size='square', **headers):
+        return self.client.post('/api/generate-text-to-image/', json.dumps({'prompt': prompt, 'size': size}),
+                                content_type='application/json', headers=headers)
+
+    def overload(self):
+        controller = overload.controller
+        controller.observe(5.0, now=0)
+        controller.observe(5.0, now=overload.overload_setting('INTERVAL'))
+        self.assertTrue(controller.overloaded)
+
+    def test_codel_needs_a_standing_queue_for_a_full_interval(self):
+        controller = overload.controller
+        controller.observe(5.0, now=0)
+        controller.observe(5.0, now=5)
+        self.assertFalse(controller.overloaded)
+        controller.observe(0.1, now=6)
+        controller.observe(5.0, now=11)
+        self.assertFalse(controller.overloaded)
+        controller.observe(5.0, now=21)
+        self.assertTrue(controller.overloaded)
+        # Leaving overload also takes a full interval below target
+        controller.observe(0.1, now=30)
+        controller.observe(0.1, now=35)
+        self.assertTrue(controller.overloaded)
+        controller.observe(5.0, now=36)
+        controller.observe(0.1, now=37)
+        controller.observe(0.1, now=46)
+        self.assertTrue(controller.overloaded)
+        controller.observe(0.1, now=47)
+        self.assertFalse(controller.overloaded)
+
+    @override_settings(OVERLOAD={'TARGET_DELAY': 2.0, 'INTERVAL': 10.0})
+    def test_overload_sheds_bulk_but_serves_near_duplicates(self):
+        first = self.generate('A red banana!').json()
+        with mock.patch.object(pipeline.get_scheduler(), 'oldest_wait', return_value=5.0):
+            self.overload()
+            response = self.generate('a red  banana', size='vertical', **{'X-Priority': 'bulk'})
+            self.assertEqual(response.json()['filename'], first['filename'])
+            self.assertTrue(response.json()['degraded'])
+
+            response = self.generate('a green banana', **{'X-Priority': 'bulk'})
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response)
+
+            # Keyless API callers go next, however they dress up the request;
+            # visitors of the site's own pages are still served
+            self.assertEqual(self.generate('a green banana').status_code, 503)
+            self.assertEqual(self.generate('a green banana', **{'Sec-Fetch-Site': 'same-origin'}).status_code, 503)
+            self.assertEqual(self.client.get('/').status_code, 200)
+            self.assertEqual(self.generate('a green banana').status_code, 200)
+        self.assertEqual(len(self.generator.calls), 2)
+        self.assertEqual(overload.controller.snapshot()['shed'], {'bulk': 1, 'anonymous': 2})
+
+
+class ReferenceTests(PipelineTestCase):
+    def register(self, data=PNG_BYTES):
+        upload = SimpleUploadedFile('face.png', data, content_type='image/png')
+        return self.client.post('/api/references/', {'image': upload})
+
+    def test_thumbnail_by_reference_id_skips_upload(self):
+        response = self.register(make_png((3000, 1500)))
+        self.assertEqual(response.status_code, 201)
+        ref = response.json()
+        self.assertEqual((ref['width'], ref['height']), (1536, 768))
+        self.assertEqual(self.register(make_png((3000, 1500))).json()['reference_id'], ref['reference_id'])
+
+        for prompt in ['shocked face', 'happy face']:
+            response = self.client.post('/api/generate-youtube-thumbnail/',
+                                        {'reference_id': ref['reference_id'], 'prompt': prompt})
+            self.assertEqual(response.status_code, 200)
+        sent = self.generator.calls[-1]['reference_images'][0]
+        self.assertIsInstance(sent, bytes)
+        self.assertEqual(len(sent), ref['bytes'])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'uploads')))
+
+        # Another node (empty local cache) resolves it through the backend
+        references.local_cache.clear()
+        self.assertIsNotNone(references.lookup(ref['reference_id'], 'ip:127.0.0.1'))
+        # ... which holds only the metadata, the bytes stay under MEDIA_ROOT
+        backend = coordination.get_backend()
+        self.assertNotIn('data', backend.get(backend.key('reference', ref['reference_id'])))
+
+    def test_references_belong_to_their_registrant(self):
+        ref_id = self.register().json()['reference_id']
+        response = self.client.post('/api/generate-youtube-thumbnail/',
+                                    {'reference_id': ref_id, 'prompt': 'shocked face'}, REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(response.status_code, 404)
+        # The same photo registered by someone else gets its own id
+        upload = SimpleUploadedFile('face.png', PNG_BYTES, content_type='image/png')
+        other = self.client.post('/api/references/', {'image': upload}, REMOTE_ADDR='10.0.0.9').json()
+        self.assertNotEqual(other['reference_id'], ref_id)
+
+    @override_settings(QUOTAS={'ANONYMOUS_REQUESTS_PER_MINUTE': 2})
+    def test_registration_is_rate_limited(self):
+        self.assertEqual([self.register().status_code for _ in range(3)], [201, 201, 429])
+
+    def test_unknown_reference_and_cache_bound(self):
+        response = self.client.post('/api/generate-youtube-thumbnail/',
+                                    {'reference_id': 'ref_missing', 'prompt': 'shocked face'})
+        self.assertEqual(response.status_code, 404)
+
+        lru = references.ReferenceCache(max_bytes=10)
+        lru.put('a', {'data': b'12345'})
+        lru.put('b', {'data': b'12345'})
+        lru.get('a')
+        lru.put('c', {'data': b'12345'})
+        self.assertIsNone(lru.get('b'))
+        self.assertIsNotNone(lru.get('a'))
+        self.assertEqual(lru.size, 10)
+
+    def test_thumbnail_composes_extra_references(self):
+        logo_id = self.register(make_png((40, 20))).json()['reference_id']
+        face = SimpleUploadedFile('face.png', PNG_BYTES, content_type='image/png')
+        extras = [SimpleUploadedFile(f'style{i}.png', make_png((10 + i, 10)), content_type='image/png')
+                  for i in range(2)]
+        response = self.client.post('/api/generate-youtube-thumbnail/', {
+            'image': face, 'references': extras, 'reference_ids': logo_id, 'prompt': 'shocked face',
+        })
+        self.assertEqual(response.status_code, 200)
+        call = self.generator.calls[-1]
+        self.assertEqual(len(call['reference_images']), 4)
+        self.assertIsInstance(call['reference_images'][1], bytes)
+        self.assertIn('3 additional reference images follow', call['prompt'])
+        # Each extra upload was registered, so it can be reused by id
+        owner = 'ip:127.0.0.1'
+        self.assertIsNotNone(references.lookup(references.reference_id(make_png((11, 10)), owner), owner))
+
+        with self.settings(REFERENCES={'MAX_PER_REQUEST': 2}):
+            response = self.client.post('/api/generate-youtube-thumbnail/', {
+                'reference_id': logo_id, 'reference_ids': f'{logo_id},{logo_id}', 'prompt': 'happy face',
+            })
+        self.assertEqual(response.status_code, 400)
+        with self.settings(REFERENCES={'MAX_PROVIDER_BYTES': 100}):
+            response = self.client.post('/api/generate-sketch-to-image/', {
+                'image': SimpleUploadedFile('sketch.png', PNG_BYTES, content_type='image/png'),
+                'reference_ids': logo_id,
+            })
+        self.assertEqual(response.status_code, 413)
+
+
+class ResumableUploadTests(PipelineTestCase):
+    def create(self, data, name='big.png'):
+        response = self.client.post('/api/uploads/', headers={
+            'Upload-Length': str(len(data)),
+            'Upload-Metadata': 'filename ' + base64.b64encode(name.encode()).decode(),
+        })
+        self.assertEqual(response.status_code, 201)
+        return response['Location']
+
+    def patch(self, url, chunk, offset, checksum=None):
+        headers = {'Upload-Offset': str(offset)}
+        if checksum is not False:
+            digest = hashlib.sha256(chunk if checksum is None else checksum).digest()
+            headers['Upload-Checksum'] = 'sha256 ' + base64.b64encode(digest).decode()
+        return self.client.patch(url, chunk, content_type='application/offset+octet-stream', headers=headers)
+
+    def test_chunked_upload_resumes_and_feeds_any_endpoint(self):
+        data = make_png((64, 64))
+        url = self.create(data)
+        middle = len(data) // 2
+
+        self.assertEqual(self.patch(url, data[:middle], 0).status_code, 204)
+        # A corrupted chunk is rejected without moving the offset
+        self.assertEqual(self.patch(url, data[middle:], middle, checksum=b'other').status_code, 460)
+        # A chunk at the wrong offset is told where to resume
+        response = self.patch(url, data[middle:], 0)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, str(middle)))
+        self.assertEqual(self.client.head(url)['Upload-Offset'], str(middle))
+
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.patch(url, data[middle:], middle)['Upload-Offset'], str(len(data)))
+        upload_id = self.client.post(url + 'finalize/').json()['upload_id']
+
+        response = self.client.post('/api/enhance-product-ad/', {'upload_id': upload_id})
+        self.assertEqual(response.status_code, 200)
+        with open(self.generator.calls[-1]['image_source'], 'rb') as f:
+            self.assertEqual(f.read(), data)
+        response = self.client.post('/api/generate-youtube-thumbnail/',
+                                    {'upload_id': upload_id, 'prompt': 'shocked face'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_uploads_are_private_and_validated(self):
+        response = self.client.post('/api/uploads/', headers={
+            'Upload-Length': '10', 'Upload-Metadata': 'filename ' + base64.b64encode(b'notes.txt').decode()})
+        self.assertEqual(response.status_code, 400)
+
+        data = b'not really a png'
+        url = self.create(data)
+        self.patch(url, data, 0, checksum=False)
+        self.assertEqual(self.client.post(url + 'finalize/').status_code, 400)
+        self.assertEqual(self.client.head(url, REMOTE_ADDR='10.0.0.9').status_code, 404)
+
+    @override_settings(UPLOADS={'MAX_SIDE': 16})
+    def test_oversized_upload_is_downscaled_within_limit(self):
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (64, 64), os.urandom(64 * 64 * 3)).save(buffer, format='PNG')
+        data = buffer.getvalue()
+        with mock.patch.object(uploads, 'MAX_UPLOAD_SIZE', len(data) - 1):
+            url = self.create(data)
+            self.patch(url, data, 0)
+            finalized = self.client.post(url + 'finalize/').json()
+        [name] = os.listdir(uploads.upload_dir())
+        self.assertEqual(name, finalized['upload_id'] + '.jpg')
+        with open(os.path.join(uploads.upload_dir(), name), 'rb') as f:
+            stored = f.read()
+        self.assertLess(len(stored), len(data))
+        self.assertEqual((finalized['size'], finalized['sha256']), (len(stored), hashlib.sha256(stored).hexdigest()))
+
+        # Refused, rather than passed on, if downscaling does not bring it under
+        with mock.patch.object(uploads, 'MAX_UPLOAD_SIZE', 10):
+            url = self.create(data)
+            self.patch(url, data, 0)
+            self.assertEqual(self.client.post(url + 'finalize/').status_code, 413)
+
+
+class CapacityReportTests(PipelineTestCase):
+    def generate(self, prompt):
+        return self.client.post('/api/generate-text-to-image/', json.dumps({'prompt': prompt}),
+                                content_type='application/json')
+
+    def test_rollups_merge_incrementally_into_report(self):
+        self.generate('a banana')
+        self.generate('a banana')
+        with mock.patch.object(self.generator, 'generate_image', side_effect=RuntimeError('provider down')):
+            self.assertEqual(self.generate('a cherry').status_code, 500)
+        analytics.recorder.flush()
+        self.generate('an apple')
+        analytics.recorder.flush()
+
+        self.assertEqual(GenerationRollup.objects.count(), 1)
+        [entry] = analytics.report(days=1)
+        self.assertEqual((entry['tool'], entry['model']), ('text_to_image', 'default'))
+        self.assertEqual(entry['requests'], 4)
+        self.assertEqual(entry['cache_hit_rate'], 0.25)
+        self.assertEqual(entry['provider_error_rate'], round(1 / 3, 4))
+        self.assertEqual(entry['cost_units'], 2)
+        self.assertEqual(entry['bytes_stored'], 2 * len(PNG_BYTES))
+        self.assertIsNotNone(entry['p95_seconds'])
+        self.assertEqual(sum(GenerationRollup.objects.get().latency_histogram), 4)
+
+    def test_rejections_are_not_errors(self):
+        _, raw_key = ApiKey.generate('client', daily_spend_units=0)
+        response = self.client.post('/api/generate-text-to-image/', json.dumps({'prompt': 'a banana'}),
+                                    content_type='application/json', headers={'X-API-Key': raw_key})
+        self.assertEqual(response.status_code, 429)
+        self.generate('a banana')
+        analytics.recorder.flush()
+
+        stats = pipeline.metrics.snapshot()['text_to_image']
+        self.assertEqual((stats['requests'], stats['errors'], stats['rejected']), (1, 0, 1))
+        [entry] = analytics.report(days=1)
+        self.assertEqual((entry['requests'], entry['error_rate']), (1, 0.0))
+
+    def test_flush_merges_into_a_row_changed_since_it_was_read(self):
+        self.generate('a banana')
+        analytics.recorder.flush()
+        stale = GenerationRollup.objects.get()
+        self.generate('a cherry')
+        analytics.recorder.flush()
+        # Another process read the row before the last flush landed
+        self.generate('an apple')
+        with mock.patch.object(GenerationRollup.objects, 'get_or_create', return_value=(stale, False)):
+            analytics.recorder.flush()
+        row = GenerationRollup.objects.get()
+        self.assertEqual(row.requests, 3)
+        self.assertEqual(sum(row.latency_histogram), 3)
+
+    @override_settings(ANALYTICS={'FLUSH_INTERVAL': 0})
+    def test_failed_flush_keeps_rollups_off_the_request_path(self):
+        from django.db import OperationalError
+
+        with mock.patch.object(analytics.recorder, '_write', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('tools.analytics', 'ERROR'):
+                response = self.generate('a banana')
+                analytics.drain_flusher()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(GenerationRollup.objects.exists())
+
+        analytics.recorder.flush()
+        [entry] = analytics.report(days=1)
+        self.assertEqual(entry['requests'], 1)
+        self.assertEqual(sum(GenerationRollup.objects.get().latency_histogram), 1)
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_admin_and_command_render_report(self):
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+
+        self.generate('a banana')
+        analytics.recorder.flush()
+
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/tools/generationrollup/?report_days=30')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Capacity report')
+        self.assertEqual(response.context['report'][0]['requests'], 1)
+
+        out = io.StringIO()
+        call_command('capacity_report', '--days', '1', stdout=out)
+        self.assertIn('text_to_image', out.getvalue())
@@ -0,0 +1,406 @@
+"""
+Request tracing with tail-based sampling.
+
+Spans follow the OpenTelemetry data model (128-bit trace ids, 64-bit span
+ids, attributes, events, OK/ERROR status) and trace context is read from and
+written to the W3C ``traceparent`` header, so traces line up with any
+OpenTelemetry-instrumented client or proxy. Nothing beyond the standard
+library is needed, so tracing works offline.
+
+TracingMiddleware opens a root span per request; the pipeline adds child
+spans for body parsing, upload writes, each stage, the provider call,
+post-processing and storage. The current span lives in a ContextVar; use
+``wrap()`` to carry it into a worker thread.
+
+Only unexpected exceptions and 5xx responses mark a span ERROR. Requests the
+API rejects on purpose - a PipelineError such as a validation error, a quota
+429 or an overload 503 - are recorded as attributes, so a burst of rejections
+is not mistaken for failures.
+
+Finished spans are buffered per trace. When the local root span ends the
+whole trace is kept if it failed, took longer than SLOW_THRESHOLD or falls in
+the SAMPLE_RATE fraction, and otherwise dropped. Kept traces are handed to a
+bounded background queue (spans beyond EXPORT_QUEUE are dropped and counted)
+and written by the configured exporter: ``file`` (one OTLP-style JSON span per
+line, rotated at MAX_FILE_BYTES), ``console`` (stderr) or ``none``.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .exceptions import PipelineError
+
+
+TRACING_DEFAULTS = {
+    'ENABLED': True,
+    'EXPORTER': 'none',
+    'FILE': 'traces.jsonl',
+    # The file is rotated to FILE.1 ... FILE.<FILE_BACKUPS> at this size
+    'MAX_FILE_BYTES': 50 * 1024 * 1024,
+    'FILE_BACKUPS': 3,
+    # Spans waiting for the background exporter; more are dropped
+    'EXPORT_QUEUE': 10_000,
+    'SERVICE_NAME': 'nanobananapro',
+    # Traces at least this slow (seconds) are always kept
+    'SLOW_THRESHOLD': 10.0,
+    # Fraction of fast, successful traces kept
+    'SAMPLE_RATE': 0.01,
+    # Traces buffered at once; the oldest unfinished one is dropped beyond this
+    'MAX_PENDING_TRACES': 1000,
+}
+
+
+def tracing_setting(name):
+    return getattr(settings, 'TRACING', {}).get(name, TRACING_DEFAULTS[name])
+
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'events',
+                 'status', 'status_message', 'start_ns', 'end_ns', 'is_local_root')
+
+    def __init__(self, name, trace_id, parent_id=None, is_local_root=False, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = 'UNSET'
+        self.status_message = ''
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.is_local_root = is_local_root
+
+    @property
+    def duration(self):
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        self.events.append({'name': name, 'timeUnixNano': time.time_ns(), 'attributes': attributes})
+
+    def set_error(self, message=''):
+        self.status = 'ERROR'
+        self.status_message = message
+
+    def record_rejection(self, exc):
+        """Note an expected, handled rejection (a PipelineError) without marking an error."""
+        self.set_attribute('rejection.type', type(exc).__name__)
+        self.set_attribute('rejection.status', exc.status)
+        self.set_attribute('rejection.message', exc.message)
+
+    def record_exception(self, exc):
+        self.set_error(str(exc))
+        self.add_event('exception', **{
+            'exception.type': type(exc).__name__,
+            'exception.message': str(exc),
+            'exception.stacktrace': ''.join(traceback.format_exception(exc)),
+        })
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'attributes': self.attributes,
+            'events': self.events,
+            'status': {'code': self.status, 'message': self.status_message},
+            'resource': {'service.name': tracing_setting('SERVICE_NAME')},
+        }
+
+
+def parse_traceparent(header):
+    """Return ``(trace_id, parent_span_id)`` from a W3C traceparent, or None."""
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2]
+
+
+# ---------------------------------------------------------------------------
+# Exporters
+# ---------------------------------------------------------------------------
+
+class FileExporter:
+    """Append spans as JSON lines, rotating the file at ``max_bytes``."""
+
+    def __init__(self, path, max_bytes=None, backups=None):
+        self.path = path
+        self.max_bytes = max_bytes if max_bytes is not None else tracing_setting('MAX_FILE_BYTES')
+        self.backups = backups if backups is not None else tracing_setting('FILE_BACKUPS')
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def export(self, spans):
+        data = ''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans).encode('utf-8')
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = 0
+            if size and size + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, 'ab') as f:
+                f.write(data)
+
+
+class ConsoleExporter:
+    """Print one line per span to stderr."""
+
+    def export(self, spans):
+        for span in spans:
+            status = f" ERROR {span.status_message}" if span.status == 'ERROR' else ''
+            sys.stderr.write(f"[trace {span.trace_id[:8]}] {span.name} {span.duration * 1000:.1f}ms{status}\n")
+
+
+class MemoryExporter:
+    """Keep exported spans in a list (for tests and debugging)."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+class BackgroundExporter:
+    """Hand spans to another exporter on a daemon thread through a bounded queue."""
+
+    def __init__(self, exporter, max_spans=None):
+        self.exporter = exporter
+        self.max_spans = max_spans if max_spans is not None else tracing_setting('EXPORT_QUEUE')
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+        self._thread.start()
+
+    def export(self, spans):
+        with self._lock:
+            if self._queued + len(spans) > self.max_spans:
+                self.dropped += len(spans)
+                return
+            self._queued += len(spans)
+        self._queue.put(spans)
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                self.exporter.export(spans)
+            except Exception as e:
+                sys.stderr.write(f"Trace export failed: {e}\n")
+            finally:
+                with self._lock:
+                    self._queued -= len(spans)
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued span has been exported."""
+        self._queue.join()
+
+
+def make_exporter():
+    kind = tracing_setting('EXPORTER')
+    if kind == 'file':
+        path = str(tracing_setting('FILE'))
+        if not os.path.isabs(path):
+            path = os.path.join(settings.BASE_DIR, path)
+        return BackgroundExporter(FileExporter(path))
+    if kind == 'console':
+        return BackgroundExporter(ConsoleExporter())
+    if kind == 'none':
+        return None
+    raise ValueError(f"Unknown TRACING exporter: {kind}")
+
+
+# ---------------------------------------------------------------------------
+# Tail-based sampling
+# ---------------------------------------------------------------------------
+
+class TailSampler:
+    """Buffer spans per trace and decide once the local root span ends."""
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()     # trace_id -> finished spans
+        self._decisions = OrderedDict()   # trace_id -> kept?, for late spans
+
+    def should_keep(self, root, spans):
+        if root.status == 'ERROR' or any(span.status == 'ERROR' for span in spans):
+            return True
+        if root.duration >= tracing_setting('SLOW_THRESHOLD'):
+            return True
+        return random.random() < tracing_setting('SAMPLE_RATE')
+
+    def on_end(self, span):
+        limit = tracing_setting('MAX_PENDING_TRACES')
+        with self._lock:
+            if span.trace_id in self._decisions and not span.is_local_root:
+                # Ends after its trace was decided (e.g. a write-behind task)
+                spans = [span] if self._decisions[span.trace_id] else []
+            else:
+                self._pending.setdefault(span.trace_id, []).append(span)
+                while len(self._pending) > limit:
+                    self._pending.popitem(last=False)
+                if not span.is_local_root:
+                    return
+                spans = self._pending.pop(span.trace_id)
+                keep = self.should_keep(span, spans)
+                self._decisions[span.trace_id] = keep
+                while len(self._decisions) > limit:
+                    self._decisions.popitem(last=False)
+                if not keep:
+                    return
+        if spans and self.exporter is not None:
+            self.exporter.export(spans)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = TailSampler(make_exporter())
+        return _sampler
+
+
+def set_exporter(exporter):
+    """Replace the exporter (None re-reads the settings)."""
+    global _sampler
+    with _sampler_lock:
+        _sampler = TailSampler(exporter) if exporter is not None else None
+
+
+@atexit.register
+def _flush_on_exit():
+    exporter = _sampler.exporter if _sampler is not None else None
+    if isinstance(exporter, BackgroundExporter):
+        # Bounded, so a wedged exporter cannot hold up shutdown
+        finished = threading.Thread(target=exporter.flush, daemon=True)
+        finished.start()
+        finished.join(timeout=5)
+
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, traceparent=None, **attributes):
+    """
+    Time the block as a span, a child of the current span if there is one.
+
+    Exceptions are recorded on the span and re-raised; a PipelineError is
+    recorded as a rejection rather than an error. ``traceparent``
+    continues a remote trace when starting a new local root.
+    """
+    if not tracing_setting('ENABLED'):
+        yield None
+        return
+
+    parent = _current_span.get()
+    if parent is not None:
+        new = Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+    else:
+        remote = parse_traceparent(traceparent)
+        trace_id, parent_id = remote or (f"{random.getrandbits(128):032x}", None)
+        new = Span(name, trace_id, parent_id, is_local_root=True, attributes=attributes)
+
+    token = _current_span.set(new)
+    try:
+        yield new
+    except PipelineError as e:
+        new.record_rejection(e)
+        raise
+    except BaseException as e:
+        new.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        new.end_ns = time.time_ns()
+        get_sampler().on_end(new)
+
+
+def wrap(fn):
+    """Bind ``fn`` to the current trace context, for running in another thread."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return run
+
+
+class TracingMiddleware:
+    """Open the root span for every request and report its trace id."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with span(f"{request.method} {request.path}",
+                  traceparent=request.headers.get('traceparent'),
+                  **{'http.method': request.method, 'http.target': request.path}) as root:
+            response = self.get_response(request)
+            if root is not None:
+                match = getattr(request, 'resolver_match', None)
+                if match is not None:
+                    root.name = f"{request.method} {match.route}"
+                    root.set_attribute('http.route', match.route)
+                root.set_attribute('http.status_code', response.status_code)
+                # 503 is deliberate load shedding (with Retry-After), not a failure
+                if response.status_code >= 500 and response.status_code != 503:
+                    root.set_error(f"HTTP {response.status_code}")
+                response['X-Trace-Id'] = root.trace_id
+        return response
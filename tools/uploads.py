@@ -0,0 +1,241 @@
+"""
+Resumable chunked uploads, modelled on the tus protocol.
+
+    POST  /api/uploads/                   Upload-Length, Upload-Metadata -> 201 + Location
+    HEAD  /api/uploads/<id>/              -> Upload-Offset, Upload-Length
+    PATCH /api/uploads/<id>/              Upload-Offset, Upload-Checksum, chunk body -> 204
+    POST  /api/uploads/<id>/finalize/     -> upload_id usable by every image endpoint
+
+Each PATCH must start at the current offset (409 with the real offset
+otherwise, so a client that lost a response can resume) and may carry a
+``Upload-Checksum: <sha256|sha1|md5> <base64 digest>`` that is verified
+before the offset advances (460 on mismatch). Chunks are streamed from the
+request straight to their offset in the upload's single file, so finalizing
+is a rename - nothing is reassembled or copied. Each request only holds a
+worker for one bounded chunk.
+
+Upload state lives in the coordination backend; the files live under
+MEDIA_ROOT, which must be shared (or uploads routed to one node) when
+several nodes serve the API.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import time
+import uuid
+
+from django.conf import settings
+
+from . import coordination, imaging
+from .exceptions import PipelineError
+from .pipeline import ALLOWED_EXTENSIONS, MAX_UPLOAD_SIZE
+
+
+UPLOAD_DEFAULTS = {
+    'MAX_LENGTH': 50 * 1024 * 1024,
+    'MAX_CHUNK': 8 * 1024 * 1024,
+    'TTL': 24 * 60 * 60,
+    # Finished uploads larger than the provider input limit are downscaled to this
+    'MAX_SIDE': 4096,
+}
+
+TUS_VERSION = '1.0.0'
+CHECKSUM_ALGORITHMS = {'sha256': hashlib.sha256, 'sha1': hashlib.sha1, 'md5': hashlib.md5}
+STREAM_BLOCK = 64 * 1024
+
+
+def upload_setting(name):
+    return getattr(settings, 'UPLOADS', {}).get(name, UPLOAD_DEFAULTS[name])
+
+
+class UploadError(PipelineError):
+    """Raised when an upload request cannot be applied."""
+
+
+def upload_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', 'resumable')
+
+
+def _key(upload_id):
+    backend = coordination.get_backend()
+    return backend, backend.key('upload', upload_id)
+
+
+def _save(state):
+    backend, key = _key(state['id'])
+    backend.set(key, state, upload_setting('TTL'))
+
+
+def parse_metadata(header):
+    """Decode a tus ``Upload-Metadata`` header (``key base64,key base64``)."""
+    metadata = {}
+    for pair in (header or '').split(','):
+        key, _, value = pair.strip().partition(' ')
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value).decode('utf-8') if value else ''
+            except (binascii.Error, UnicodeDecodeError):
+                raise UploadError('Upload-Metadata values must be base64')
+    return metadata
+
+
+def sweep():
+    """Delete upload files older than the TTL."""
+    cutoff = time.time() - upload_setting('TTL')
+    try:
+        entries = list(os.scandir(upload_dir()))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def create(length, filename, principal_id):
+    """Start an upload of ``length`` bytes; return its state."""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise UploadError(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}')
+    if not 0 < length <= upload_setting('MAX_LENGTH'):
+        raise UploadError(f"Upload-Length must be between 1 and {upload_setting('MAX_LENGTH')} bytes",
+                          status=413 if length > 0 else 400)
+
+    sweep()
+    os.makedirs(upload_dir(), exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(upload_dir(), f"{upload_id}.part")
+    # Reserve the full size up front so chunks can land at their offsets
+    with open(path, 'wb') as f:
+        f.truncate(length)
+
+    state = {
+        'id': upload_id,
+        'length': length,
+        'offset': 0,
+        'filename': os.path.basename(filename),
+        'ext': ext,
+        'principal': principal_id,
+        'path': path,
+        'complete': False,
+        'created_at': time.time(),
+    }
+    _save(state)
+    return state
+
+
+def get(upload_id, principal_id):
+    backend, key = _key(upload_id)
+    state = backend.get(key)
+    if state is None or state['principal'] != principal_id:
+        raise UploadError('Upload not found or expired', status=404)
+    return state
+
+
+def _parse_checksum(header):
+    if not header:
+        return None
+    algorithm, _, encoded = header.strip().partition(' ')
+    if algorithm.lower() not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f'Unsupported checksum algorithm. Allowed: {", ".join(CHECKSUM_ALGORITHMS)}')
+    try:
+        expected = base64.b64decode(encoded, validate=True)
+    except binascii.Error:
+        raise UploadError('Upload-Checksum digest must be base64')
+    return CHECKSUM_ALGORITHMS[algorithm.lower()](), expected
+
+
+def append(upload_id, principal_id, offset, stream, size, checksum=None):
+    """
+    Write one chunk of ``size`` bytes read from ``stream`` at ``offset``;
+    return the new offset. Concurrent PATCHes to one upload are serialized.
+    """
+    backend = coordination.get_backend()
+    with backend.lock(f"upload:{upload_id}", ttl=60, timeout=10):
+        state = get(upload_id, principal_id)
+        if state['complete']:
+            raise UploadError('Upload is already finalized', status=409)
+        if offset != state['offset']:
+            raise UploadError('Upload-Offset does not match', status=409,
+                              headers={'Upload-Offset': state['offset']})
+        if size > upload_setting('MAX_CHUNK'):
+            raise UploadError(f"Chunks are limited to {upload_setting('MAX_CHUNK')} bytes", status=413)
+        if offset + size > state['length']:
+            raise UploadError('Chunk runs past Upload-Length', status=413)
+
+        check = _parse_checksum(checksum)
+        written = 0
+        with open(state['path'], 'r+b') as f:
+            f.seek(offset)
+            while written < size:
+                block = stream.read(min(STREAM_BLOCK, size - written))
+                if not block:
+                    break
+                if check:
+                    check[0].update(block)
+                f.write(block)
+                written += len(block)
+
+        if check and check[0].digest() != check[1]:
+            # The offset is not advanced, so the chunk can simply be resent
+            raise UploadError('Checksum mismatch', status=460, headers={'Upload-Offset': state['offset']})
+
+        state['offset'] = offset + written
+        _save(state)
+        return state['offset']
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(STREAM_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finalize(upload_id, principal_id):
+    """Check the finished upload is a usable image and make it available by id."""
+    with coordination.get_backend().lock(f"upload:{upload_id}", ttl=60, timeout=10):
+        return _finalize(get(upload_id, principal_id))
+
+
+def _finalize(state):
+    upload_id = state['id']
+    if state['complete']:
+        return state
+    if state['offset'] != state['length']:
+        raise UploadError(f"Upload is incomplete ({state['offset']} of {state['length']} bytes)", status=409,
+                          headers={'Upload-Offset': state['offset']})
+
+    final_path = os.path.join(upload_dir(), f"{upload_id}{state['ext']}")
+    try:
+        if state['length'] > MAX_UPLOAD_SIZE:
+            # Larger than the provider accepts: keep a downscaled copy instead
+            data, ext, _ = imaging.normalize(state['path'], upload_setting('MAX_SIDE'))
+            if len(data) > MAX_UPLOAD_SIZE:
+                raise UploadError('Image is still over 10MB after downscaling.', status=413)
+            final_path = os.path.join(upload_dir(), f"{upload_id}{ext}")
+            with open(final_path, 'wb') as f:
+                f.write(data)
+            os.remove(state['path'])
+        else:
+            imaging.verify(state['path'])
+            os.replace(state['path'], final_path)
+    except OSError:
+        raise UploadError('Could not read the image. Please upload a valid JPG, PNG or WEBP file.')
+
+    state.update(path=final_path, complete=True, size=os.path.getsize(final_path), sha256=_sha256(final_path))
+    _save(state)
+    return state
+
+
+def resolve(upload_id, principal_id):
+    """Return the state of a finalized upload owned by the principal."""
+    state = get(os.path.basename(upload_id), principal_id)
+    if not state['complete'] or not os.path.exists(state['path']):
+        raise UploadError('Upload is not finalized', status=409)
+    return state
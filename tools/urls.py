@@ -10,10 +10,21 @@ urlpatterns = [
     path('product-ad-enhancer/', views.product_ad_enhancer, name='product_ad_enhancer'),
     path('image-editor/', views.image_editor, name='image_editor'),
     path('youtube-thumbnail/', views.youtube_thumbnail_generator, name='youtube_thumbnail_generator'),
+    path('health/ready/', views.readiness, name='readiness'),
     # API endpoints
     path('api/generate-text-to-image/', views.generate_text_to_image, name='generate_text_to_image_api'),
     path('api/enhance-product-ad/', views.generate_product_ad_enhancer, name='generate_product_ad_enhancer_api'),
     path('api/generate-sketch-to-image/', views.generate_sketch_to_image, name='generate_sketch_to_image_api'),
     path('api/edit-image/', views.api_edit_image, name='api_edit_image'),
     path('api/generate-youtube-thumbnail/', views.api_generate_youtube_thumbnail, name='api_generate_youtube_thumbnail'),
+    path('api/tools/<slug:tool_name>/', views.api_tool, name='api_tool'),
+    path('api/references/', views.register_reference, name='register_reference'),
+    path('api/uploads/', views.upload_create, name='upload_create'),
+    path('api/uploads/<slug:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('api/uploads/<slug:upload_id>/finalize/', views.upload_finalize, name='upload_finalize'),
+    path('api/jobs/<slug:job_id>/', views.job_status, name='job_status'),
+    path('api/stats/', views.stats, name='stats'),
+    path('api/bulk/product-ad-enhancer/', views.bulk_enhance, name='bulk_enhance'),
+    path('api/bulk/<slug:run_id>/', views.bulk_run, name='bulk_run'),
+    path('api/bulk/<slug:run_id>/results.zip', views.bulk_results, name='bulk_results'),
 ]
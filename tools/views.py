@@ -1,537 +1,308 @@
+import os
+from functools import wraps
+
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.urls import reverse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.views.decorators.cache import cache_page
 from django.views.decorators.csrf import csrf_exempt
-from django.conf import settings
-import os
-import uuid
-from SimplerLLM import ImageGenerator, ImageProvider, ImageSize
+
+from . import bulk, coordination, overload, pipeline, quotas, references, scheduler, uploads
+from .exceptions import PipelineError
+from . import specs  # noqa: F401 - registers the tool specs
+
+
+_page_cache = cache_page(settings.PAGE_CACHE_TIMEOUT)
 
 
+def static_page(view):
+    """
+    Serve a fully static tool page from the page cache. The visitor's page
+    cookie (see scheduler.issue_page_token) is set after the cache, so it is
+    never stored in or served from it.
+    """
+    cached = _page_cache(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = cached(request, *args, **kwargs)
+        scheduler.issue_page_token(request, response)
+        return response
+    return wrapper
+
+
+@static_page
 def home(request):
     """Home page with cards for all three AI image tools."""
     return render(request, 'home.html')
 
 
+@static_page
 def text_to_image(request):
     """Text to Image tool page."""
     return render(request, 'text_to_image.html')
 
 
+@static_page
 def sketch_to_image(request):
     """Sketch to Image tool page."""
     return render(request, 'sketch_to_image.html')
 
 
+@static_page
 def product_ad_enhancer(request):
     """Product Ad Enhancer tool page."""
     return render(request, 'product_ad_enhancer.html')
 
 
+@static_page
+def image_editor(request):
+    """Image Editor tool page."""
+    return render(request, 'image_editor.html')
+
+
+@static_page
+def youtube_thumbnail_generator(request):
+    """YouTube Thumbnail Generator tool page."""
+    return render(request, 'youtube_thumbnail.html')
+
+
+# API endpoints - each one runs its registered spec through the shared
+# generation pipeline (see tools/pipeline.py and tools/specs.py).
+generate_text_to_image = pipeline.api_view('text_to_image')
+generate_product_ad_enhancer = pipeline.api_view('product_ad_enhancer')
+generate_sketch_to_image = pipeline.api_view('sketch_to_image')
+api_edit_image = pipeline.api_view('edit_image')
+api_generate_youtube_thumbnail = pipeline.api_view('youtube_thumbnail')
+
+
 @csrf_exempt
-def generate_text_to_image(request):
-    """API endpoint to generate image from text using SimplerLLM."""
-    if request.method != 'POST':
-        return JsonResponse({'error': 'Method not allowed'}, status=405)
+def api_tool(request, tool_name):
+    """API endpoint that serves any registered tool spec by name."""
+    spec = pipeline.get_tool(tool_name)
+    if spec is None:
+        return JsonResponse({'error': 'Unknown tool'}, status=404)
+    return pipeline.handle(request, spec)
+
+
+def readiness(request):
+    """Readiness probe - 503 until this worker has finished warming up."""
+    from . import warmup
+    snapshot = warmup.state.snapshot()
+    return JsonResponse(snapshot, status=200 if snapshot['ready'] else 503)
+
+
+def job_status(request, job_id):
+    """API endpoint reporting the state of a generation job from any node."""
+    state = coordination.get_backend().get_job_state(job_id)
+    if state is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(state)
+
+
+def generated_image(request, filename):
+    """Serve a generated image, fetching it from the shared result index if
+    another node produced it."""
+    path = pipeline.ensure_local_result(os.path.basename(filename))
+    if path is None:
+        raise Http404('Image not found')
+    return FileResponse(open(path, 'rb'), content_type='image/png')
 
-    try:
-        # Get parameters from request
-        import json
-        data = json.loads(request.body)
-        prompt = data.get('prompt', '').strip()
-        size = data.get('size', 'square').lower()
-
-        # Validate prompt
-        if not prompt:
-            return JsonResponse({'error': 'Prompt is required'}, status=400)
-
-        # Map size string to ImageSize enum
-        size_map = {
-            'square': ImageSize.SQUARE,
-            'horizontal': ImageSize.HORIZONTAL,
-            'vertical': ImageSize.VERTICAL
-        }
-        image_size = size_map.get(size, ImageSize.SQUARE)
-
-        # Create image generator instance
-        img_gen = ImageGenerator.create(provider=ImageProvider.GOOGLE_GEMINI)
-
-        # Generate unique filename
-        filename = f"text_to_image_{uuid.uuid4().hex}.png"
-        output_path = os.path.join(settings.MEDIA_ROOT, 'generated_images', filename)
-
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        # Generate image
-        img_gen.generate_image(
-            prompt=prompt,
-            size=image_size,
-            output_format="file",
-            output_path=output_path
-        )
-
-        # Return image URL
-        image_url = f"{settings.MEDIA_URL}generated_images/{filename}"
-        return JsonResponse({
-            'success': True,
-            'image_url': image_url,
-            'filename': filename
-        })
-
-    except Exception as e:
-        return JsonResponse({
-            'error': str(e),
-            'success': False
-        }, status=500)
+
+def stats(request):
+    """Per-tool pipeline counters, per-class scheduler queues and overload state for tuning."""
+    return JsonResponse({
+        'pipeline': pipeline.metrics.snapshot(),
+        'scheduler': pipeline.get_scheduler().snapshot(),
+        'overload': overload.controller.snapshot(),
+    })
+
+
+def _bulk_principal(request):
+    principal = quotas.authenticate(request)
+    if principal.api_key_id is None:
+        raise PipelineError('Bulk imports require an API key', status=401)
+    return principal
+
+
+def _bulk_state(run):
+    state = dict(run.state)
+    state.pop('import_root', None)
+    state.pop('csv_base', None)
+    state['status_url'] = reverse('tools:bulk_run', args=[run.run_id])
+    if os.path.exists(run.results_path):
+        state['results_url'] = reverse('tools:bulk_results', args=[run.run_id])
+    return state
 
 
 @csrf_exempt
-def generate_product_ad_enhancer(request):
-    """API endpoint to enhance product photos using SimplerLLM."""
+def bulk_enhance(request):
+    """API endpoint starting a bulk Product Ad Enhancer run from a ZIP or CSV upload."""
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        principal = _bulk_principal(request)
+        limit = bulk.bulk_setting('MAX_UPLOAD_BYTES')
+        # Refused before Django spools the upload to disk
+        content_length = request.META.get('CONTENT_LENGTH') or ''
+        if content_length.isdigit() and int(content_length) > limit:
+            raise PipelineError(f"Uploads are limited to {limit // (1024 * 1024)}MB", status=413)
+        if 'file' not in request.FILES:
+            raise PipelineError('No ZIP or CSV file uploaded')
+        upload = request.FILES['file']
+        import_root = bulk.bulk_setting('IMPORT_ROOT')
+        if upload.name.lower().endswith('.csv') and not import_root:
+            raise PipelineError('CSV imports are not enabled on this server; upload a ZIP instead')
+        preset = request.POST.get('preset', '').strip().lower() or None
+        run = bulk.BulkRun.create(upload.name, upload.chunks(), principal.id, preset,
+                                  import_root=import_root)
+        bulk.start(run, principal)
+    except PipelineError as e:
+        return JsonResponse({'error': e.message}, status=e.status, headers=e.headers)
+    return JsonResponse(_bulk_state(run), status=202)
 
+
+@csrf_exempt
+def bulk_run(request, run_id):
+    """API endpoint reporting a bulk run (GET) or resuming it (POST)."""
     try:
-        # Check if file was uploaded
-        if 'image' not in request.FILES:
-            return JsonResponse({'error': 'No image file uploaded'}, status=400)
-
-        uploaded_file = request.FILES['image']
-
-        # Validate file type
-        allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
-        file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-        if file_ext not in allowed_extensions:
-            return JsonResponse({
-                'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'
-            }, status=400)
-
-        # Validate file size (max 10MB)
-        max_size = 10 * 1024 * 1024  # 10MB in bytes
-        if uploaded_file.size > max_size:
-            return JsonResponse({
-                'error': 'File size too large. Maximum size is 10MB.'
-            }, status=400)
-
-        # Create upload directory
-        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-
-        # Save uploaded file temporarily
-        temp_filename = f"upload_{uuid.uuid4().hex}{file_ext}"
-        temp_path = os.path.join(upload_dir, temp_filename)
-
-        with open(temp_path, 'wb+') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
-
-        # Create image generator instance
-        img_gen = ImageGenerator.create(provider=ImageProvider.GOOGLE_GEMINI)
-
-        # Generate output filename
-        output_filename = f"product_enhancer_{uuid.uuid4().hex}.png"
-        output_path = os.path.join(settings.MEDIA_ROOT, 'generated_images', output_filename)
-
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        # Professional studio enhancement prompt
-        enhancement_prompt = """Transform this product photo into a professional studio shot with high-end commercial photography quality.
-
-Apply these enhancements:
-- Professional three-point studio lighting (key light, fill light, rim light)
-- Clean, minimalist background (pure white or subtle gradient)
-- Sharp focus on the product with perfect clarity
-- Remove any distractions, clutter, or background objects
-- Enhance product details, colors, and textures
-- Add natural shadows and reflections for depth
-- Create a high-end, luxury feel
-- Make it look like a professional advertisement or e-commerce product photo
-
-Maintain the product's exact appearance while elevating the overall presentation to studio quality."""
-
-        # Enhance the product image
-        img_gen.edit_image(
-            image_source=temp_path,
-            edit_prompt=enhancement_prompt,
-            size=ImageSize.HORIZONTAL,
-            output_format="file",
-            output_path=output_path,
-            model="gemini-3-pro-image-preview"
-        )
-
-        # Clean up temporary file
+        principal = _bulk_principal(request)
+    except PipelineError as e:
+        return JsonResponse({'error': e.message}, status=e.status, headers=e.headers)
+    run = bulk.get_run(run_id)
+    if run is None or run.state['principal'] != principal.id:
+        return JsonResponse({'error': 'Run not found'}, status=404)
+
+    if request.method == 'POST':
+        # Refused while another worker holds the run's lease; an orphaned
+        # run (lease lapsed after a restart) is taken over
         try:
-            os.remove(temp_path)
-        except:
-            pass
-
-        # Return enhanced image URL
-        image_url = f"{settings.MEDIA_URL}generated_images/{output_filename}"
-        return JsonResponse({
-            'success': True,
-            'image_url': image_url,
-            'filename': output_filename
-        })
-
-    except Exception as e:
-        # Clean up temp file if it exists
-        try:
-            if 'temp_path' in locals():
-                os.remove(temp_path)
-        except:
-            pass
+            bulk.start(run, principal)
+        except PipelineError as e:
+            return JsonResponse({'error': e.message}, status=e.status, headers=e.headers)
+        return JsonResponse(_bulk_state(run), status=202)
+    return JsonResponse(_bulk_state(run))
+
 
-        return JsonResponse({
-            'error': str(e),
-            'success': False
-        }, status=500)
+def bulk_results(request, run_id):
+    """Download the results ZIP (images plus manifest.csv) of a bulk run."""
+    try:
+        principal = _bulk_principal(request)
+    except PipelineError as e:
+        return JsonResponse({'error': e.message}, status=e.status, headers=e.headers)
+    run = bulk.get_run(run_id)
+    if run is None or run.state['principal'] != principal.id or not os.path.exists(run.results_path):
+        raise Http404('Results not found')
+    return FileResponse(open(run.results_path, 'rb'), as_attachment=True,
+                        filename=f"enhanced_{run.run_id}.zip", content_type='application/zip')
 
 
 @csrf_exempt
-def generate_sketch_to_image(request):
-    """API endpoint to transform sketches into realistic images using SimplerLLM."""
+def register_reference(request):
+    """
+    API endpoint registering a reference image once for reuse by id. The id
+    only resolves for the caller that registered it, and registrations count
+    against the caller's request rate and concurrency limits.
+    """
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
-
     try:
-        # Check if file was uploaded
-        if 'image' not in request.FILES:
-            return JsonResponse({'error': 'No sketch image uploaded'}, status=400)
-
-        uploaded_file = request.FILES['image']
-
-        # Validate file type
-        allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
-        file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-        if file_ext not in allowed_extensions:
-            return JsonResponse({
-                'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'
-            }, status=400)
-
-        # Validate file size (max 10MB)
-        max_size = 10 * 1024 * 1024  # 10MB in bytes
-        if uploaded_file.size > max_size:
-            return JsonResponse({
-                'error': 'File size too large. Maximum size is 10MB.'
-            }, status=400)
-
-        # Create upload directory
-        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-
-        # Save uploaded sketch temporarily
-        temp_filename = f"sketch_{uuid.uuid4().hex}{file_ext}"
-        temp_path = os.path.join(upload_dir, temp_filename)
-
-        with open(temp_path, 'wb+') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
-
-        # Create image generator instance
-        img_gen = ImageGenerator.create(provider=ImageProvider.GOOGLE_GEMINI)
-
-        # Generate output filename
-        output_filename = f"sketch_to_image_{uuid.uuid4().hex}.png"
-        output_path = os.path.join(settings.MEDIA_ROOT, 'generated_images', output_filename)
-
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        # Sketch to realistic transformation prompt
-        transformation_prompt = """Transform this hand-drawn sketch into a photorealistic, high-quality photograph.
-Maintain the exact composition, subject matter, and layout from the sketch, but enhance it with:
-- Realistic details and textures
-- Professional lighting and shadows
-- Natural, vibrant colors
-- High-definition quality
-- Photographic depth and clarity
-Make it look like a professional photograph while staying true to the original sketch's intent."""
-
-        # Generate realistic image from sketch
-        img_gen.generate_image(
-            prompt=transformation_prompt,
-            reference_images=[temp_path],
-            size=ImageSize.HORIZONTAL,
-            output_format="file",
-            output_path=output_path,
-            model="gemini-3-pro-image-preview"
-        )
-
-        # Clean up temporary file
+        principal = quotas.authenticate(request)
+        quotas.accountant.admit(principal, 0)
         try:
-            os.remove(temp_path)
-        except:
-            pass
-
-        # Return generated image URL
-        image_url = f"{settings.MEDIA_URL}generated_images/{output_filename}"
-        return JsonResponse({
-            'success': True,
-            'image_url': image_url,
-            'filename': output_filename
-        })
-
-    except Exception as e:
-        # Clean up temp file if it exists
-        try:
-            if 'temp_path' in locals():
-                os.remove(temp_path)
-        except:
-            pass
+            if 'image' not in request.FILES:
+                raise PipelineError('No reference image uploaded')
+            upload = request.FILES['image']
+            pipeline.validate_upload(upload)
+            try:
+                entry = references.register(b''.join(upload.chunks()), principal.id)
+            except OSError:
+                raise PipelineError('Could not read the image. Please upload a valid JPG, PNG or WEBP file.')
+        finally:
+            quotas.accountant.release(principal, 0)
+    except PipelineError as e:
+        return JsonResponse({'error': e.message}, status=e.status, headers=e.headers)
 
-        return JsonResponse({
-            'error': str(e),
-            'success': False
-        }, status=500)
+    return JsonResponse({
+        'success': True,
+        'reference_id': entry['id'],
+        'width': entry['width'],
+        'height': entry['height'],
+        'bytes': len(entry['data']),
+        'expires_in': references.reference_setting('TTL'),
+    }, status=201)
 
 
-def image_editor(request):
-    """Image Editor tool page."""
-    return render(request, 'image_editor.html')
+def _upload_response(data=None, status=200, headers=None):
+    response = JsonResponse(data, status=status) if data is not None else HttpResponse(status=status)
+    response['Tus-Resumable'] = uploads.TUS_VERSION
+    response['Cache-Control'] = 'no-store'
+    for header, value in (headers or {}).items():
+        response[header] = str(value)
+    return response
+
+
+def _upload_error(e):
+    return _upload_response({'error': e.message}, status=e.status, headers=e.headers)
 
 
 @csrf_exempt
-def api_edit_image(request):
-    """API endpoint to edit images using AI with free-form text prompts."""
+def upload_create(request):
+    """API endpoint starting a resumable upload (tus-style creation)."""
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
-
     try:
-        # Get the edit prompt
-        edit_prompt = request.POST.get('prompt', '').strip()
-
-        if not edit_prompt:
-            return JsonResponse({'error': 'Edit prompt is required'}, status=400)
-
-        # Determine the source image - either a new upload or a previously edited image
-        source_image_path = None
-        temp_path = None
-
-        # Check if this is a new upload
-        if 'image' in request.FILES:
-            uploaded_file = request.FILES['image']
-
-            # Validate file type
-            allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
-            file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-            if file_ext not in allowed_extensions:
-                return JsonResponse({
-                    'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'
-                }, status=400)
-
-            # Validate file size (max 10MB)
-            max_size = 10 * 1024 * 1024  # 10MB in bytes
-            if uploaded_file.size > max_size:
-                return JsonResponse({
-                    'error': 'File size too large. Maximum size is 10MB.'
-                }, status=400)
-
-            # Create upload directory
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
-            os.makedirs(upload_dir, exist_ok=True)
-
-            # Save uploaded file temporarily
-            temp_filename = f"edit_upload_{uuid.uuid4().hex}{file_ext}"
-            temp_path = os.path.join(upload_dir, temp_filename)
-
-            with open(temp_path, 'wb+') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
-
-            source_image_path = temp_path
-
-        # Check if this is editing a previously generated image
-        elif 'current_image' in request.POST:
-            current_image_filename = request.POST.get('current_image', '').strip()
-
-            if current_image_filename:
-                # Construct the full path to the previously generated image
-                source_image_path = os.path.join(
-                    settings.MEDIA_ROOT,
-                    'generated_images',
-                    current_image_filename
-                )
-
-                # Verify the file exists
-                if not os.path.exists(source_image_path):
-                    return JsonResponse({
-                        'error': 'Referenced image not found. Please upload a new image.'
-                    }, status=400)
-
-        # If no source image was provided
-        if not source_image_path:
-            return JsonResponse({
-                'error': 'No image provided. Please upload an image or reference an existing one.'
-            }, status=400)
-
-        # Create image generator instance
-        img_gen = ImageGenerator.create(provider=ImageProvider.GOOGLE_GEMINI)
-
-        # Generate output filename
-        output_filename = f"edited_image_{uuid.uuid4().hex}.png"
-        output_path = os.path.join(settings.MEDIA_ROOT, 'generated_images', output_filename)
-
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        # Edit the image with the user's prompt
-        img_gen.edit_image(
-            image_source=source_image_path,
-            edit_prompt=edit_prompt,
-            size=ImageSize.HORIZONTAL,
-            output_format="file",
-            output_path=output_path,
-            model="gemini-3-pro-image-preview"
-        )
-
-        # Clean up temporary file if it was uploaded
-        if temp_path:
-            try:
-                os.remove(temp_path)
-            except:
-                pass
-
-        # Return edited image URL
-        image_url = f"{settings.MEDIA_URL}generated_images/{output_filename}"
-        return JsonResponse({
-            'success': True,
-            'image_url': image_url,
-            'filename': output_filename
-        })
-
-    except Exception as e:
-        # Clean up temp file if it exists
-        if 'temp_path' in locals() and temp_path:
-            try:
-                os.remove(temp_path)
-            except:
-                pass
+        principal = quotas.authenticate(request)
+        try:
+            length = int(request.headers.get('Upload-Length', ''))
+        except ValueError:
+            raise uploads.UploadError('Upload-Length header is required')
+        metadata = uploads.parse_metadata(request.headers.get('Upload-Metadata'))
+        state = uploads.create(length, metadata.get('filename', ''), principal.id)
+    except PipelineError as e:
+        return _upload_error(e)
 
-        return JsonResponse({
-            'error': str(e),
-            'success': False
-        }, status=500)
+    location = reverse('tools:upload_detail', args=[state['id']])
+    return _upload_response({'upload_id': state['id'], 'offset': 0, 'url': location}, status=201,
+                            headers={'Location': location, 'Upload-Offset': 0})
 
 
-def youtube_thumbnail_generator(request):
-    """YouTube Thumbnail Generator tool page."""
-    return render(request, 'youtube_thumbnail.html')
+@csrf_exempt
+def upload_detail(request, upload_id):
+    """HEAD reports the offset of a resumable upload; PATCH appends a chunk."""
+    try:
+        principal = quotas.authenticate(request)
+        if request.method == 'HEAD':
+            state = uploads.get(upload_id, principal.id)
+            return _upload_response(headers={'Upload-Offset': state['offset'], 'Upload-Length': state['length']})
+        if request.method != 'PATCH':
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+        if request.content_type != 'application/offset+octet-stream':
+            raise uploads.UploadError('Content-Type must be application/offset+octet-stream', status=415)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise uploads.UploadError('Upload-Offset header is required')
+        # Stream the body straight to disk instead of buffering request.body
+        offset = uploads.append(upload_id, principal.id, offset, request, size,
+                                checksum=request.headers.get('Upload-Checksum'))
+    except PipelineError as e:
+        return _upload_error(e)
+    return _upload_response(status=204, headers={'Upload-Offset': offset})
 
 
 @csrf_exempt
-def api_generate_youtube_thumbnail(request):
-    """API endpoint to generate YouTube thumbnails with reference images."""
+def upload_finalize(request, upload_id):
+    """Finish a resumable upload; its id then works as ``upload_id`` on every image endpoint."""
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
-
     try:
-        # Check if file was uploaded
-        if 'image' not in request.FILES:
-            return JsonResponse({'error': 'No reference image uploaded'}, status=400)
-
-        # Get user's custom prompt
-        user_prompt = request.POST.get('prompt', '').strip()
-        if not user_prompt:
-            return JsonResponse({'error': 'Thumbnail description is required'}, status=400)
-
-        uploaded_file = request.FILES['image']
-
-        # Validate file type
-        allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
-        file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-        if file_ext not in allowed_extensions:
-            return JsonResponse({
-                'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'
-            }, status=400)
-
-        # Validate file size (max 10MB)
-        max_size = 10 * 1024 * 1024  # 10MB in bytes
-        if uploaded_file.size > max_size:
-            return JsonResponse({
-                'error': 'File size too large. Maximum size is 10MB.'
-            }, status=400)
-
-        # Create upload directory
-        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-
-        # Save uploaded file temporarily
-        temp_filename = f"thumbnail_ref_{uuid.uuid4().hex}{file_ext}"
-        temp_path = os.path.join(upload_dir, temp_filename)
-
-        with open(temp_path, 'wb+') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
-
-        # Create image generator instance
-        img_gen = ImageGenerator.create(provider=ImageProvider.GOOGLE_GEMINI)
-
-        # Generate output filename
-        output_filename = f"youtube_thumbnail_{uuid.uuid4().hex}.png"
-        output_path = os.path.join(settings.MEDIA_ROOT, 'generated_images', output_filename)
-
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        # Create optimized YouTube thumbnail prompt combining user input with best practices
-        optimized_prompt = f"""Create a professional, high-CTR YouTube thumbnail featuring the person from the reference image.
-
-User's Vision: {user_prompt}
-
-Technical Requirements:
-- Subject: The person from the reference image with an engaging, expressive face
-- Composition: Strategic positioning with space for potential text overlay
-- Lighting: Dramatic professional lighting with high contrast and rim lights
-- Colors: Vibrant, bold colors that pop on screen using complementary color schemes
-- Background: Dynamic and visually interesting, not cluttered, with depth
-- Quality: High-definition, sharp focus, professional photography quality
-- Style: Eye-catching, attention-grabbing, optimized for mobile viewing
-- Expression: Genuine emotion that matches the video concept
-
-YouTube Optimization:
-- Must grab attention instantly in a crowded feed
-- Clear and readable even at small thumbnail sizes (mobile optimization)
-- Single strong focal point (the person's face and expression)
-- High contrast for maximum visibility
-- Professional and trustworthy appearance
-- Designed to maximize click-through rate
-
-Create a thumbnail that combines the user's vision with professional YouTube thumbnail best practices."""
-
-        # Generate YouTube thumbnail with reference image
-        img_gen.generate_image(
-            prompt=optimized_prompt,
-            reference_images=[temp_path],
-            size=ImageSize.HORIZONTAL,  # 16:9 aspect ratio for YouTube (1280x720)
-            output_format="file",
-            output_path=output_path,
-            model="gemini-3-pro-image-preview"
-        )
-
-        # Clean up temporary file
-        try:
-            os.remove(temp_path)
-        except:
-            pass
-
-        # Return generated thumbnail URL
-        image_url = f"{settings.MEDIA_URL}generated_images/{output_filename}"
-        return JsonResponse({
-            'success': True,
-            'image_url': image_url,
-            'filename': output_filename
-        })
-
-    except Exception as e:
-        # Clean up temp file if it exists
-        try:
-            if 'temp_path' in locals():
-                os.remove(temp_path)
-        except:
-            pass
-
-        return JsonResponse({
-            'error': str(e),
-            'success': False
-        }, status=500)
+        principal = quotas.authenticate(request)
+        state = uploads.finalize(upload_id, principal.id)
+    except PipelineError as e:
+        return _upload_error(e)
+    return _upload_response({'success': True, 'upload_id': state['id'], 'size': state['size'],
+                             'sha256': state['sha256']})
@@ -0,0 +1,170 @@
+"""
+Worker warm-up, started only by the serving entry points: the WSGI and ASGI
+modules (which runserver also loads) and serve_prefork, which does the
+import-time steps in the parent before forking and the provider steps in
+each child. Management commands, shells and scripts
+that merely call django.setup() never warm up.
+
+A cold worker pays for heavy imports, template compilation and building
+the image generator on its first request. Warm-up does that work in a
+background thread at startup and records its progress so the readiness
+endpoint can keep load balancers away until the worker is warm.
+
+No provider connection is kept open: SimplerLLM creates a new genai client
+for every call, so the first real request still pays its own connection
+setup. The optional health probe only checks that the provider answers.
+"""
+
+import importlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+WARMUP_DEFAULTS = {
+    'ENABLED': True,
+    # Check the provider answers a cheap metadata request (the connection is not kept)
+    'HEALTH_PROBE': False,
+    'PROBE_MODEL': 'gemini-2.5-flash-image',
+}
+
+HEAVY_MODULES = [
+    'PIL.Image',
+    'PIL.ImageDraw',
+    'google.genai',
+    'SimplerLLM',
+    'SimplerLLM.image.generation.wrappers.google_wrapper',
+]
+
+PAGE_TEMPLATES = [
+    'home.html',
+    'text_to_image.html',
+    'sketch_to_image.html',
+    'product_ad_enhancer.html',
+    'image_editor.html',
+    'youtube_thumbnail.html',
+]
+
+
+def warmup_setting(name):
+    return getattr(settings, 'WARMUP', {}).get(name, WARMUP_DEFAULTS[name])
+
+
+class WarmupState:
+    """Thread-safe record of which warm-up steps have finished."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+        self.steps = {}
+        self.errors = {}
+
+    def start(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.finished_at = None
+            self.steps = {}
+            self.errors = {}
+
+    def step_done(self, name, seconds):
+        with self._lock:
+            self.steps[name] = round(seconds, 3)
+
+    def step_failed(self, name, error):
+        with self._lock:
+            self.errors[name] = str(error)
+
+    def finish(self):
+        with self._lock:
+            self.finished_at = time.time()
+
+    @property
+    def ready(self):
+        with self._lock:
+            return self.finished_at is not None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'ready': self.finished_at is not None,
+                'steps': dict(self.steps),
+                'errors': dict(self.errors),
+            }
+
+
+state = WarmupState()
+
+
+def preload_modules():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+
+def compile_templates():
+    """Compile and render each page so the cached loader and URL resolver are hot."""
+    from django.template.loader import get_template
+    from django.test import RequestFactory
+
+    request = RequestFactory().get('/')
+    for name in PAGE_TEMPLATES:
+        get_template(name).render({}, request)
+
+
+def prepare_provider():
+    """Build the shared image generator; this opens no provider connection."""
+    from . import pipeline
+    pipeline.get_image_generator()
+
+
+def probe_provider():
+    from google import genai
+
+    api_key = os.getenv('GEMINI_API_KEY', '')
+    if not api_key:
+        raise RuntimeError('GEMINI_API_KEY is not set')
+    genai.Client(api_key=api_key).models.get(model=warmup_setting('PROBE_MODEL'))
+
+
+def warm_up(provider=True):
+    """
+    Run every warm-up step, recording timings and failures in ``state``.
+    ``provider=False`` skips the provider client and probe, whose sockets
+    must not be shared with forked children.
+    """
+    steps = [
+        ('modules', preload_modules),
+        ('templates', compile_templates),
+    ]
+    if provider:
+        steps.append(('provider', prepare_provider))
+        if warmup_setting('HEALTH_PROBE'):
+            steps.append(('health_probe', probe_provider))
+
+    state.start()
+    for name, step in steps:
+        started = time.monotonic()
+        try:
+            step()
+        except Exception as e:
+            # A failed step should not keep the worker out of rotation forever
+            logger.warning('Warm-up step %s failed: %s', name, e)
+            state.step_failed(name, e)
+        else:
+            state.step_done(name, time.monotonic() - started)
+    state.finish()
+
+
+def start():
+    """Kick off warm-up in a daemon thread; called by the serving entry points."""
+    if not warmup_setting('ENABLED'):
+        state.finish()
+        return None
+    thread = threading.Thread(target=warm_up, name='tools-warmup', daemon=True)
+    thread.start()
+    return thread